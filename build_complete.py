@@ -182,7 +182,12 @@ def build_executable():
         "tkinter", "tkinter.ttk",
         "tkinter.filedialog", "tkinter.scrolledtext", "tkinter.messagebox",
         # Custom modules
-        "script", "ffmpeg_helper"
+        "script", "ffmpeg_helper", "media_info", "probe_cache", "mkv_reader", "prefetch",
+        "job_scheduler", "staging", "mkv_edit",
+        "mkv_subtitles", "ffmpeg_progress", "process_engine",
+        "job_watchdog", "planner", "fingerprint", "history_store",
+        "log_writer", "scan_journal", "library_walker",
+        "folder_watcher", "rate_limiter", "remote_log", "sync_outbox"
     ]
     for imp in hidden_imports:
         pyinstaller_args.extend(["--hidden-import", imp])
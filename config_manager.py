@@ -15,6 +15,46 @@ DEFAULT_CONFIG: Dict[str, Any] = {
     "logs_dir": "logs",
     "subtitle_dir": "subtitles",
     "token": "",
+    "remote_batch_commits": True,
+    "remote_batch_size": 0,
+    "github_upload_workers": 4,
+    "github_max_retries": 5,
+    "github_timeout": 60,
+    "github_writes_per_minute": 70,
+    "log_segment_max_entries": 2000,
+    "remote_flush_interval": 300,
+    "probe_cache": True,
+    "probe_cache_max_entries": 50000,
+    "native_probe": True,
+    "prefetch_workers": 2,
+    "prefetch_depth": 4,
+    "single_pass": True,
+    "jobs": 1,
+    "jobs_per_device": 1,
+    "staging": "auto",
+    "output_mode": "remux",
+    "native_subtitles": True,
+    "ffmpeg_progress": True,
+    "stall_timeout": 300,
+    "job_budget_factor": 4.0,
+    "job_budget_min": 900,
+    "job_budget_mb_per_s": 10,
+    "plan_mb_per_s": 80,
+    "fingerprint_cache": True,
+    "fingerprint_segment_uid": True,
+    "log_batch_size": 50,
+    "log_flush_interval": 5,
+    "log_fsync": "batch",
+    "scan_journal": True,
+    "recursive": False,
+    "scan_include": [],
+    "scan_exclude": [],
+    "scan_max_depth": None,
+    "scan_workers": 8,
+    "watch_folders": [],
+    "watch_mode": "auto",
+    "watch_settle_seconds": 10,
+    "watch_poll_interval": 30,
 }
 
 
@@ -0,0 +1,219 @@
+"""
+Theo dõi tiến độ ffmpeg qua `-progress pipe:1 -nostats`.
+ffmpeg ghi các khối key=value (out_time_us, total_size, speed...) ra stdout,
+mỗi khối kết thúc bằng `progress=continue` hoặc `progress=end`. ProgressParser
+đọc từng dòng, so với thời lượng đã biết để tính %, MB/s và ETA rồi phát
+ProgressEvent tới các listener đã đăng ký (CLI in ra console, GUI đưa vào
+thanh tiến độ). stdout được process_engine chuyển cho parser theo từng dòng.
+"""
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+from process_engine import ProcessHandle, ProcessResult, start_process
+
+
+PROGRESS_ARGS = ("-progress", "pipe:1", "-nostats")
+
+
+@dataclass(frozen=True)
+class ProgressEvent:
+    """Một mốc tiến độ của một job ffmpeg."""
+
+    label: str
+    out_time_us: int
+    total_size: int
+    speed: Optional[float]  # Bội số thời gian thực (1.5 = nhanh gấp 1.5 lần), None nếu N/A
+    duration_us: Optional[int]
+    elapsed: float
+    done: bool = False
+
+    @property
+    def percent(self) -> Optional[float]:
+        if self.done:
+            return 100.0
+        if not self.duration_us:
+            return None
+        return max(0.0, min(100.0, self.out_time_us * 100.0 / self.duration_us))
+
+    @property
+    def mb_per_s(self) -> float:
+        if self.elapsed <= 0:
+            return 0.0
+        return self.total_size / self.elapsed / (1024 ** 2)
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        if self.done:
+            return 0.0
+        if not self.duration_us or self.out_time_us <= 0:
+            return None
+        remaining_us = max(0, self.duration_us - self.out_time_us)
+        # Ưu tiên speed của ffmpeg; stream copy hay báo N/A thì dùng tốc độ trung bình từ đầu job
+        rate = self.speed
+        if not rate:
+            if self.elapsed <= 0:
+                return None
+            rate = self.out_time_us / 1e6 / self.elapsed
+        return remaining_us / 1e6 / rate
+
+    def describe(self) -> str:
+        parts = [self.label]
+        percent = self.percent
+        parts.append(f"{percent:5.1f}%" if percent is not None else f"{self.out_time_us / 1e6:.0f}s")
+        parts.append(f"{self.mb_per_s:.1f} MB/s")
+        eta = self.eta_seconds
+        if eta is not None and not self.done:
+            parts.append(f"ETA {format_seconds(eta)}")
+        return " | ".join(parts)
+
+
+def format_seconds(seconds: float) -> str:
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes:02d}:{secs:02d}"
+
+
+def _parse_int(value: str) -> Optional[int]:
+    try:
+        return int(value)
+    except ValueError:
+        return None  # "N/A" khi ffmpeg chưa biết
+
+
+def _parse_speed(value: str) -> Optional[float]:
+    value = value.strip().rstrip("x")
+    try:
+        speed = float(value)
+    except ValueError:
+        return None
+    return speed if speed > 0 else None
+
+
+class ProgressParser:
+    """Parse luồng key=value của `-progress` từng dòng một."""
+
+    def __init__(self, label: str, duration_us: Optional[int] = None, clock: Callable[[], float] = time.monotonic):
+        self.label = label
+        self.duration_us = duration_us if duration_us and duration_us > 0 else None
+        self._clock = clock
+        self._started = clock()
+        self._out_time_us = 0
+        self._total_size = 0
+        self._speed: Optional[float] = None
+
+    def feed_line(self, line: str) -> Optional[ProgressEvent]:
+        """Trả về ProgressEvent khi gặp dòng `progress=...` (hết một khối), ngược lại None."""
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return None
+        if key in ("out_time_us", "out_time_ms"):
+            # out_time_ms thực ra cũng là micro giây (lỗi đặt tên lâu đời của ffmpeg)
+            parsed = _parse_int(value)
+            if parsed is not None and parsed >= 0:
+                self._out_time_us = parsed
+        elif key == "total_size":
+            parsed = _parse_int(value)
+            if parsed is not None:
+                self._total_size = parsed
+        elif key == "speed":
+            self._speed = _parse_speed(value)
+        elif key == "progress":
+            return ProgressEvent(
+                label=self.label,
+                out_time_us=self._out_time_us,
+                total_size=self._total_size,
+                speed=self._speed,
+                duration_us=self.duration_us,
+                elapsed=self._clock() - self._started,
+                done=value.strip() == "end",
+            )
+        return None
+
+
+_listeners: List[Callable[[ProgressEvent], None]] = []
+_listeners_lock = threading.Lock()
+
+
+def add_listener(listener: Callable[[ProgressEvent], None]) -> None:
+    with _listeners_lock:
+        if listener not in _listeners:
+            _listeners.append(listener)
+
+
+def remove_listener(listener: Callable[[ProgressEvent], None]) -> None:
+    with _listeners_lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def publish(event: ProgressEvent) -> None:
+    with _listeners_lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        try:
+            listener(event)
+        except Exception as exc:
+            print(f"[PROGRESS] Listener lỗi: {exc}")
+
+
+class ConsolePrinter:
+    """Listener cho CLI: in tiến độ mỗi job tối đa một lần mỗi `interval` giây."""
+
+    def __init__(self, interval: float = 2.0, stream=None):
+        self.interval = interval
+        self.stream = stream
+        self._last: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event: ProgressEvent) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if not event.done and now - self._last.get(event.label, 0.0) < self.interval:
+                return
+            if event.done:
+                self._last.pop(event.label, None)
+            else:
+                self._last[event.label] = now
+        stream = self.stream or sys.stdout
+        print(f"[PROGRESS] {event.describe()}", file=stream, flush=True)
+
+
+def with_progress_args(cmd: Sequence[str]) -> List[str]:
+    """Chèn `-progress pipe:1 -nostats` ngay sau tên binary ffmpeg."""
+    return [cmd[0], *PROGRESS_ARGS, *cmd[1:]]
+
+
+def start_with_progress(
+    cmd: Sequence[str],
+    label: str,
+    duration_us: Optional[int] = None,
+    timeout: Optional[float] = None,
+    on_event: Optional[Callable[[ProgressEvent], None]] = None,
+) -> ProcessHandle:
+    """Khởi chạy ffmpeg (đã có PROGRESS_ARGS) qua process_engine, phát ProgressEvent trong lúc chạy.
+
+    `on_event` nhận riêng sự kiện của job này (ví dụ watchdog), ngoài các listener chung.
+    """
+    parser = ProgressParser(label, duration_us)
+
+    def on_line(raw: bytes) -> None:
+        event = parser.feed_line(raw.decode("utf-8", errors="replace"))
+        if event is not None:
+            if on_event is not None:
+                on_event(event)
+            publish(event)
+
+    return start_process(cmd, timeout=timeout, on_stdout_line=on_line)
+
+
+def run_with_progress(
+    cmd: Sequence[str], label: str, duration_us: Optional[int] = None, timeout: Optional[float] = None
+) -> ProcessResult:
+    """Bản đồng bộ của start_with_progress. Trả về ProcessResult (stderr dạng bytes)."""
+    return start_with_progress(cmd, label, duration_us, timeout).result()
@@ -0,0 +1,186 @@
+"""
+Dấu vân tay nội dung file, không cần ffprobe.
+Chữ ký cũ `size_duration` phải probe cả file mới có duration. Dấu vân tay mới
+băm BLAKE2b kích thước file cùng vài khối mẫu (đầu, cuối và một số vị trí cố
+định), kèm SegmentUID của Matroska nếu có. Kết quả được cache theo
+(device, inode) + size + mtime_ns giống probe cache, nên kiểm tra file đã xử
+lý gần như không tốn gì.
+Chữ ký cũ trong log local và log trên remote vẫn khớp được nhờ bảng
+chuyển đổi (migration map) chữ ký cũ -> dấu vân tay, được ghi lại mỗi khi một
+file vừa có dấu vân tay vừa có chữ ký cũ (tức là đã probe).
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from probe_cache import stat_cache_key
+
+
+FINGERPRINT_PREFIX = "b2:"
+FINGERPRINT_VERSION = b"fp1"
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_POINTS = (0.25, 0.5, 0.75)  # Vị trí lấy mẫu (tỉ lệ kích thước file), ngoài khối đầu và cuối
+DEFAULT_MAX_ENTRIES = 50000
+
+
+def is_fingerprint(signature: Optional[str]) -> bool:
+    return bool(signature) and signature.startswith(FINGERPRINT_PREFIX)
+
+
+def legacy_signature_size(signature: Optional[str]) -> Optional[int]:
+    """Kích thước file trong chữ ký cũ `size_duration`, None nếu không phải chữ ký cũ."""
+    if not signature or is_fingerprint(signature):
+        return None
+    size, sep, _ = signature.partition("_")
+    if not sep or not size.isdigit():
+        return None
+    return int(size)
+
+
+def sample_offsets(size: int, sample_size: int = SAMPLE_SIZE):
+    """Các offset được băm: đầu file, các điểm SAMPLE_POINTS và khối cuối (không trùng lặp)."""
+    if size <= sample_size:
+        return [0]
+    last = size - sample_size
+    offsets = {0, last}
+    for point in SAMPLE_POINTS:
+        offsets.add(min(last, int(size * point)))
+    return sorted(offsets)
+
+
+def compute_fingerprint(file_path: str, size: Optional[int] = None, include_segment_uid: bool = True) -> str:
+    """Đọc các khối mẫu và trả về dấu vân tay dạng `b2:<hex>`."""
+    from mkv_reader import read_segment_uid
+
+    digest = hashlib.blake2b(digest_size=16, person=FINGERPRINT_VERSION)
+    with open(file_path, "rb") as f:
+        if size is None:
+            size = os.fstat(f.fileno()).st_size
+        digest.update(size.to_bytes(8, "little"))
+        head = b""
+        for offset in sample_offsets(size):
+            f.seek(offset)
+            block = f.read(SAMPLE_SIZE)
+            if offset == 0:
+                head = block
+            digest.update(offset.to_bytes(8, "little"))
+            digest.update(block)
+    if include_segment_uid:
+        segment_uid = read_segment_uid(head)
+        if segment_uid:
+            digest.update(b"segment_uid")
+            digest.update(segment_uid)
+    return FINGERPRINT_PREFIX + digest.hexdigest()
+
+
+class FingerprintCache:
+    """Cache dấu vân tay theo inode/mtime và bảng chuyển đổi chữ ký cũ (SQLite)."""
+
+    def __init__(self, db_path: Path, max_entries: int = DEFAULT_MAX_ENTRIES, include_segment_uid: bool = True):
+        self.db_path = Path(db_path)
+        self.max_entries = max(1, int(max_entries))
+        self.include_segment_uid = include_segment_uid
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                cache_key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                fingerprint TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS signature_migration (
+                legacy_signature TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_fingerprints_last_used ON fingerprints(last_used)")
+        self._conn.commit()
+
+    def lookup(self, file_path: str, st: os.stat_result) -> Optional[str]:
+        """Dấu vân tay đã cache cho đúng bộ (inode, size, mtime_ns), không đọc file."""
+        key = stat_cache_key(st, file_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, fingerprint FROM fingerprints WHERE cache_key = ?", (key,)
+            ).fetchone()
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            self.hits += 1
+            return row[2]
+        return None
+
+    def fingerprint(self, file_path: str, st: Optional[os.stat_result] = None) -> str:
+        """Dấu vân tay của file, chỉ đọc file khi cache không còn đúng với size/mtime."""
+        st = st or os.stat(file_path)
+        cached = self.lookup(file_path, st)
+        if cached is not None:
+            return cached
+        self.misses += 1
+        key = stat_cache_key(st, file_path)
+        value = compute_fingerprint(file_path, st.st_size, self.include_segment_uid)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO fingerprints (cache_key, size, mtime_ns, fingerprint, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, st.st_size, st.st_mtime_ns, value, time.time()),
+            )
+            self._conn.commit()
+            self._evict_locked()
+        return value
+
+    def _evict_locked(self) -> None:
+        count = self._conn.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        keep = int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM fingerprints WHERE cache_key IN "
+            "(SELECT cache_key FROM fingerprints ORDER BY last_used ASC LIMIT ?)",
+            (count - keep,),
+        )
+        self._conn.commit()
+
+    def record_migration(self, legacy_signature: Optional[str], fingerprint: Optional[str]) -> None:
+        """Ghi nhận chữ ký cũ tương ứng với dấu vân tay (khi đã có cả hai cho cùng một file)."""
+        if not is_fingerprint(fingerprint) or legacy_signature_size(legacy_signature) is None:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO signature_migration (legacy_signature, fingerprint) VALUES (?, ?)",
+                (legacy_signature, fingerprint),
+            )
+            self._conn.commit()
+
+    def migration_map(self, legacy_signatures: Iterable[str]) -> Dict[str, str]:
+        """Chữ ký cũ -> dấu vân tay cho các chữ ký đã biết cách chuyển đổi."""
+        wanted = {sig for sig in legacy_signatures if legacy_signature_size(sig) is not None}
+        if not wanted:
+            return {}
+        with self._lock:
+            rows = self._conn.execute("SELECT legacy_signature, fingerprint FROM signature_migration").fetchall()
+        return {legacy: value for legacy, value in rows if legacy in wanted}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def summary(self) -> str:
+        return f"{self.hits} hit, {self.misses} tính mới"
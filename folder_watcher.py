@@ -0,0 +1,387 @@
+"""
+Theo dõi thư mục inbox và trả về file MKV mới khi đã copy xong (chế độ daemon).
+- Linux: dùng inotify (qua ctypes, không cần thư viện ngoài). Ổ mạng (SMB/NFS)
+  không phát sự kiện khi file được ghi từ máy khác, nên ở chế độ auto thư mục
+  nằm trên ổ mạng luôn được poll (thư mục khác vẫn dùng inotify).
+- Chế độ poll: liệt kê lại thư mục sau mỗi `poll_interval` giây và so với lần trước.
+- File chỉ được coi là xong khi size và mtime không đổi trong `settle_seconds`
+  giây và không còn tiến trình nào mở file (psutil). Tiến trình của user khác
+  (vd. smbd) có thể không đọc được danh sách file đang mở, khi đó chỉ dựa vào
+  size/mtime.
+- File có sẵn lúc bắt đầu không được xử lý; chỉ file xuất hiện hoặc thay đổi sau đó.
+Watcher chạy ở thread nền để sự kiện không bị tràn hàng đợi kernel trong lúc
+luồng chính đang xử lý file.
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import psutil  # type: ignore
+
+from library_walker import DEFAULT_SKIP_DIRS, LibraryWalker
+from staging import is_network_path
+
+
+WATCH_MODES = ("auto", "inotify", "poll")
+DEFAULT_SETTLE_SECONDS = 10.0
+DEFAULT_POLL_INTERVAL = 30.0
+
+# inotify(7)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+# Không đăng ký IN_MODIFY: copy file lớn sinh hàng triệu sự kiện, size/mtime đã đủ để biết file còn đổi
+WATCH_MASK = IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO | IN_ATTRIB | IN_DELETE | IN_MOVED_FROM | IN_DELETE_SELF | IN_MOVE_SELF
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """Bọc tối thiểu inotify của libc."""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self.paths: Dict[int, str] = {}
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), path)
+        self.paths[wd] = path
+        return wd
+
+    def read(self, timeout: float) -> List[Tuple[str, int]]:
+        """Các sự kiện (đường dẫn, mask) đọc được trong tối đa `timeout` giây."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events: List[Tuple[str, int]] = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                events.append(("", mask))
+                continue
+            directory = self.paths.get(wd)
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+            if directory is None:
+                continue
+            events.append((os.path.join(directory, os.fsdecode(name)) if name else directory, mask))
+        return events
+
+    def close(self) -> None:
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+
+def files_held_open(paths: Iterable[str]) -> Set[str]:
+    """Các file trong `paths` đang được một tiến trình khác mở (bỏ qua tiến trình không đọc được)."""
+    wanted = {os.path.realpath(path): path for path in paths}
+    if not wanted:
+        return set()
+    held: Set[str] = set()
+    me = os.getpid()
+    for proc in psutil.process_iter():
+        if proc.pid == me:
+            continue
+        try:
+            for opened in proc.open_files():
+                if opened.path in wanted:
+                    held.add(wanted[opened.path])
+        except (psutil.Error, OSError):
+            continue
+        if len(held) == len(wanted):
+            break
+    return held
+
+
+@dataclass
+class _Candidate:
+    root: str
+    size: int
+    mtime_ns: int
+    since: float
+
+
+class FolderWatcher:
+    """Theo dõi một hoặc nhiều thư mục, đưa các lô file đã ổn định vào hàng đợi.
+
+    Dùng: `start()`, rồi lặp `get_batch(timeout)` -> (thư mục gốc, [đường dẫn]); `close()` khi xong.
+    """
+
+    def __init__(
+        self,
+        folders: Sequence[str],
+        recursive: bool = False,
+        settle_seconds: float = DEFAULT_SETTLE_SECONDS,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        mode: str = "auto",
+        include: Sequence[str] = (),
+        exclude: Sequence[str] = (),
+        max_depth: Optional[int] = None,
+        skip_dirs: Sequence[str] = DEFAULT_SKIP_DIRS,
+    ):
+        if mode not in WATCH_MODES:
+            raise ValueError(f"mode phải là một trong {WATCH_MODES}")
+        self.settle_seconds = max(0.0, float(settle_seconds))
+        self.poll_interval = max(1.0, float(poll_interval))
+        self.walkers = [
+            LibraryWalker(
+                folder,
+                include=include,
+                exclude=exclude,
+                max_depth=max_depth if recursive else 0,
+                skip_dirs=skip_dirs,
+            )
+            for folder in folders
+        ]
+        self.mode = mode
+        self._inotify: Optional[Inotify] = None
+        self._poll_roots: Set[str] = set()  # Thư mục gốc luôn poll (ổ mạng) kể cả khi có inotify
+        self._known: Dict[str, Tuple[int, int]] = {}  # File đã có hoặc đã giao: (size, mtime_ns)
+        self._candidates: Dict[str, _Candidate] = {}
+        self._batches: "queue.Queue[Tuple[str, List[str]]]" = queue.Queue()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- Khởi động ---
+
+    def start(self) -> None:
+        if self.mode == "auto":
+            for walker in self.walkers:
+                if is_network_path(walker.root):
+                    print(f"[WATCH] {walker.root} nằm trên ổ mạng, dùng poll mỗi {self.poll_interval:g} giây")
+                    self._poll_roots.add(walker.root)
+        local = [walker for walker in self.walkers if walker.root not in self._poll_roots]
+        if self.mode in ("auto", "inotify") and sys.platform.startswith("linux") and local:
+            try:
+                self._inotify = Inotify()
+            except (OSError, AttributeError) as exc:
+                if self.mode == "inotify":
+                    raise
+                print(f"[WATCH] Không dùng được inotify ({exc}), chuyển sang poll")
+        elif self.mode == "inotify":
+            raise OSError(errno.ENOSYS, "inotify chỉ có trên Linux")
+        for walker in self.walkers:
+            self._snapshot(walker, baseline=True)
+        if self._inotify is None:
+            self.mode = "poll"
+        else:
+            self.mode = "inotify+poll" if self._poll_roots else "inotify"
+        self._thread = threading.Thread(target=self._run, name="folder-watcher", daemon=True)
+        self._thread.start()
+
+    def _walker_for(self, path: str) -> Optional[LibraryWalker]:
+        for walker in self.walkers:
+            if path == walker.root or path.startswith(walker.root.rstrip(os.sep) + os.sep):
+                return walker
+        return None
+
+    def _watch(self, path: str) -> None:
+        if self._inotify is None:
+            return
+        try:
+            self._inotify.add_watch(path)
+        except OSError as exc:
+            if exc.errno == errno.ENOSPC:
+                # Hết fs.inotify.max_user_watches: poll cho chắc chắn không bỏ sót
+                print("[WATCH] Vượt giới hạn inotify watch (fs.inotify.max_user_watches), chuyển sang poll")
+                self._inotify.close()
+                self._inotify = None
+                self.mode = "poll"
+            elif exc.errno != errno.ENOENT:
+                print(f"[WATCH] Không thể theo dõi {path}: {exc}")
+
+    def _snapshot(self, walker: LibraryWalker, baseline: bool = False, root: Optional[str] = None) -> None:
+        """Liệt kê (một phần) cây thư mục: lần đầu làm mốc, các lần sau tìm file mới/đổi."""
+        scan_root = root or walker.root
+        sub = walker
+        if scan_root != walker.root:
+            sub = LibraryWalker(
+                scan_root,
+                include=(),
+                exclude=(),
+                max_depth=None if walker.max_depth is None else max(0, walker.max_depth - walker.depth_of(scan_root)),
+                skip_dirs=walker.skip_dirs,
+            )
+        seen: Set[str] = set()
+        for directory in sub.directories(include_empty=True):
+            if walker.root not in self._poll_roots:
+                self._watch(directory.path)
+            for name, entry in directory.entries.items():
+                path = os.path.join(directory.path, name)
+                if not walker.accepts_file(path):
+                    continue
+                seen.add(path)
+                if baseline:
+                    self._known[path] = (entry.size, entry.mtime_ns)
+                elif self._known.get(path) != (entry.size, entry.mtime_ns):
+                    self._offer(walker.root, path)
+        if not baseline and root is None:
+            prefix = walker.root.rstrip(os.sep) + os.sep
+            for path in [p for p in self._known if p.startswith(prefix) and p not in seen]:
+                del self._known[path]
+
+    # --- Vòng theo dõi ---
+
+    def _offer(self, root: str, path: str) -> None:
+        """Thêm (hoặc làm mới) file ứng viên; đồng hồ ổn định bắt đầu lại khi size/mtime đổi."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._candidates.pop(path, None)
+            return
+        if self._known.get(path) == (st.st_size, st.st_mtime_ns):
+            return  # Sự kiện không làm đổi nội dung (chmod, đã giao trước đó)
+        current = self._candidates.get(path)
+        if current is None or (current.size, current.mtime_ns) != (st.st_size, st.st_mtime_ns):
+            self._candidates[path] = _Candidate(root, st.st_size, st.st_mtime_ns, time.monotonic())
+
+    def _safe_snapshot(self, walker: LibraryWalker, root: Optional[str] = None) -> None:
+        """_snapshot, nhưng thư mục không đọc được chỉ được báo lỗi (không dừng thread theo dõi)."""
+        try:
+            self._snapshot(walker, root=root)
+        except OSError as exc:
+            print(f"[WATCH] Không thể liệt kê {root or walker.root}: {exc}")
+
+    def _polled_walkers(self) -> List[LibraryWalker]:
+        if self._inotify is None:
+            return self.walkers
+        return [walker for walker in self.walkers if walker.root in self._poll_roots]
+
+    def _handle_event(self, path: str, mask: int) -> None:
+        if not path:  # IN_Q_OVERFLOW: có thể đã mất sự kiện, liệt kê lại
+            print("[WATCH] Hàng đợi inotify bị tràn, quét lại thư mục")
+            for walker in self.walkers:
+                self._safe_snapshot(walker)
+            return
+        walker = self._walker_for(path)
+        if walker is None:
+            return
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO) and walker.accepts_directory(path):
+                # Thư mục được chuyển vào cùng file bên trong: không có sự kiện riêng cho từng file
+                self._safe_snapshot(walker, root=path)
+            return
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self._candidates.pop(path, None)
+            self._known.pop(path, None)
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            return
+        if walker.accepts_file(path):
+            self._offer(walker.root, path)
+
+    def _run(self) -> None:
+        tick = max(0.5, min(2.0, self.settle_seconds / 2 or 0.5))
+        next_poll = time.monotonic() + self.poll_interval
+        while not self._stop.is_set():
+            if self._inotify is not None:
+                try:
+                    events = self._inotify.read(tick)
+                except OSError as exc:
+                    print(f"[WATCH] Lỗi đọc inotify ({exc}), chuyển sang poll")
+                    self._inotify.close()
+                    self._inotify = None
+                    self.mode = "poll"
+                    continue
+                for path, mask in events:
+                    self._handle_event(path, mask)
+            else:
+                self._stop.wait(tick)
+            if time.monotonic() >= next_poll:
+                next_poll = time.monotonic() + self.poll_interval
+                for walker in self._polled_walkers():
+                    self._safe_snapshot(walker)
+            self._check_candidates()
+
+    def _check_candidates(self) -> None:
+        if not self._candidates:
+            return
+        now = time.monotonic()
+        settled: List[str] = []
+        for path in list(self._candidates):
+            candidate = self._candidates[path]
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self._candidates[path]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (candidate.size, candidate.mtime_ns):
+                candidate.size, candidate.mtime_ns, candidate.since = st.st_size, st.st_mtime_ns, now
+            elif now - candidate.since >= self.settle_seconds:
+                settled.append(path)
+        if not settled:
+            return
+        held = files_held_open(settled)
+        batches: Dict[str, List[str]] = {}
+        for path in settled:
+            candidate = self._candidates[path]
+            if path in held:
+                candidate.since = now  # Vẫn đang có tiến trình ghi: chờ thêm
+                continue
+            del self._candidates[path]
+            self._known[path] = (candidate.size, candidate.mtime_ns)
+            batches.setdefault(candidate.root, []).append(path)
+        for root, paths in batches.items():
+            self._batches.put((root, sorted(paths)))
+
+    # --- API cho luồng chính ---
+
+    def get_batch(self, timeout: Optional[float] = None) -> Optional[Tuple[str, List[str]]]:
+        """Lô file đã ổn định kế tiếp, None nếu hết `timeout`."""
+        try:
+            return self._batches.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    @property
+    def waiting(self) -> int:
+        """Số file đang chờ ổn định."""
+        return len(self._candidates)
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
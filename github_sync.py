@@ -1,18 +1,41 @@
 """
 Module hỗ trợ đồng bộ subtitle và log lên GitHub bằng token cá nhân.
 Đọc cấu hình từ auto_push_config.json hoặc biến môi trường.
+Mặc định subtitle và log của cả lượt chạy được gom vào một commit qua Git Data
+API (blob -> tree -> commit -> cập nhật ref) thay vì một commit Contents API
+cho mỗi file. Log trên remote là các segment NDJSON chỉ ghi thêm (xem remote_log).
 """
 from __future__ import annotations
 
 import base64
 import datetime
+import hashlib
 import json
 import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from config_manager import get_config_dir
+from rate_limiter import GitHubRateLimiter, SyncStats, backoff_delay
+from remote_log import (
+    DEFAULT_SEGMENT_MAX_ENTRIES,
+    MANIFEST_NAME,
+    Manifest,
+    RemoteState,
+    SegmentCache,
+    SegmentInfo,
+    build_segments,
+    decode_segment,
+    segment_infos,
+    sha256_hex,
+)
 
 
 @dataclass
@@ -20,10 +43,20 @@ class AutoPushConfig:
     token: str
     repo: str
     branch: str = "main"
-    log_path: str = "logs/processed.json"
+    log_path: str = "logs/processed.json"  # Log JSON cũ, chỉ còn đọc để chuyển sang segment
+    segments_dir: str = "logs/processed"  # Segment NDJSON + manifest.json
+    segment_max_entries: int = DEFAULT_SEGMENT_MAX_ENTRIES
+    cache_dir: Optional[str] = None  # Cache segment ở máy (None: không cache)
     subtitle_dir: str = "subtitles"
     logs_dir: str = "logs"
     enabled: bool = True
+    batch_commits: bool = True  # Gom file vào commit qua Git Data API; False: mỗi file một commit
+    batch_size: int = 0  # Commit sau mỗi N subtitle; 0: một commit cho cả lượt chạy
+    upload_workers: int = 4  # Số upload chạy song song (dùng chung connection pool của session)
+    max_retries: int = 5  # Thử lại lỗi 5xx / rate limit phụ
+    timeout: float = 60.0
+    writes_per_minute: float = 70.0
+    max_wait: float = 900.0  # Chờ reset quota tối đa (giây), lâu hơn thì báo lỗi
 
 
 def build_auto_push_config(settings: Dict[str, Any]) -> Optional[AutoPushConfig]:
@@ -40,11 +73,32 @@ def build_auto_push_config(settings: Dict[str, Any]) -> Optional[AutoPushConfig]
         log_path=(settings.get("log_path") or f"{settings.get('logs_dir', 'logs')}/processed.json").strip(),
         subtitle_dir=(settings.get("subtitle_dir") or "subtitles").strip(),
         logs_dir=(settings.get("logs_dir") or "logs").strip(),
+        segments_dir=(settings.get("log_segments_dir") or f"{settings.get('logs_dir', 'logs')}/processed").strip(),
+        segment_max_entries=max(1, int(settings.get("log_segment_max_entries", DEFAULT_SEGMENT_MAX_ENTRIES))),
+        cache_dir=str(get_config_dir() / "remote_log_cache" / f"{repo.replace('/', '__')}@{(settings.get('branch') or 'main').strip()}"),
+        batch_commits=bool(settings.get("remote_batch_commits", True)),
+        batch_size=max(0, int(settings.get("remote_batch_size", 0) or 0)),
+        upload_workers=max(1, int(settings.get("github_upload_workers", 4))),
+        max_retries=max(0, int(settings.get("github_max_retries", 5))),
+        timeout=float(settings.get("github_timeout", 60)),
+        writes_per_minute=float(settings.get("github_writes_per_minute", 70)),
     )
 
 
+class GitHubAPIError(RuntimeError):
+    """Response lỗi (>= 400) từ GitHub API; `status_code` để người gọi phân loại lỗi."""
+
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f"GitHub API error {status_code}: {text}")
+        self.status_code = status_code
+
+
+class GitRefConflict(RuntimeError):
+    """Branch đã có commit mới trong lúc tạo commit (cập nhật ref không fast-forward)."""
+
+
 class GitHubClient:
-    """Client đơn giản gọi GitHub Content API."""
+    """Client đơn giản gọi GitHub Content API và Git Data API."""
 
     def __init__(self, config: AutoPushConfig):
         self.config = config
@@ -57,15 +111,99 @@ class GitHubClient:
                 "X-GitHub-Api-Version": "2022-11-28",
             }
         )
+        # Đủ kết nối giữ sẵn cho mọi worker upload
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.upload_workers + 2)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.stats = SyncStats()
+        self.limiter = GitHubRateLimiter(writes_per_minute=config.writes_per_minute, stats=self.stats)
+        self._blobs: Dict[str, str] = {}  # sha1 git của nội dung -> sha blob đã tạo (dùng lại khi thử lại commit)
+        self._blobs_lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
 
     def _request(
-        self, method: str, endpoint: str, *, params: Optional[Dict[str, Any]] = None, json_data: Optional[Dict[str, Any]] = None
+        self,
+        method: str,
+        endpoint: str,
+        *,
+        params: Optional[Dict[str, Any]] = None,
+        json_data: Optional[Dict[str, Any]] = None,
+        upload_size: Optional[int] = None,
+        headers: Optional[Dict[str, str]] = None,
     ) -> requests.Response:
+        """Gửi request qua rate limiter; thử lại lỗi 5xx, rate limit phụ và lỗi kết nối."""
         url = f"{self.base_url}{endpoint}"
-        response = self.session.request(method, url, params=params, json=json_data, timeout=30)
-        if response.status_code >= 400:
-            raise RuntimeError(f"GitHub API error {response.status_code}: {response.text}")
-        return response
+        if upload_size is not None:
+            self.stats.begin_upload()
+        ok = False
+        try:
+            for attempt in range(self.config.max_retries + 1):
+                last = attempt >= self.config.max_retries
+                self.limiter.before(method)
+                self.stats.count_request(retry=attempt > 0)
+                try:
+                    response = self.session.request(
+                        method, url, params=params, json=json_data, headers=headers, timeout=self.config.timeout
+                    )
+                except (requests.ConnectionError, requests.Timeout) as exc:
+                    if last:
+                        raise RuntimeError(f"GitHub API lỗi kết nối: {exc}") from exc
+                    self._backoff(attempt)
+                    continue
+                self.limiter.after(response.headers)
+                if response.status_code == 304:
+                    self.stats.count_not_modified()
+                if response.status_code < 400:
+                    ok = True
+                    return response
+                delay = self._retry_delay(response, attempt)
+                if delay is None or last:
+                    raise GitHubAPIError(response.status_code, response.text)
+                self._backoff(attempt, delay)
+            raise RuntimeError("GitHub API: hết số lần thử lại")  # Không tới được: vòng lặp luôn return/raise
+        finally:
+            if upload_size is not None:
+                self.stats.end_upload(upload_size, ok)
+
+    def _retry_delay(self, response: requests.Response, attempt: int) -> Optional[float]:
+        """Thời gian chờ trước khi thử lại, None nếu lỗi không nên thử lại."""
+        status = response.status_code
+        retry_after = response.headers.get("Retry-After")
+        if status in (403, 429):
+            reset_wait = self.limiter.reset_wait(response.headers)
+            if reset_wait is not None:
+                # Hết quota chính: chờ tới lúc reset nếu không quá lâu
+                return reset_wait if reset_wait <= self.config.max_wait else None
+            if retry_after is None and "secondary rate limit" not in response.text.lower():
+                return None  # 403 thật (token sai quyền...)
+        elif status < 500:
+            return None
+        try:
+            seconds = float(retry_after) if retry_after is not None else None
+        except ValueError:
+            seconds = None
+        return backoff_delay(attempt, retry_after=seconds)
+
+    def _backoff(self, attempt: int, delay: Optional[float] = None) -> None:
+        delay = backoff_delay(attempt) if delay is None else delay
+        self.stats.add_throttle(delay)
+        time.sleep(delay)
+
+    # --- Upload song song ---
+
+    def submit(self, func: Callable[..., Any], *args: Any) -> Future:
+        """Chạy `func` trên pool upload (tối đa `upload_workers` việc cùng lúc)."""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.config.upload_workers, thread_name_prefix="github-upload")
+            return self._pool.submit(func, *args)
+
+    def close(self) -> None:
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
 
     def get_content(self, path: str) -> Tuple[Optional[bytes], Optional[str]]:
         """Lấy nội dung file (base64) từ repo."""
@@ -75,8 +213,8 @@ class GitHubClient:
                 f"/repos/{self.config.repo}/contents/{path}",
                 params={"ref": self.config.branch},
             )
-        except RuntimeError as exc:
-            if "404" in str(exc):
+        except GitHubAPIError as exc:
+            if exc.status_code == 404:
                 return None, None
             raise
 
@@ -85,6 +223,57 @@ class GitHubClient:
         sha = data.get("sha")
         return content, sha
 
+    def get_content_if_changed(
+        self, path: str, etag: Optional[str] = None
+    ) -> Tuple[bool, Optional[bytes], Optional[str], Optional[str]]:
+        """GET có điều kiện (If-None-Match). Trả về (đã đổi, nội dung, sha, etag).
+
+        304 trả về (False, None, None, etag): nội dung trong cache vẫn đúng. File không
+        tồn tại trả về (True, None, None, None).
+        """
+        try:
+            response = self._request(
+                "GET",
+                f"/repos/{self.config.repo}/contents/{path}",
+                params={"ref": self.config.branch},
+                headers={"If-None-Match": etag} if etag else None,
+            )
+        except GitHubAPIError as exc:
+            if exc.status_code == 404:
+                return True, None, None, None
+            raise
+        if response.status_code == 304:
+            return False, None, None, etag
+        data = response.json()
+        content = base64.b64decode(data["content"]) if "content" in data else None
+        return True, content, data.get("sha"), response.headers.get("ETag")
+
+    def get_head(self, etag: Optional[str] = None) -> Tuple[bool, Optional[str], Optional[str]]:
+        """Sha commit đầu branch, có điều kiện như get_content_if_changed: (đã đổi, sha, etag)."""
+        response = self._request(
+            "GET",
+            f"/repos/{self.config.repo}/git/ref/heads/{self.config.branch}",
+            headers={"If-None-Match": etag} if etag else None,
+        )
+        if response.status_code == 304:
+            return False, None, etag
+        return True, response.json()["object"]["sha"], response.headers.get("ETag")
+
+    def get_raw(self, path: str) -> Optional[bytes]:
+        """Nội dung file dạng raw (không base64, không giới hạn 1 MB của Contents API), None nếu không có."""
+        try:
+            response = self._request(
+                "GET",
+                f"/repos/{self.config.repo}/contents/{path}",
+                params={"ref": self.config.branch},
+                headers={"Accept": "application/vnd.github.raw+json"},
+            )
+        except GitHubAPIError as exc:
+            if exc.status_code == 404:
+                return None
+            raise
+        return response.content
+
     def put_content(self, path: str, content: bytes, message: str, sha: Optional[str] = None) -> str:
         """Upload (hoặc cập nhật) file lên repo. Trả về sha mới."""
         encoded = base64.b64encode(content).decode("utf-8")
@@ -100,6 +289,7 @@ class GitHubClient:
             "PUT",
             f"/repos/{self.config.repo}/contents/{path}",
             json_data=payload,
+            upload_size=len(content),
         )
         resp_json = response.json()
         return resp_json.get("content", {}).get("sha", "")
@@ -112,57 +302,404 @@ class GitHubClient:
             json_data=payload,
         )
 
+    # --- Git Data API ---
+
+    def create_blob(self, content: bytes) -> str:
+        """Tạo blob (chỉ một lần cho mỗi nội dung trong phiên). Trả về sha."""
+        key = hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+        with self._blobs_lock:
+            if key in self._blobs:
+                return self._blobs[key]
+        response = self._request(
+            "POST",
+            f"/repos/{self.config.repo}/git/blobs",
+            json_data={"content": base64.b64encode(content).decode("utf-8"), "encoding": "base64"},
+            upload_size=len(content),
+        )
+        with self._blobs_lock:
+            self._blobs[key] = response.json()["sha"]
+            return self._blobs[key]
+
+    def commit_files(self, files: Dict[str, Optional[bytes]], message: str, expected_head: Optional[str] = None) -> str:
+        """Ghi nhiều file trong một commit và fast-forward branch. Trả về sha commit.
+
+        `files`: đường dẫn trong repo -> nội dung (None để xóa file). Ném GitRefConflict nếu
+        branch đã đổi trong lúc tạo commit, hoặc đầu branch khác `expected_head` (nội dung
+        `files` được tính từ commit đó); blob đã tạo được dùng lại khi gọi lại.
+        """
+        repo = self.config.repo
+        ref = self._request("GET", f"/repos/{repo}/git/ref/heads/{self.config.branch}").json()
+        parent = ref["object"]["sha"]
+        if expected_head and parent != expected_head:
+            raise GitRefConflict(f"Branch đã đổi: {expected_head[:7]} -> {parent[:7]}")
+        base_tree = self._request("GET", f"/repos/{repo}/git/commits/{parent}").json()["tree"]["sha"]
+        # Blob được tạo song song trên pool upload
+        blobs = {
+            path: self.submit(self.create_blob, content) for path, content in sorted(files.items()) if content is not None
+        }
+        tree = [
+            {"path": path, "mode": "100644", "type": "blob", "sha": blobs[path].result() if path in blobs else None}
+            for path in sorted(files)
+        ]
+        tree_sha = self._request(
+            "POST", f"/repos/{repo}/git/trees", json_data={"base_tree": base_tree, "tree": tree}
+        ).json()["sha"]
+        commit_sha = self._request(
+            "POST",
+            f"/repos/{repo}/git/commits",
+            json_data={"message": message, "tree": tree_sha, "parents": [parent]},
+        ).json()["sha"]
+        try:
+            self._request(
+                "PATCH",
+                f"/repos/{repo}/git/refs/heads/{self.config.branch}",
+                json_data={"sha": commit_sha, "force": False},
+            )
+        except GitHubAPIError as exc:
+            if exc.status_code in (409, 422):
+                raise GitRefConflict(str(exc)) from exc
+            raise
+        return commit_sha
+
 
 class RemoteSyncManager:
     """
     Quản lý log và upload subtitle lên GitHub.
-    - Log được lưu tại log_path (JSON list).
+    - Log là các segment NDJSON trong segments_dir, liệt kê trong manifest.json.
+    - log_path (processed.json cũ) được tự chuyển sang segment khi gặp.
     - Subtitle lưu trong subtitle_dir.
+    - `read_only`: chỉ đọc (dry-run), không chuyển đổi/ghi gì lên repo.
     """
 
-    def __init__(self, config: AutoPushConfig):
+    def __init__(self, config: AutoPushConfig, read_only: bool = False):
         self.config = config
+        self.read_only = read_only
         self.client = GitHubClient(config)
         self.log_entries: List[Dict[str, Any]] = []
-        self.log_sha: Optional[str] = None
+        self.manifest = Manifest()
+        self.manifest_sha: Optional[str] = None  # sha Contents API của manifest (khi không commit theo lô)
+        self.manifest_path = f"{config.segments_dir}/{MANIFEST_NAME}"
+        self.head: Optional[str] = None  # Đầu branch mà self.manifest được đọc từ đó
+        self.cache: Optional[SegmentCache] = None
+        self.state: Optional[RemoteState] = None
+        if config.cache_dir:
+            try:
+                self.cache = SegmentCache(Path(config.cache_dir))
+                self.state = RemoteState(self.cache)
+            except OSError as exc:
+                print(f"[AUTO PUSH] Không thể tạo cache log: {exc}")
+        self._refresh: Optional[Future] = None
         self.pending_entries: List[Dict[str, Any]] = []
+        self.pending_files: Dict[str, bytes] = {}  # Đường dẫn remote -> nội dung, chờ commit theo lô
+        # Upload từng file (khi không commit theo lô): (future, entry, file ở máy) đang chạy trên pool
+        self._uploads: List[Tuple[Future, Dict[str, Any], str]] = []
+        self._failed_uploads: List[Tuple[Dict[str, Any], str]] = []  # Upload lỗi, chạy lại ở lần flush sau
         self.signatures: Dict[str, Dict[str, Any]] = {}
+        # Nhiều job có thể ghi log cùng lúc (xem JobScheduler trong script.py)
+        self._lock = threading.RLock()
+
+    def refresh_async(self) -> Future:
+        """Chạy load_remote_logs() ở thread nền (song song với quét thư mục ở máy).
+
+        record_entry/flush tự chờ thread này xong trước khi dùng log remote.
+        """
+        future: Future = Future()
+
+        def run() -> None:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(self.load_remote_logs())
+            except BaseException as exc:
+                future.set_exception(exc)
+
+        self._refresh = future
+        threading.Thread(target=run, name="remote-log-refresh", daemon=True).start()
+        return future
+
+    def _wait_refresh(self) -> None:
+        refresh = self._refresh
+        if refresh is not None:
+            try:
+                refresh.result()
+            except Exception:
+                pass
 
     def load_remote_logs(self) -> List[Dict[str, Any]]:
-        """Tải log hiện tại từ GitHub."""
+        """Tải log từ GitHub: manifest + các segment chưa có trong cache (và processed.json cũ nếu còn).
+
+        Đầu branch trùng lần đọc trước thì manifest/log cũ lấy từ cache mà không tải gì;
+        khác thì đọc lại bằng request có điều kiện (304 khi file không đổi).
+        """
         try:
-            content, sha = self.client.get_content(self.config.log_path)
+            head, head_etag = self._branch_head()
+            unchanged = bool(head) and self.state is not None and head == self.state.head
+            if not unchanged and not self.read_only and self.convert_remote_legacy_log():
+                head, head_etag = self._branch_head()
+            self.head = head
+            data, self.manifest_sha = self._read_file(self.manifest_path, cached=unchanged)
+            self.manifest = Manifest.from_bytes(data)
+            entries = self._load_segments(self.manifest.segments)
+            legacy = self._read_raw_file(self.config.log_path, cached=unchanged)
         except Exception as exc:
             print(f"[AUTO PUSH] Không thể tải log từ GitHub: {exc}")
             return []
 
-        self.log_sha = sha
-        if not content:
-            self.log_entries = []
-        else:
-            try:
-                self.log_entries = json.loads(content.decode("utf-8"))
-            except json.JSONDecodeError:
-                print("[AUTO PUSH] Log từ GitHub không hợp lệ. Bắt đầu bằng danh sách rỗng.")
-                self.log_entries = []
-
-        self.signatures = {
-            entry["signature"]: entry
-            for entry in self.log_entries
-            if entry.get("category") == "video" and entry.get("signature")
-        }
+        if self.state:
+            self.state.set_head(head, head_etag)
+        if legacy is not None:
+            legacy_entries = self._parse_log(legacy)
+            if legacy_entries:
+                entries.extend(legacy_entries)
+                if not self.read_only:
+                    self._migrate_legacy_log(legacy_entries)
+            else:
+                # Không đọc được entry nào: giữ nguyên file cũ, không xóa lịch sử
+                print(f"[AUTO PUSH] {self.config.log_path} rỗng hoặc không hợp lệ, không chuyển sang segment.")
+        if self.state:
+            self.state.save()
+        self.log_entries = entries
+
+        self.signatures = {}
+        for entry in self.log_entries:
+            if entry.get("category") != "video":
+                continue
+            # Entry mới có cả dấu vân tay và chữ ký cũ size_duration; entry cũ chỉ có chữ ký cũ
+            for key in ("signature", "legacy_signature"):
+                if entry.get(key):
+                    self.signatures[entry[key]] = entry
         return self.log_entries
 
+    def _branch_head(self) -> Tuple[Optional[str], Optional[str]]:
+        """(sha, etag) của đầu branch; 304 trả về đầu branch đã lưu trong cache."""
+        etag = self.state.head_etag if self.state and self.state.head else None
+        changed, sha, etag = self.client.get_head(etag)
+        if not changed:
+            return self.state.head, etag
+        return sha, etag
+
+    def _read_file(self, path: str, cached: bool = False) -> Tuple[Optional[bytes], Optional[str]]:
+        """(nội dung, sha) của file trên branch; None nếu không có.
+
+        `cached`: branch chưa đổi từ lần đọc trước, dùng cache nếu có mà không gửi request.
+        """
+        if self.state is None:
+            return self.client.get_content(path)
+        if cached:
+            known, content, sha = self.state.content(path)
+            if known:
+                return content, sha
+        info = self.state.file(path) or {}
+        changed, content, sha, etag = self.client.get_content_if_changed(path, info.get("etag"))
+        if not changed:
+            known, content, sha = self.state.content(path)
+            if known:
+                return content, sha
+            changed, content, sha, etag = self.client.get_content_if_changed(path)
+        self.state.remember(path, content, sha, etag)
+        return content, sha
+
+    def _read_raw_file(self, path: str, cached: bool = False) -> Optional[bytes]:
+        """Nội dung file qua get_raw (Contents API dạng JSON không trả nội dung file > 1 MB); None nếu không có."""
+        if cached and self.state is not None:
+            known, content, _sha = self.state.content(path)
+            if known:
+                return content
+        content = self.client.get_raw(path)
+        if self.state is not None:
+            self.state.remember(path, content)
+        return content
+
+    def _legacy_sha(self, path: str) -> Optional[str]:
+        """sha Contents API của file cũ, cần khi xóa từng file (commit theo lô không cần)."""
+        if self.config.batch_commits:
+            return None
+        return self.client.get_content(path)[1]
+
+    def _reload_manifest(self) -> None:
+        self.head, _ = self._branch_head()
+        data, self.manifest_sha = self._read_file(self.manifest_path)
+        self.manifest = Manifest.from_bytes(data)
+
+    def _load_segments(self, segments: List[SegmentInfo]) -> List[Dict[str, Any]]:
+        """Entry của các segment theo thứ tự manifest; chỉ tải (song song) segment chưa có trong cache."""
+        contents: Dict[str, bytes] = {}
+        missing: Dict[str, Future] = {}
+        for segment in segments:
+            cached = self.cache.get(segment) if self.cache else None
+            if cached is not None:
+                contents[segment.path] = cached
+            else:
+                missing[segment.path] = self.client.submit(self.client.get_raw, segment.path)
+        for segment in segments:
+            if segment.path not in missing:
+                continue
+            data = missing[segment.path].result()
+            if data is None:
+                print(f"[AUTO PUSH] Thiếu segment log {segment.path}")
+                continue
+            if sha256_hex(data) != segment.sha256:
+                print(f"[AUTO PUSH] Segment {segment.path} không khớp sha256 trong manifest, không cache")
+            elif self.cache:
+                self.cache.put(data)
+            contents[segment.path] = data
+        entries: List[Dict[str, Any]] = []
+        for segment in segments:
+            if segment.path in contents:
+                entries.extend(decode_segment(contents[segment.path]))
+        if segments:
+            print(
+                f"[AUTO PUSH] Log remote: {len(segments)} segment ({len(missing)} tải mới, "
+                f"{len(segments) - len(missing)} từ cache), {len(entries)} entry"
+            )
+        return entries
+
+    def _migrate_legacy_log(self, entries: List[Dict[str, Any]]) -> None:
+        """Chuyển processed.json cũ thành segment theo tháng rồi xóa file cũ (một commit nếu commit theo lô)."""
+        try:
+            legacy_sha = self._legacy_sha(self.config.log_path)
+        except Exception as exc:
+            print(f"[AUTO PUSH] Không thể lấy sha của {self.config.log_path}: {exc}")
+            return
+        segments = build_segments(
+            entries, self.config.segments_dir, self.config.segment_max_entries, by_entry_month=True, label="legacy"
+        )
+        with self._lock:
+            ok = self._publish(
+                segments,
+                f"Migrate {self.config.log_path} to NDJSON segments ({len(entries)} entries)",
+                deletes={self.config.log_path: legacy_sha},
+            )
+        if ok:
+            print(f"[AUTO PUSH] Đã chuyển {self.config.log_path} ({len(entries)} entry) thành {len(segments)} segment NDJSON")
+
+    def _publish(
+        self,
+        segments: Dict[str, bytes],
+        message: str,
+        files: Optional[Dict[str, bytes]] = None,
+        deletes: Optional[Dict[str, Optional[str]]] = None,
+        attempts: int = 3,
+    ) -> bool:
+        """Ghi segment mới và manifest (cùng `files`, xóa `deletes`). Gọi khi đang giữ lock.
+
+        Commit theo lô: một commit, gặp xung đột thì đọc lại manifest và thử lại.
+        Từng file: PUT segment song song, rồi PUT manifest với sha (409 -> đọc lại, thử lại).
+        """
+        infos = segment_infos(segments)
+        deletes = deletes or {}
+        if self.config.batch_commits:
+            for attempt in range(attempts):
+                manifest = self.manifest.merged_with(infos)
+                payload: Dict[str, Optional[bytes]] = dict(files or {})
+                payload.update(segments)
+                if infos:
+                    payload[self.manifest_path] = manifest.to_bytes()
+                payload.update({path: None for path in deletes})
+                try:
+                    commit_sha = self.client.commit_files(payload, message, expected_head=self.head)
+                except GitRefConflict:
+                    if attempt + 1 >= attempts:
+                        print("[AUTO PUSH] Branch liên tục thay đổi, sẽ thử lại ở lần đồng bộ sau.")
+                        return False
+                    # Có commit khác chen vào: đọc lại manifest rồi gộp (blob đã tạo được dùng lại)
+                    try:
+                        self._reload_manifest()
+                    except Exception as exc:
+                        print(f"[AUTO PUSH] Không thể tải lại manifest: {exc}")
+                        return False
+                    continue
+                except Exception as exc:
+                    print(f"[AUTO PUSH] Không thể commit lên GitHub: {exc}")
+                    return False
+                self._segments_published(manifest, segments)
+                self.manifest_sha = None  # sha Contents API của manifest đã cũ
+                if self.state:
+                    if infos:
+                        self.state.remember(self.manifest_path, manifest.to_bytes())
+                    for path in deletes:
+                        self.state.remember(path, None)
+                    # Cache chỉ còn đúng ở commit mới nếu nó đúng ở commit cha
+                    if self.state.head == self.head:
+                        self.state.set_head(commit_sha)
+                    self.state.save()
+                self.head = commit_sha
+                return True
+            return False
+
+        try:
+            uploads = [self.client.submit(self.client.put_content, path, data, message) for path, data in segments.items()]
+            for future in uploads:
+                future.result()
+        except Exception as exc:
+            print(f"[AUTO PUSH] Không thể upload segment log: {exc}")
+            return False
+        for attempt in range(attempts):
+            manifest = self.manifest.merged_with(infos)
+            try:
+                data = manifest.to_bytes()
+                self.manifest_sha = self.client.put_content(self.manifest_path, data, message, sha=self.manifest_sha)
+            except RuntimeError as exc:
+                conflict = isinstance(exc, GitHubAPIError) and exc.status_code in (409, 422)
+                if not conflict or attempt + 1 >= attempts:
+                    print(f"[AUTO PUSH] Không thể cập nhật manifest log: {exc}")
+                    return False
+                try:
+                    self._reload_manifest()
+                except Exception as reload_exc:
+                    print(f"[AUTO PUSH] Không thể tải lại manifest: {reload_exc}")
+                    return False
+                continue
+            self._segments_published(manifest, segments)
+            if self.state:
+                self.state.remember(self.manifest_path, data, self.manifest_sha)
+            for path, sha in deletes.items():
+                if sha:
+                    try:
+                        self.client.delete_content(path, sha, message=f"Remove {path}")
+                    except Exception as exc:
+                        print(f"[AUTO PUSH] Không thể xóa {path}: {exc}")
+                        continue
+                    if self.state:
+                        self.state.remember(path, None)
+            if self.state:
+                # Đầu branch mới không rõ (upload từng file chạy song song), lần sau kiểm tra lại
+                self.state.set_head(None)
+                self.state.save()
+            return True
+        return False
+
+    def _segments_published(self, manifest: Manifest, segments: Dict[str, bytes]) -> None:
+        self.manifest = manifest
+        if self.cache:
+            for data in segments.values():
+                self.cache.put(data)
+
+    @staticmethod
+    def _parse_log(content: Optional[bytes]) -> Optional[List[Dict[str, Any]]]:
+        """Entry của log JSON cũ; None nếu nội dung không phải danh sách JSON hợp lệ."""
+        if not content:
+            return None
+        try:
+            entries = json.loads(content.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            print("[AUTO PUSH] Log từ GitHub không hợp lệ.")
+            return None
+        if not isinstance(entries, list):
+            print("[AUTO PUSH] Log từ GitHub không phải danh sách entry.")
+            return None
+        return [entry for entry in entries if isinstance(entry, dict)]
+
     def convert_remote_legacy_log(self, legacy_path: str = "Subtitles/processed_files.log") -> Optional[List[Dict[str, Any]]]:
         """Nếu repo còn log dạng cũ, chuyển sang JSON và xóa file cũ."""
         try:
-            content, sha = self.client.get_content(legacy_path)
+            content = self._read_raw_file(legacy_path)
         except Exception:
             return None
         if not content:
             return None
 
-        lines = content.decode("utf-8").strip().splitlines()
+        lines = content.decode("utf-8", errors="replace").strip().splitlines()
         converted: List[Dict[str, Any]] = []
         for line in lines:
             parts = line.split("|")
@@ -186,13 +723,17 @@ class RemoteSyncManager:
             return None
 
         remote_path = f"{self.config.logs_dir}/legacy_{datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.json"
-        self.client.put_content(
-            remote_path,
-            json.dumps(converted, ensure_ascii=False, indent=2).encode("utf-8"),
-            message="Convert legacy processed_files log",
-        )
-        if sha:
-            self.client.delete_content(legacy_path, sha, message="Remove legacy processed_files.log")
+        payload = json.dumps(converted, ensure_ascii=False, indent=2).encode("utf-8")
+        if self.config.batch_commits:
+            # Thêm file mới và xóa log cũ trong cùng một commit
+            self.client.commit_files({remote_path: payload, legacy_path: None}, "Convert legacy processed_files log")
+        else:
+            sha = self._legacy_sha(legacy_path)
+            self.client.put_content(remote_path, payload, message="Convert legacy processed_files log")
+            if sha:
+                self.client.delete_content(legacy_path, sha, message="Remove legacy processed_files.log")
+        if self.state:
+            self.state.remember(legacy_path, None)
         print(f"[AUTO PUSH] Đã chuyển đổi {legacy_path} thành {remote_path}")
         return converted
 
@@ -208,63 +749,165 @@ class RemoteSyncManager:
         """
         category = entry.get("category", "video")
         file_path = local_path or local_file
+        self._wait_refresh()  # Cần chữ ký từ log remote để bỏ entry trùng
 
         if category == "video":
             signature = entry.get("signature")
-            if signature and signature in self.signatures:
-                return
-            self.signatures[signature] = entry
-            self.pending_entries.append(entry)
+            legacy_signature = entry.get("legacy_signature")
+            with self._lock:
+                if signature and signature in self.signatures:
+                    return
+                if legacy_signature and legacy_signature in self.signatures:
+                    return
+                self.signatures[signature] = entry
+                if legacy_signature:
+                    self.signatures[legacy_signature] = entry
+                self.pending_entries.append(entry)
         elif category == "subtitle":
+            if self.config.batch_commits:
+                if file_path and os.path.exists(file_path):
+                    entry["remote_path"] = self._stage_file(file_path, prefix=self.config.subtitle_dir)
+                with self._lock:
+                    self.pending_entries.append(entry)
+                    full = self.config.batch_size and len(self.pending_files) >= self.config.batch_size
+                if full:
+                    self._commit_pending()
+                return
+            # Upload chạy trên pool nền, flush() chờ mọi upload xong rồi mới ghi log
             if file_path and os.path.exists(file_path):
-                remote_path = self._upload_file(file_path, prefix=self.config.subtitle_dir)
+                remote_path = self._remote_path(file_path, prefix=self.config.subtitle_dir)
                 entry["remote_path"] = remote_path
-            self.pending_entries.append(entry)
+                future = self.client.submit(self._upload_file, file_path, self.config.subtitle_dir, remote_path)
+                with self._lock:
+                    self._uploads.append((future, entry, file_path))
+            with self._lock:
+                self.pending_entries.append(entry)
         else:
-            self.pending_entries.append(entry)
+            with self._lock:
+                self.pending_entries.append(entry)
 
-    def flush(self) -> None:
-        """Upload toàn bộ pending entries vào log trên GitHub."""
-        if not self.pending_entries:
-            return
+    def has_pending(self) -> bool:
+        """Còn entry/file chưa lên GitHub."""
+        with self._lock:
+            return bool(self.pending_entries or self.pending_files or self._uploads or self._failed_uploads)
 
-        merged_entries = self.log_entries + self.pending_entries
-        try:
-            new_sha = self.client.put_content(
-                self.config.log_path,
-                json.dumps(merged_entries, ensure_ascii=False, indent=2).encode("utf-8"),
-                message=f"Update logs ({len(self.pending_entries)} entries)",
-                sha=self.log_sha,
-            )
-            self.log_entries = merged_entries
-            self.log_sha = new_sha
+    def flush(self) -> bool:
+        """Ghi pending entries thành segment log mới (kèm file đang chờ nếu commit theo lô).
+
+        Trả về True nếu không còn gì chờ đồng bộ.
+        """
+        self._wait_refresh()
+        if self.config.batch_commits:
+            return self._commit_pending()
+        self._retry_failed_uploads()
+        self.wait_uploads()
+        with self._lock:
+            # Entry có subtitle chưa lên GitHub chờ lần flush sau (remote_path chưa tồn tại)
+            failed = {id(entry) for entry, _path in self._failed_uploads}
+            ready = [entry for entry in self.pending_entries if id(entry) not in failed]
+            if ready:
+                segments = build_segments(ready, self.config.segments_dir, self.config.segment_max_entries)
+                if not self._publish(segments, f"Append log segment ({len(ready)} entries)"):
+                    return False
+                self.log_entries.extend(ready)
+                self.pending_entries = [entry for entry in self.pending_entries if id(entry) in failed]
+                print("[AUTO PUSH] Đã đồng bộ log lên GitHub.")
+            if self.pending_entries:
+                print(f"[AUTO PUSH] {len(self.pending_entries)} subtitle upload lỗi, sẽ thử lại ở lần đồng bộ sau.")
+                return False
+            return True
+
+    def _retry_failed_uploads(self) -> None:
+        """Upload lại các subtitle lỗi ở lần flush trước (cùng remote_path đã ghi trong entry)."""
+        with self._lock:
+            failed, self._failed_uploads = self._failed_uploads, []
+        for entry, file_path in failed:
+            if not os.path.exists(file_path):
+                print(f"[AUTO PUSH] {file_path} không còn ở máy, ghi log không kèm subtitle.")
+                entry.pop("remote_path", None)
+                continue
+            future = self.client.submit(self._upload_file, file_path, self.config.subtitle_dir, entry.get("remote_path"))
+            with self._lock:
+                self._uploads.append((future, entry, file_path))
+
+    def _commit_pending(self) -> bool:
+        """Commit mọi file đang chờ cùng segment log mới trong một commit (Git Data API)."""
+        with self._lock:
+            if not self.pending_files and not self.pending_entries:
+                return True
+            segments = build_segments(self.pending_entries, self.config.segments_dir, self.config.segment_max_entries)
+            message = f"Sync {len(self.pending_files)} files, {len(self.pending_entries)} log entries"
+            if not self._publish(segments, message, files=self.pending_files):
+                return False
+            print(f"[AUTO PUSH] Đã đồng bộ {len(self.pending_files)} file và {len(self.pending_entries)} entry log trong một commit.")
+            self.log_entries.extend(self.pending_entries)
+            self.pending_files = {}
             self.pending_entries = []
-            print("[AUTO PUSH] Đã đồng bộ log lên GitHub.")
-        except Exception as exc:
-            print(f"[AUTO PUSH] Không thể cập nhật log: {exc}")
+            return True
 
-    def _upload_file(self, local_path: str, prefix: str) -> str:
-        """Upload file và trả về đường dẫn remote."""
-        file_name = os.path.basename(local_path)
+    def wait_uploads(self) -> None:
+        """Chờ các upload từng file trên pool chạy xong; upload lỗi được giữ lại để thử lại."""
+        with self._lock:
+            uploads, self._uploads = self._uploads, []
+        for future, entry, file_path in uploads:
+            try:
+                future.result()
+            except Exception as exc:
+                print(f"[AUTO PUSH] Không thể upload {file_path}: {exc}")
+                with self._lock:
+                    self._failed_uploads.append((entry, file_path))
+
+    def summary(self) -> str:
+        return self.client.stats.summary()
+
+    def close(self) -> None:
+        self._wait_refresh()
+        self.wait_uploads()
+        self.client.close()
+        if self.state:
+            self.state.save()
+
+    @staticmethod
+    def _remote_path(local_path: str, prefix: str) -> str:
         timestamp = datetime.datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-        remote_path = f"{prefix}/{timestamp}_{file_name}"
+        return f"{prefix}/{timestamp}_{os.path.basename(local_path)}"
+
+    def _stage_file(self, local_path: str, prefix: str) -> str:
+        """Đọc file vào lô chờ commit và trả về đường dẫn remote."""
+        remote_path = self._remote_path(local_path, prefix)
         try:
             with open(local_path, "rb") as f:
                 content = f.read()
-            self.client.put_content(
-                remote_path,
-                content,
-                message=f"Upload {file_name}",
-            )
-            print(f"[AUTO PUSH] Đã upload file {file_name} lên {remote_path}")
         except Exception as exc:
-            print(f"[AUTO PUSH] Không thể upload {local_path}: {exc}")
+            print(f"[AUTO PUSH] Không thể đọc {local_path}: {exc}")
+            return remote_path
+        with self._lock:
+            self.pending_files[remote_path] = content
+        return remote_path
+
+    def _upload_file(self, local_path: str, prefix: str, remote_path: Optional[str] = None) -> str:
+        """Upload file và trả về đường dẫn remote."""
+        file_name = os.path.basename(local_path)
+        remote_path = remote_path or self._remote_path(local_path, prefix)
+        with open(local_path, "rb") as f:
+            content = f.read()
+        self.client.put_content(
+            remote_path,
+            content,
+            message=f"Upload {file_name}",
+        )
+        print(f"[AUTO PUSH] Đã upload file {file_name} lên {remote_path}")
         return remote_path
 
     def upload_log_snapshot(self, entries: List[Dict[str, Any]], filename_prefix: str = "run") -> Optional[str]:
         if not entries:
             return None
         remote_path = f"{self.config.logs_dir}/{filename_prefix}_{datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.json"
+        if self.config.batch_commits:
+            # Đi cùng commit của lần flush kế tiếp
+            with self._lock:
+                self.pending_files[remote_path] = json.dumps(entries, ensure_ascii=False, indent=2).encode("utf-8")
+            return remote_path
         try:
             self.client.put_content(
                 remote_path,
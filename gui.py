@@ -15,7 +15,10 @@ from pathlib import Path
 
 import requests
 
-from config_manager import load_user_config, save_user_config
+from config_manager import get_config_dir, load_user_config, save_user_config
+from ffmpeg_progress import add_listener
+from history_store import HISTORY_FILE, HistoryStore
+from scan_journal import ScanJournal
 
 # Đảm bảo thư mục chứa script nằm trong sys.path
 BASE_DIR = Path(getattr(sys, '_MEIPASS', Path(__file__).resolve().parent))
@@ -91,6 +94,9 @@ class MKVProcessorGUI:
         
         # Queue để giao tiếp giữa thread xử lý và GUI
         self.log_queue = queue.Queue()
+        # Sự kiện tiến độ ffmpeg (phát từ thread xử lý) và tiến độ mới nhất của từng job
+        self.progress_queue = queue.Queue()
+        self.job_progress = {}
         
         # Biến trạng thái
         self.is_processing = False
@@ -107,6 +113,7 @@ class MKVProcessorGUI:
         
         self.setup_ui()
         self.check_dependencies()
+        add_listener(self.progress_queue.put)
         self.process_log_queue()
         
     def setup_ui(self):
@@ -223,6 +230,8 @@ class MKVProcessorGUI:
 
         self.progress = ttk.Progressbar(parent, mode="indeterminate")
         self.progress.pack(fill=tk.X, pady=5)
+        self.progress_label = ttk.Label(parent, text="", font=("Consolas", 9))
+        self.progress_label.pack(fill=tk.X)
 
         log_frame = ttk.LabelFrame(parent, text="📝 Nhật ký xử lý", padding=10)
         log_frame.pack(fill=tk.BOTH, expand=True, pady=5)
@@ -367,9 +376,39 @@ class MKVProcessorGUI:
         except queue.Empty:
             pass
         finally:
+            self.update_progress()
             # Lên lịch kiểm tra lại sau 100ms
             self.root.after(100, self.process_log_queue)
             
+    def update_progress(self):
+        """Cập nhật thanh tiến độ theo các sự kiện ffmpeg (%, MB/s, ETA từng job)"""
+        changed = False
+        try:
+            while True:
+                event = self.progress_queue.get_nowait()
+                if event.done:
+                    self.job_progress.pop(event.label, None)
+                else:
+                    self.job_progress[event.label] = event
+                changed = True
+        except queue.Empty:
+            pass
+        if not changed:
+            return
+
+        percents = [event.percent for event in self.job_progress.values() if event.percent is not None]
+        if percents:
+            if str(self.progress.cget("mode")) != "determinate":
+                self.progress.stop()
+                self.progress.config(mode="determinate", maximum=100)
+            self.progress["value"] = sum(percents) / len(percents)
+        elif self.is_processing and str(self.progress.cget("mode")) != "indeterminate":
+            self.progress.config(mode="indeterminate")
+            self.progress.start()
+        self.progress_label.config(
+            text="   ".join(event.describe() for event in list(self.job_progress.values())[:3])
+        )
+
     def check_dependencies(self):
         """Kiểm tra dependencies"""
         def check():
@@ -494,16 +533,34 @@ class MKVProcessorGUI:
             )
             return
             
-        # Đếm file MKV
+        # Đếm file MKV (qua scan journal: biết luôn bao nhiêu file mới/thay đổi từ lần chạy trước)
         try:
-            mkv_files = [f for f in os.listdir(folder) if f.lower().endswith('.mkv')]
-            count = len(mkv_files)
-            if count > 0:
+            scan = None
+            try:
+                journal = ScanJournal(get_config_dir() / "scan_journal.sqlite3")
+                try:
+                    scan = journal.scan(folder)
+                finally:
+                    journal.close()
+            except Exception:
+                pass
+            if scan is not None:
+                count = scan.total
+                pending = len(scan.pending)
+            else:
+                count = len([f for f in os.listdir(folder) if f.lower().endswith('.mkv')])
+                pending = count
+            if count > 0 and pending == 0:
+                self.folder_status.config(
+                    text=f"Thư mục: ✅ {count} file MKV, không có file mới kể từ lần chạy trước",
+                    foreground="green"
+                )
+            elif count > 0:
                 self.folder_status.config(
-                    text=f"Thư mục: ✅ {count} file MKV tìm thấy",
+                    text=f"Thư mục: ✅ {count} file MKV tìm thấy ({pending} mới/thay đổi)",
                     foreground="green"
                 )
-                self.log(f"Tìm thấy {count} file MKV trong thư mục", "INFO")
+                self.log(f"Tìm thấy {count} file MKV trong thư mục, {pending} file mới hoặc đã thay đổi", "INFO")
             else:
                 self.folder_status.config(
                     text="Thư mục: ⚠️ Không có file MKV",
@@ -573,6 +630,8 @@ class MKVProcessorGUI:
         self.is_processing = True
         self.process_btn.config(state=tk.DISABLED)
         self.stop_btn.config(state=tk.NORMAL)
+        self.job_progress.clear()
+        self.progress.config(mode="indeterminate", value=0)
         self.progress.start()
         self.processing_error = False
         self.log_text.delete(1.0, tk.END)
@@ -655,6 +714,8 @@ class MKVProcessorGUI:
         self.process_btn.config(state=tk.NORMAL)
         self.stop_btn.config(state=tk.DISABLED)
         self.progress.stop()
+        self.job_progress.clear()
+        self.progress_label.config(text="")
         if self.processing_error:
             self.log("Quá trình kết thúc nhưng có lỗi. Xem log chi tiết.", "WARNING")
             messagebox.showwarning("Hoàn thành (có lỗi)", "Đã kết thúc nhưng xuất hiện lỗi. Vui lòng xem log để biết chi tiết.")
@@ -663,8 +724,25 @@ class MKVProcessorGUI:
             messagebox.showinfo("Hoàn thành", "Đã xử lý xong tất cả file!")
         
     def view_processed_log(self):
-        """Mở thư mục logs và hiển thị file JSON mới nhất."""
+        """Hiển thị lịch sử xử lý (SQLite) của thư mục đang chọn, hoặc file JSON mới nhất nếu chưa có."""
         logs_dir = Path(self.logs_dir_var.get() or "logs")
+        if not logs_dir.is_absolute():
+            logs_dir = Path(self.current_folder.get() or ".") / logs_dir  # script.main chạy trong thư mục input
+        history_path = logs_dir / HISTORY_FILE
+        if history_path.exists():
+            # WAL: đọc được cả khi job đang ghi
+            try:
+                history = HistoryStore(history_path)
+                try:
+                    entries = history.recent(limit=1000)
+                finally:
+                    history.close()
+            except Exception as e:
+                messagebox.showerror("Lỗi", f"Không thể đọc lịch sử xử lý: {e}")
+                return
+            self.show_log_window(f"📊 Lịch sử: {history_path.name} ({len(entries)} entry mới nhất)", entries)
+            return
+
         if not logs_dir.exists():
             messagebox.showinfo("Thông tin", f"Chưa có thư mục logs ({logs_dir}).")
             return
@@ -675,19 +753,23 @@ class MKVProcessorGUI:
             return
 
         latest = json_files[0]
+        try:
+            parsed = json.loads(latest.read_text(encoding="utf-8"))
+        except Exception as e:
+            parsed = f"Lỗi khi đọc log: {e}"
+        self.show_log_window(f"📊 Log: {latest.name}", parsed)
+
+    def show_log_window(self, title, content):
         log_window = tk.Toplevel(self.root)
-        log_window.title(f"📊 Log: {latest.name}")
+        log_window.title(title)
         log_window.geometry("900x600")
 
         text_widget = scrolledtext.ScrolledText(log_window, wrap=tk.WORD)
         text_widget.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-
-        try:
-            content = latest.read_text(encoding="utf-8")
-            parsed = json.loads(content)
-            text_widget.insert(1.0, json.dumps(parsed, ensure_ascii=False, indent=2))
-        except Exception as e:
-            text_widget.insert(1.0, f"Lỗi khi đọc log: {e}")
+        if isinstance(content, str):
+            text_widget.insert(1.0, content)
+        else:
+            text_widget.insert(1.0, json.dumps(content, ensure_ascii=False, indent=2))
 
     def copy_log_text(self):
         """Copy toàn bộ log hiện tại vào clipboard"""
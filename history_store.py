@@ -0,0 +1,237 @@
+"""
+Lịch sử file đã xử lý trong một file SQLite (WAL) duy nhất.
+Thay cho Subtitles/processed_files.log (đọc hết vào dict mỗi lần chạy) và các
+snapshot legacy_*.json / run_*.json / remote_sync_*.json trong thư mục logs.
+- Tra cứu theo tên cũ/mới và chữ ký dùng index, không phải nạp cả lịch sử.
+- Ghi theo lô qua append_many (log_writer.LogWriter gom entry của các job).
+- WAL cho phép GUI đọc trong lúc job đang ghi.
+- Định dạng cũ chỉ được import một lần (bảng `imports` ghi lại nguồn đã import).
+"""
+from __future__ import annotations
+
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+
+HISTORY_FILE = "processed_history.sqlite3"
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL")
+ENTRY_FIELDS = (
+    "old_name",
+    "new_name",
+    "timestamp",
+    "signature",
+    "legacy_signature",
+    "category",
+    "output_path",
+    "language",
+    "notes",
+    "remote_path",
+)
+SKIP_CATEGORIES = ("stalled",)  # Entry không có nghĩa là file đã xử lý xong
+
+
+class HistoryStore:
+    """Kho lịch sử xử lý, an toàn khi nhiều thread cùng ghi."""
+
+    def __init__(self, db_path: Path, synchronous: str = "NORMAL"):
+        self.db_path = Path(db_path)
+        synchronous = synchronous.upper()
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"synchronous không hợp lệ: {synchronous}")
+        self._lock = threading.RLock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={synchronous}")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                old_name TEXT,
+                new_name TEXT,
+                timestamp TEXT,
+                signature TEXT,
+                legacy_signature TEXT,
+                category TEXT NOT NULL DEFAULT 'video',
+                output_path TEXT,
+                language TEXT,
+                notes TEXT,
+                remote_path TEXT,
+                source TEXT
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_entries_unique
+                ON entries(category, old_name, new_name, timestamp);
+            CREATE INDEX IF NOT EXISTS idx_entries_old_name ON entries(old_name);
+            CREATE INDEX IF NOT EXISTS idx_entries_new_name ON entries(new_name);
+            CREATE INDEX IF NOT EXISTS idx_entries_signature ON entries(signature);
+            CREATE INDEX IF NOT EXISTS idx_entries_legacy_signature ON entries(legacy_signature);
+            CREATE INDEX IF NOT EXISTS idx_entries_category ON entries(category);
+            CREATE TABLE IF NOT EXISTS imports (
+                source TEXT PRIMARY KEY,
+                imported_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                entries INTEGER
+            );
+            """
+        )
+        self._conn.commit()
+
+    # --- Ghi ---
+
+    def append_many(self, entries: Iterable[Dict[str, Any]], source: Optional[str] = None) -> int:
+        """Ghi ngay nhiều entry (bỏ qua entry trùng). Trả về số entry mới."""
+        with self._lock:
+            return self._insert_locked(list(entries), source)
+
+    def _insert_locked(self, entries: List[Dict[str, Any]], source: Optional[str]) -> int:
+        if not entries:
+            return 0
+        before = self._conn.total_changes
+        self._conn.executemany(
+            f"INSERT OR IGNORE INTO entries ({', '.join(ENTRY_FIELDS)}, source) "
+            f"VALUES ({', '.join('?' for _ in ENTRY_FIELDS)}, ?)",
+            [_entry_row(entry) + (source,) for entry in entries],
+        )
+        self._conn.commit()
+        return self._conn.total_changes - before
+
+    # --- Tra cứu ---
+
+    def lookup_name(self, name: str) -> Optional[Dict[str, Any]]:
+        """Entry gần nhất có tên cũ hoặc tên mới là `name`."""
+        if not name:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT * FROM entries WHERE (old_name = ? OR new_name = ?) "
+                f"AND category NOT IN ({', '.join('?' for _ in SKIP_CATEGORIES)}) ORDER BY id DESC LIMIT 1",
+                (name, name, *SKIP_CATEGORIES),
+            ).fetchone()
+        return _row_entry(row)
+
+    def lookup_signature(self, signatures: Iterable[Optional[str]]) -> Optional[Dict[str, Any]]:
+        """Entry video đầu tiên khớp một trong các chữ ký (dấu vân tay hoặc chữ ký cũ)."""
+        wanted = [signature for signature in signatures if signature]
+        if not wanted:
+            return None
+        with self._lock:
+            for signature in wanted:
+                row = self._conn.execute(
+                    "SELECT * FROM entries WHERE category = 'video' AND (signature = ? OR legacy_signature = ?) "
+                    "ORDER BY id DESC LIMIT 1",
+                    (signature, signature),
+                ).fetchone()
+                if row is not None:
+                    return _row_entry(row)
+        return None
+
+    def recent(self, limit: int = 500, category: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Các entry mới nhất (cho GUI)."""
+        query = "SELECT * FROM entries"
+        params: List[Any] = []
+        if category:
+            query += " WHERE category = ?"
+            params.append(category)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [_row_entry(row) for row in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    # --- Chữ ký cũ ---
+
+    def legacy_signatures(self) -> List[str]:
+        """Chữ ký của các entry video chưa có dấu vân tay (dạng size_duration)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT signature FROM entries WHERE category = 'video' AND signature IS NOT NULL "
+                "AND signature != '' AND signature NOT LIKE 'b2:%' AND legacy_signature IS NULL"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def migrate_signatures(self, mapping: Dict[str, str]) -> int:
+        """Đổi chữ ký cũ sang dấu vân tay (chữ ký cũ chuyển sang cột legacy_signature)."""
+        if not mapping:
+            return 0
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "UPDATE entries SET legacy_signature = signature, signature = ? "
+                "WHERE signature = ? AND legacy_signature IS NULL",
+                [(fingerprint, legacy) for legacy, fingerprint in mapping.items()],
+            )
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    # --- Import định dạng cũ ---
+
+    def was_imported(self, source: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM imports WHERE source = ?", (source,)).fetchone() is not None
+
+    def import_entries(self, source: str, entries: Iterable[Dict[str, Any]]) -> int:
+        """Import một nguồn cũ đúng một lần. Trả về số entry mới (0 nếu đã import trước đó)."""
+        with self._lock:
+            if self.was_imported(source):
+                return 0
+            added = self._insert_locked(list(entries), source)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO imports (source, entries) VALUES (?, ?)", (source, added)
+            )
+            self._conn.commit()
+            return added
+
+    def copy_from(self, db_path: Path) -> int:
+        """Nạp entry và các nguồn đã import từ kho SQLite khác mà không ghi gì vào thư mục của nó.
+
+        Không có file -wal (không ai đang ghi) thì mở dạng immutable để SQLite không tạo
+        -wal/-shm; có thì mở chỉ đọc bình thường để thấy cả phần chưa checkpoint.
+        Trả về số entry mới.
+        """
+        db_path = Path(db_path).resolve()
+        wal = db_path.with_name(db_path.name + "-wal")
+        mode = "mode=ro" if wal.exists() else "mode=ro&immutable=1"
+        source = sqlite3.connect(f"{db_path.as_uri()}?{mode}", uri=True)
+        source.row_factory = sqlite3.Row
+        try:
+            rows = source.execute("SELECT * FROM entries ORDER BY id").fetchall()
+            imports = source.execute("SELECT source, imported_at, entries FROM imports").fetchall()
+        finally:
+            source.close()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                f"INSERT OR IGNORE INTO entries ({', '.join(ENTRY_FIELDS)}, source) "
+                f"VALUES ({', '.join('?' for _ in ENTRY_FIELDS)}, ?)",
+                [_entry_row(_row_entry(row)) + (row["source"],) for row in rows],
+            )
+            added = self._conn.total_changes - before
+            self._conn.executemany("INSERT OR IGNORE INTO imports VALUES (?, ?, ?)", [tuple(row) for row in imports])
+            self._conn.commit()
+            return added
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _entry_row(entry: Dict[str, Any]) -> tuple:
+    row = []
+    for field in ENTRY_FIELDS:
+        value = entry.get(field)
+        if field == "category":
+            value = value or "video"
+        row.append(None if value is None else str(value))
+    return tuple(row)
+
+
+def _row_entry(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+    if row is None:
+        return None
+    return {field: row[field] for field in ENTRY_FIELDS}
@@ -0,0 +1,124 @@
+"""
+Bộ lập lịch chạy nhiều file cùng lúc với giới hạn theo ổ đĩa.
+Mỗi job khai báo các device (st_dev) nó đọc/ghi; job chỉ được chạy khi mọi
+device đó còn slot, nên hai job không cùng giã một ổ HDD trong khi ổ khác rảnh.
+Job bị chặn không chặn hàng đợi: job phía sau dùng ổ khác vẫn được chạy trước.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional
+
+
+def device_of(path: str) -> Optional[int]:
+    """st_dev của path, hoặc của thư mục cha gần nhất đã tồn tại (cho output chưa tạo)."""
+    current = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(current).st_dev
+        except OSError:
+            parent = os.path.dirname(current)
+            if parent == current:
+                return None
+            current = parent
+
+
+@dataclass
+class _Job:
+    func: Callable[[], Any]
+    devices: FrozenSet[int]
+    label: str
+    future: Future = field(default_factory=Future)
+
+
+class JobScheduler:
+    """Thread pool giới hạn tổng số job (`max_jobs`) và số job mỗi device (`per_device`)."""
+
+    def __init__(self, max_jobs: int, per_device: int = 1, max_pending: Optional[int] = None):
+        self.max_jobs = max(1, int(max_jobs))
+        self.per_device = max(1, int(per_device))
+        self.max_pending = max_pending if max_pending is not None else self.max_jobs * 2
+        self._cond = threading.Condition()
+        self._queue: List[_Job] = []
+        self._busy: Counter = Counter()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"job-{i}", daemon=True)
+            for i in range(self.max_jobs)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, func: Callable[[], Any], devices: Iterable[Optional[int]] = (), label: str = "") -> Future:
+        """Đưa job vào hàng đợi. Chặn khi đã có `max_pending` job chờ (giữ bộ nhớ và prefetch có giới hạn)."""
+        job = _Job(func=func, devices=frozenset(d for d in devices if d is not None), label=label)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("JobScheduler đã đóng")
+            while len(self._queue) >= self.max_pending:
+                self._cond.wait()
+            self._queue.append(job)
+            self._cond.notify_all()
+        return job.future
+
+    def _can_run_locked(self, job: _Job) -> bool:
+        return all(self._busy[device] < self.per_device for device in job.devices)
+
+    def _take_locked(self) -> Optional[_Job]:
+        for position, job in enumerate(self._queue):
+            if self._can_run_locked(job):
+                del self._queue[position]
+                for device in job.devices:
+                    self._busy[device] += 1
+                return job
+        return None
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                job = self._take_locked()
+                while job is None:
+                    if self._closed and not self._queue:
+                        return
+                    self._cond.wait()
+                    job = self._take_locked()
+                self._cond.notify_all()  # Có chỗ trống trong hàng đợi cho submit()
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        job.future.set_result(job.func())
+                    except BaseException as exc:
+                        job.future.set_exception(exc)
+            finally:
+                with self._cond:
+                    for device in job.devices:
+                        self._busy[device] -= 1
+                        if self._busy[device] <= 0:
+                            del self._busy[device]
+                    self._cond.notify_all()
+
+    def shutdown(self, wait: bool = True, cancel_pending: bool = False) -> None:
+        with self._cond:
+            self._closed = True
+            if cancel_pending:
+                for job in self._queue:
+                    job.future.cancel()
+                self._queue.clear()
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def active_devices(self) -> Dict[int, int]:
+        with self._cond:
+            return dict(self._busy)
+
+    def __enter__(self) -> "JobScheduler":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.shutdown(wait=True, cancel_pending=exc_type is not None)
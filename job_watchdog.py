@@ -0,0 +1,190 @@
+"""
+Watchdog cho các job ffmpeg: kill tiến trình treo thay vì để cả lượt chạy đứng.
+Mỗi job được theo dõi hai tín hiệu hoạt động: tiến độ ffmpeg (out_time/total_size
+tăng) và kích thước file output tăng. Job bị kill khi:
+- không có hoạt động nào trong `stall_seconds` (ví dụ ổ SMB bị treo), hoặc
+- chạy quá ngân sách thời gian = `budget_factor` x (kích thước nguồn / thông
+  lượng đo được từ các job trước), tối thiểu `min_budget` giây.
+Việc stat file output chạy ở thread phụ để một ổ mạng treo không chặn luôn
+vòng kiểm tra của watchdog.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from process_engine import ProcessHandle, ProcessResult
+
+
+STALL_REASON = "stall"
+BUDGET_REASON = "budget"
+WATCHDOG_REASONS = (STALL_REASON, BUDGET_REASON)
+MIN_SAMPLE_BYTES = 64 * 1024 * 1024  # Job nhỏ hơn không dùng để đo thông lượng
+
+
+class JobStalledError(RuntimeError):
+    """Job ffmpeg bị watchdog kill (treo hoặc quá ngân sách thời gian)."""
+
+    def __init__(self, reason: str, label: str, detail: str, result: Optional[ProcessResult] = None):
+        super().__init__(f"{label}: {detail}")
+        self.reason = reason
+        self.label = label
+        self.detail = detail
+        self.result = result
+
+
+@dataclass
+class WatchedJob:
+    label: str
+    outputs: Tuple[str, ...]
+    source_size: int
+    budget: float
+    started: float
+    last_activity: float
+    handle: Optional[ProcessHandle] = None
+    kill_reason: Optional[str] = None
+    kill_detail: Optional[str] = None
+    _out_time_us: int = -1
+    _total_size: int = -1
+    _output_size: int = -1
+    _clock: Callable[[], float] = field(default=time.monotonic, repr=False)
+
+    def on_progress(self, event) -> None:
+        """Listener tiến độ: chỉ tính là hoạt động khi out_time hoặc total_size thực sự tăng."""
+        if event.out_time_us > self._out_time_us or event.total_size > self._total_size:
+            self._out_time_us = max(self._out_time_us, event.out_time_us)
+            self._total_size = max(self._total_size, event.total_size)
+            self.last_activity = self._clock()
+
+    def sample_outputs(self) -> None:
+        size = 0
+        for path in self.outputs:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        if size > self._output_size:
+            self._output_size = size
+            self.last_activity = self._clock()
+
+
+class JobWatchdog:
+    """Thread nền kiểm tra định kỳ các job đang chạy và kill job treo/quá hạn."""
+
+    def __init__(
+        self,
+        stall_seconds: float = 300,
+        budget_factor: float = 4.0,
+        min_budget: float = 900,
+        assumed_mb_per_s: float = 10.0,
+        poll_interval: float = 5.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.stall_seconds = float(stall_seconds)
+        self.budget_factor = float(budget_factor)
+        self.min_budget = float(min_budget)
+        self.assumed_bytes_per_s = max(0.1, float(assumed_mb_per_s)) * 1024 ** 2
+        self.poll_interval = float(poll_interval)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._jobs: List[WatchedJob] = []
+        self._throughput: Optional[float] = None  # byte nguồn/giây, trung bình trượt
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._sampler: Optional[threading.Thread] = None
+
+    @property
+    def throughput(self) -> float:
+        return self._throughput or self.assumed_bytes_per_s
+
+    def budget_for(self, source_size: int) -> float:
+        if self.budget_factor <= 0:
+            return float("inf")
+        return max(self.min_budget, self.budget_factor * source_size / self.throughput)
+
+    def watch(self, label: str, outputs: Sequence[str], source_size: int) -> WatchedJob:
+        now = self._clock()
+        job = WatchedJob(
+            label=label,
+            outputs=tuple(outputs),
+            source_size=int(source_size or 0),
+            budget=self.budget_for(int(source_size or 0)),
+            started=now,
+            last_activity=now,
+            _clock=self._clock,
+        )
+        with self._lock:
+            self._jobs.append(job)
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="job-watchdog", daemon=True)
+                self._thread.start()
+        return job
+
+    def attach(self, job: WatchedJob, handle: ProcessHandle) -> None:
+        job.handle = handle
+        if job.kill_reason:
+            handle.kill(job.kill_reason)  # Watchdog quyết định kill trước khi kịp gắn handle
+
+    def finish(self, job: WatchedJob, result: Optional[ProcessResult]) -> None:
+        """Bỏ theo dõi job; job thành công đủ lớn được dùng để cập nhật thông lượng."""
+        with self._lock:
+            if job in self._jobs:
+                self._jobs.remove(job)
+            if result is None or result.returncode != 0 or job.source_size < MIN_SAMPLE_BYTES:
+                return
+            elapsed = self._clock() - job.started
+            if elapsed <= 0:
+                return
+            sample = job.source_size / elapsed
+            self._throughput = sample if self._throughput is None else 0.7 * self._throughput + 0.3 * sample
+
+    def check(self) -> List[Tuple[WatchedJob, str]]:
+        """Kill các job treo/quá hạn. Trả về [(job, lý do)] vừa bị kill."""
+        now = self._clock()
+        killed = []
+        with self._lock:
+            jobs = list(self._jobs)
+        for job in jobs:
+            if job.kill_reason:
+                continue
+            idle = now - job.last_activity
+            runtime = now - job.started
+            if self.stall_seconds > 0 and idle > self.stall_seconds:
+                reason = STALL_REASON
+                job.kill_detail = f"không có tiến độ trong {idle:.0f}s"
+            elif runtime > job.budget:
+                reason = BUDGET_REASON
+                job.kill_detail = f"chạy {runtime:.0f}s, vượt ngân sách {job.budget:.0f}s"
+            else:
+                continue
+            job.kill_reason = reason
+            print(f"[WATCHDOG] Dừng {job.label}: {job.kill_detail}")
+            if job.handle is not None:
+                job.handle.kill(reason)
+            killed.append((job, reason))
+        return killed
+
+    def _sample_outputs(self, jobs: List[WatchedJob]) -> None:
+        for job in jobs:
+            job.sample_outputs()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            with self._lock:
+                jobs = list(self._jobs)
+                if not jobs:
+                    self._thread = None
+                    return
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(
+                    target=self._sample_outputs, args=(jobs,), name="job-watchdog-stat", daemon=True
+                )
+                self._sampler.start()
+            self.check()
+
+    def stop(self) -> None:
+        self._stop.set()
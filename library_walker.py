@@ -0,0 +1,163 @@
+"""
+Duyệt đệ quy thư viện phim (vd. /media/<thể loại>/<tên phim>/*.mkv).
+- Mỗi thư mục được liệt kê đúng một lần bằng os.scandir; size/mtime/inode lấy
+  từ DirEntry (Windows không cần stat riêng từng file, Linux chỉ stat file MKV).
+- Các thư mục con được duyệt song song trên thread pool: ổ mạng có độ trễ cao
+  cho mỗi lệnh gọi nên chờ song song nhiều thư mục nhanh hơn hẳn duyệt tuần tự.
+- Kết quả trả về dần (generator) theo từng thư mục ngay khi liệt kê xong, pipeline
+  xử lý bắt đầu trước khi duyệt hết thư viện.
+- Bỏ qua thư mục output của tool, thư mục ẩn và symlink tới thư mục (tránh vòng lặp).
+"""
+from __future__ import annotations
+
+import fnmatch
+import os
+import threading
+import unicodedata
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from scan_journal import DEFAULT_SUFFIXES, ScanEntry
+
+
+DEFAULT_SKIP_DIRS = ("Original", "Lồng Tiếng - Thuyết Minh", "Subtitles")  # Thư mục output của tool
+DEFAULT_WORKERS = 8
+
+
+def _nfc(name: str) -> str:
+    # macOS/SMB có thể trả tên tiếng Việt dạng NFD
+    return unicodedata.normalize("NFC", name)
+
+
+@dataclass
+class WalkedDirectory:
+    path: str
+    depth: int
+    entries: Dict[str, ScanEntry] = field(default_factory=dict)
+    filtered: bool = False  # Có file MKV bị loại bởi include/exclude
+
+    def paths(self) -> List[str]:
+        return [os.path.join(self.path, name) for name in sorted(self.entries)]
+
+
+class LibraryWalker:
+    """Duyệt thư viện theo include/exclude glob và độ sâu tối đa.
+
+    Glob được so với đường dẫn tương đối so với thư mục gốc (dùng `/`) và với tên
+    file/thư mục, vd. `Phim lẻ/*`, `*sample*`. Exclude áp dụng cho cả thư mục
+    (không duyệt vào), include chỉ áp dụng cho file. `max_depth=0` chỉ xét thư mục gốc.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        suffixes: Sequence[str] = DEFAULT_SUFFIXES,
+        include: Sequence[str] = (),
+        exclude: Sequence[str] = (),
+        max_depth: Optional[int] = None,
+        workers: int = DEFAULT_WORKERS,
+        skip_dirs: Sequence[str] = DEFAULT_SKIP_DIRS,
+    ):
+        self.root = os.path.abspath(root)
+        self.suffixes = tuple(s.lower() for s in suffixes)
+        self.include = [p for p in include if p]
+        self.exclude = [p for p in exclude if p]
+        self.max_depth = max_depth if max_depth is None or max_depth >= 0 else None
+        self.workers = max(1, int(workers))
+        self.skip_dirs: Set[str] = {_nfc(name) for name in skip_dirs}
+        self.directories_listed = 0
+        self.files_found = 0
+        self.errors: List[Tuple[str, str]] = []
+        self._lock = threading.Lock()
+
+    def _relative(self, path: str) -> str:
+        return path[len(self.root):].lstrip(os.sep).replace(os.sep, "/")
+
+    @staticmethod
+    def _matches(patterns: Sequence[str], relative: str, name: str) -> bool:
+        return any(fnmatch.fnmatch(relative, p) or fnmatch.fnmatch(name, p) for p in patterns)
+
+    def depth_of(self, path: str) -> int:
+        """Độ sâu của thư mục so với gốc (gốc = 0)."""
+        relative = self._relative(os.path.abspath(path))
+        return relative.count("/") + 1 if relative else 0
+
+    def accepts_directory(self, path: str) -> bool:
+        """Thư mục con `path` có được duyệt không (độ sâu, thư mục output/ẩn, exclude)."""
+        if self.max_depth is not None and self.depth_of(path) > self.max_depth:
+            return False
+        name = _nfc(os.path.basename(path))
+        if name.startswith(".") or name in self.skip_dirs:
+            return False
+        return not self._matches(self.exclude, _nfc(self._relative(path)), name)
+
+    def accepts_file(self, path: str) -> bool:
+        """File `path` có khớp đuôi và include/exclude không (không stat)."""
+        name = _nfc(os.path.basename(path))
+        if not name.lower().endswith(self.suffixes):
+            return False
+        relative = _nfc(self._relative(path))
+        if self.include and not self._matches(self.include, relative, name):
+            return False
+        return not self._matches(self.exclude, relative, name)
+
+    def _list(self, path: str, depth: int) -> Tuple[WalkedDirectory, List[str]]:
+        directory = WalkedDirectory(path=path, depth=depth)
+        subdirs: List[str] = []
+        with os.scandir(path) as iterator:
+            for entry in iterator:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if self.accepts_directory(entry.path):
+                            subdirs.append(entry.path)
+                        continue
+                    if not entry.name.lower().endswith(self.suffixes) or not entry.is_file():
+                        continue
+                    if not self.accepts_file(entry.path):
+                        directory.filtered = True
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                directory.entries[entry.name] = ScanEntry(entry.name, st.st_size, st.st_mtime_ns, entry.inode() or st.st_ino)
+        with self._lock:
+            self.directories_listed += 1
+            self.files_found += len(directory.entries)
+        return directory, subdirs
+
+    def directories(self, include_empty: bool = False) -> Iterator[WalkedDirectory]:
+        """Các thư mục có file MKV (mọi thư mục nếu `include_empty`), theo thứ tự liệt kê xong."""
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="walk")
+        pending: Dict[Future, str] = {executor.submit(self._list, self.root, 0): self.root}
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    try:
+                        directory, subdirs = future.result()
+                    except OSError as exc:
+                        if path == self.root:
+                            raise
+                        print(f"[SCAN] Không thể đọc thư mục {path}: {exc}")
+                        self.errors.append((path, str(exc)))
+                        continue
+                    for subdir in subdirs:
+                        pending[executor.submit(self._list, subdir, directory.depth + 1)] = subdir
+                    if directory.entries or include_empty:
+                        yield directory
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def files(self) -> Iterator[str]:
+        for directory in self.directories():
+            yield from directory.paths()
+
+    def summary(self) -> str:
+        text = f"{self.files_found} file MKV trong {self.directories_listed} thư mục"
+        if self.errors:
+            text += f", {len(self.errors)} thư mục không đọc được"
+        return text
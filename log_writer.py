@@ -0,0 +1,231 @@
+"""
+Ghi log file đã xử lý theo lô, không chặn vòng xử lý.
+- Entry được gom trong bộ nhớ và ghi xuống kho lịch sử (hoặc processed_files.log
+  khi không có kho) khi đủ `batch_size` entry hoặc sau `flush_interval` giây.
+- Chính sách fsync: "always" (ghi và fsync ngay từng entry), "batch" (fsync mỗi
+  lô; SQLite WAL synchronous=NORMAL), "none" (để hệ điều hành tự ghi).
+- Đồng bộ remote (upload subtitle, ghi entry lên GitHub) chạy ở thread nền riêng
+  qua hàng đợi, job không phải chờ HTTP. Entry được ghi vào outbox trên đĩa trước
+  (sync_outbox.SyncOutbox) và chỉ bị xóa khỏi đó khi đã lên GitHub; thread nền
+  đẩy log lên remote mỗi `remote_flush_interval` giây trong lượt chạy dài. Entry
+  không ghi nhận được (lỗi mạng...) được thử lại ở các lần đẩy đó, chu kỳ giãn gấp
+  đôi sau mỗi lần lỗi liên tiếp.
+Writer không bao giờ probe file: chữ ký phải có sẵn trong entry.
+"""
+from __future__ import annotations
+
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from history_store import HistoryStore
+from sync_outbox import SyncOutbox
+
+
+FSYNC_POLICIES = ("always", "batch", "none")
+HISTORY_SYNCHRONOUS = {"always": "FULL", "batch": "NORMAL", "none": "OFF"}
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_FLUSH_INTERVAL = 5.0
+DEFAULT_REMOTE_FLUSH_INTERVAL = 300.0
+MAX_REMOTE_RETRY_INTERVAL = 3600.0  # Lỗi liên tiếp: giãn chu kỳ đồng bộ tới tối đa 1 giờ
+
+_STOP = object()
+_FLUSH = object()
+
+
+class LogWriter:
+    """Gom entry log của nhiều job và ghi theo lô; chuyển việc đồng bộ remote cho thread nền."""
+
+    def __init__(
+        self,
+        history: Optional[HistoryStore] = None,
+        fallback_log: Optional[str] = None,
+        remote=None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        fsync: str = "batch",
+        outbox: Optional[SyncOutbox] = None,
+        remote_flush_interval: float = DEFAULT_REMOTE_FLUSH_INTERVAL,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync phải là một trong {FSYNC_POLICIES}")
+        self.history = history
+        self.fallback_log = fallback_log
+        self.remote = remote
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = float(flush_interval)
+        self.fsync = fsync
+        self.outbox = outbox if remote is not None else None
+        self.remote_flush_interval = float(remote_flush_interval)
+        self.written = 0
+        self._lock = threading.Lock()
+        self._pending: List[Dict[str, Any]] = []
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._remote_queue: "queue.Queue[Any]" = queue.Queue()
+        self._remote_thread: Optional[threading.Thread] = None
+        self._unsynced: List[Optional[str]] = []  # Id outbox của entry đã đưa cho remote nhưng chưa lên GitHub
+        self._failed: List[Tuple[Optional[str], Dict[str, Any], Optional[str]]] = []  # record_entry lỗi, chờ thử lại
+        self._remote_failures = 0  # Số lần đồng bộ lỗi liên tiếp (backoff)
+        if self.flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, name="log-writer", daemon=True)
+            self._flusher.start()
+        if remote is not None:
+            self._remote_thread = threading.Thread(target=self._remote_loop, name="log-remote-sync", daemon=True)
+            self._remote_thread.start()
+
+    def write(self, entry: Dict[str, Any], local_path: Optional[str] = None, sync_remote: bool = True) -> None:
+        """Thêm entry vào lô; entry được đưa sang thread đồng bộ remote nếu có và `sync_remote`."""
+        with self._lock:
+            self._pending.append(entry)
+            if self.fsync == "always" or len(self._pending) >= self.batch_size:
+                self._flush_locked()
+        if sync_remote:
+            self.sync_remote(entry, local_path)
+
+    def sync_remote(self, entry: Dict[str, Any], local_path: Optional[str] = None) -> None:
+        """Ghi entry vào outbox rồi đưa sang thread đồng bộ remote (không ghi lịch sử)."""
+        if self.remote is None:
+            return
+        record_id = self.outbox.add(entry, local_path) if self.outbox is not None else None
+        self._remote_queue.put((record_id, entry, local_path))
+
+    def replay_outbox(self) -> int:
+        """Đồng bộ tiếp các entry chưa lên GitHub của lần chạy trước. Trả về số entry."""
+        if self.outbox is None:
+            return 0
+        records = self.outbox.pending()
+        if not records:
+            return 0
+        if self.history is not None:
+            # Lô lịch sử có thể chưa kịp ghi khi crash; entry trùng tự bị bỏ qua
+            self.history.append_many((record.entry for record in records), source="run")
+        for record in records:
+            self._remote_queue.put((record.id, record.entry, record.local_path))
+        return len(records)
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            if self.history is not None:
+                self.history.append_many(batch, source="run")
+            elif self.fallback_log:
+                self._append_text_log(batch)
+            self.written += len(batch)
+        except Exception as exc:
+            print(f"[LOG] Không thể ghi {len(batch)} entry: {exc}")
+            self._pending = batch + self._pending  # Thử lại ở lần flush sau
+
+    def _append_text_log(self, batch: List[Dict[str, Any]]) -> None:
+        with open(self.fallback_log, "a", encoding="utf-8") as f:
+            for entry in batch:
+                f.write(
+                    f"{entry.get('old_name')}|{entry.get('new_name')}|{entry.get('timestamp')}|{entry.get('signature') or ''}\n"
+                )
+            if self.fsync != "none":
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _remote_interval(self) -> float:
+        """Chu kỳ đẩy log lên remote, gấp đôi sau mỗi lần lỗi liên tiếp."""
+        return min(
+            max(self.remote_flush_interval, MAX_REMOTE_RETRY_INTERVAL),
+            self.remote_flush_interval * 2 ** min(self._remote_failures, 16),
+        )
+
+    def _remote_loop(self) -> None:
+        last_flush = time.monotonic()
+        while True:
+            timeout = None
+            if (self._unsynced or self._failed) and self.remote_flush_interval > 0:
+                timeout = max(0.0, last_flush + self._remote_interval() - time.monotonic())
+            try:
+                item = self._remote_queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush_remote()
+                last_flush = time.monotonic()
+                continue
+            try:
+                if item is _STOP:
+                    return
+                if item is _FLUSH:
+                    self._flush_remote()
+                    last_flush = time.monotonic()
+                    continue
+                if not self._record(item):
+                    # Không ack: entry còn trong outbox, thử lại ở lần đẩy log định kỳ
+                    self._failed.append(item)
+                    continue
+                if not self.remote.has_pending():
+                    # Entry trùng bị bỏ qua hoặc lô đã tự commit khi đủ remote_batch_size
+                    self._ack_unsynced()
+            finally:
+                self._remote_queue.task_done()
+
+    def _record(self, item: Tuple[Optional[str], Dict[str, Any], Optional[str]]) -> bool:
+        record_id, entry, local_path = item
+        try:
+            self.remote.record_entry(entry, local_path=local_path)
+        except Exception as exc:
+            print(f"[AUTO PUSH] Không thể ghi log lên GitHub: {exc}")
+            return False
+        self._unsynced.append(record_id)
+        return True
+
+    def _flush_remote(self) -> None:
+        failed, self._failed = self._failed, []
+        for item in failed:
+            if not self._record(item):
+                self._failed.append(item)
+        try:
+            ok = self.remote.flush()
+        except Exception as exc:
+            print(f"[AUTO PUSH] Không thể đồng bộ log lên GitHub: {exc}")
+            ok = False
+        if ok:
+            self._ack_unsynced()
+        if ok and not self._failed:
+            self._remote_failures = 0
+        else:
+            self._remote_failures += 1
+            if self.remote_flush_interval > 0:
+                print(f"[AUTO PUSH] Sẽ thử đồng bộ lại sau {self._remote_interval():.0f} giây.")
+
+    def _ack_unsynced(self) -> None:
+        ids, self._unsynced = self._unsynced, []
+        if self.outbox is not None:
+            self.outbox.ack(ids)
+
+    def drain_remote(self) -> None:
+        """Chờ thread nền đồng bộ xong mọi entry đã nhận."""
+        if self._remote_thread is not None:
+            self._remote_queue.join()
+
+    def flush_remote(self) -> None:
+        """Chờ thread nền nhận hết entry rồi đẩy log lên remote ngay (outbox được ack nếu thành công)."""
+        if self._remote_thread is not None:
+            self._remote_queue.put(_FLUSH)
+            self._remote_queue.join()
+
+    def close(self) -> None:
+        """Ghi nốt lô còn lại và dừng các thread nền (chờ đồng bộ remote xong)."""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        if self._remote_thread is not None:
+            self._remote_queue.put(_STOP)
+            self._remote_thread.join()
+            self._remote_thread = None
@@ -0,0 +1,179 @@
+"""
+Thông tin media của một file video, được probe đúng một lần mỗi lượt chạy.
+Các hàm xử lý trong script.py nhận MediaInfo thay vì tự gọi ffprobe.
+"""
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from probe_cache import ProbeCache
+
+
+UNKNOWN_RESOLUTION = "unknown_resolution"
+FFPROBE_TIMEOUT = 120
+
+
+class ProbeError(RuntimeError):
+    """ffprobe thất bại hoặc quá thời gian."""
+
+
+def resolution_label(width: int, height: int) -> str:
+    """Trả về nhãn độ phân giải (8K, 4K, 2K, FHD, HD, 480p...)."""
+    # 8k
+    if width >= 7680 or height >= 4320:
+        return "8K"
+    # 4k
+    if width >= 3840 or height >= 2160:  # Bao gồm cả 3840x1608
+        return "4K"
+    # 2k
+    if width >= 2560 or height >= 1440:
+        return "2K"
+    # FHD
+    if width >= 1920 or height >= 1080:
+        return "FHD"
+    # HD
+    if width >= 1280 or height >= 720:
+        return "HD"
+    # 480p
+    if width >= 720 or height >= 480:
+        return "480p"
+    return f"{width}p"
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    """Kết quả probe bất biến của một file (streams, tags, nhãn, chữ ký)."""
+
+    path: str
+    size: int
+    streams: Tuple[Dict[str, Any], ...]
+    format_info: Dict[str, Any]
+    resolution_label: str
+    year: str
+    signature: Optional[str]  # Dấu vân tay nội dung (fingerprint.py), hoặc chữ ký cũ nếu không có
+    legacy_signature: Optional[str] = None  # Chữ ký cũ `size_duration`, để khớp log cũ
+
+    @property
+    def format_tags(self) -> Dict[str, Any]:
+        return self.format_info.get("tags", {}) or {}
+
+    @property
+    def duration(self) -> str:
+        return str(self.format_info.get("duration", "0"))
+
+    @property
+    def probe_data(self) -> Dict[str, Any]:
+        """Dạng dict giống `ffmpeg.probe` để tương thích code cũ."""
+        return {"streams": list(self.streams), "format": self.format_info}
+
+    def streams_of(self, codec_type: str) -> List[Dict[str, Any]]:
+        return [stream for stream in self.streams if stream.get("codec_type") == codec_type]
+
+    @property
+    def video_streams(self) -> List[Dict[str, Any]]:
+        return self.streams_of("video")
+
+    @property
+    def audio_streams(self) -> List[Dict[str, Any]]:
+        return self.streams_of("audio")
+
+    @property
+    def subtitle_streams(self) -> List[Dict[str, Any]]:
+        return self.streams_of("subtitle")
+
+    @property
+    def first_audio(self) -> Optional[Dict[str, Any]]:
+        audio_streams = self.audio_streams
+        return audio_streams[0] if audio_streams else None
+
+
+def _resolution_from_streams(streams: List[Dict[str, Any]]) -> str:
+    video_stream = next((stream for stream in streams if stream.get("codec_type") == "video"), None)
+    if video_stream and "width" in video_stream and "height" in video_stream:
+        return resolution_label(int(video_stream["width"]), int(video_stream["height"]))
+    return UNKNOWN_RESOLUTION
+
+
+def media_info_from_probe(
+    file_path: str, probe_data: Dict[str, Any], size: Optional[int] = None, signature: Optional[str] = None
+) -> MediaInfo:
+    """Dựng MediaInfo từ dữ liệu probe đã có (không gọi ffprobe).
+
+    `signature` là dấu vân tay nội dung nếu đã tính; không có thì dùng chữ ký cũ.
+    """
+    streams = list(probe_data.get("streams", []))
+    format_info = dict(probe_data.get("format", {}) or {})
+    if size is None:
+        size = os.path.getsize(file_path)
+    duration = format_info.get("duration", "0")
+    year = str((format_info.get("tags", {}) or {}).get("year", "")).strip()
+    return MediaInfo(
+        path=file_path,
+        size=size,
+        streams=tuple(streams),
+        format_info=format_info,
+        resolution_label=_resolution_from_streams(streams),
+        year=year,
+        signature=signature or f"{size}_{duration}",
+        legacy_signature=f"{size}_{duration}",
+    )
+
+
+def run_probe(file_path: str, native: bool = True) -> Dict[str, Any]:
+    """Probe file: ưu tiên parser Matroska native, fallback về ffprobe."""
+    if native:
+        from mkv_reader import MatroskaParseError, probe_matroska
+
+        try:
+            return probe_matroska(file_path)
+        except MatroskaParseError:
+            pass  # Không phải MKV hoặc header lạ -> để ffprobe xử lý
+    return ffprobe_json(file_path)
+
+
+def ffprobe_json(file_path: str, timeout: float = FFPROBE_TIMEOUT) -> Dict[str, Any]:
+    """Gọi ffprobe qua process_engine (thay ffmpeg.probe), cùng định dạng kết quả."""
+    import json
+
+    from process_engine import run_process
+
+    cmd = ["ffprobe", "-show_format", "-show_streams", "-of", "json", file_path]
+    try:
+        from ffmpeg_helper import get_ffmpeg_command
+
+        cmd = get_ffmpeg_command(cmd)
+    except ImportError:
+        pass
+    result = run_process(cmd, timeout=timeout)
+    if result.timed_out:
+        raise ProbeError(f"ffprobe quá {timeout:.0f}s với {file_path}")
+    if result.returncode != 0:
+        raise ProbeError(f"ffprobe lỗi: {result.stderr.decode('utf-8', errors='replace').strip()}")
+    return json.loads(result.stdout.decode("utf-8"))
+
+
+def probe_media_info(
+    file_path: str,
+    cache: Optional["ProbeCache"] = None,
+    native: bool = True,
+    signature: Optional[str] = None,
+) -> MediaInfo:
+    """Probe một lần (hoặc lấy từ cache) và trả về MediaInfo. Ném lỗi nếu probe thất bại."""
+    st = os.stat(file_path)
+    probe_data = None
+    if cache:
+        try:
+            probe_data = cache.get(file_path, st)
+        except Exception as exc:
+            print(f"[CACHE] Không thể đọc probe cache: {exc}")
+    if probe_data is None:
+        probe_data = run_probe(file_path, native=native)
+        if cache:
+            try:
+                cache.put(file_path, probe_data, st)
+            except Exception as exc:
+                print(f"[CACHE] Không thể ghi probe cache: {exc}")
+    return media_info_from_probe(file_path, probe_data, size=st.st_size, signature=signature)
@@ -0,0 +1,254 @@
+"""
+Sửa header Matroska tại chỗ (giống mkvpropedit): đổi FlagDefault/FlagEnabled,
+tên và ngôn ngữ track mà không remux cả file.
+Element Tracks được ghi lại trong đúng vùng cũ, phần dư/thiếu được bù bằng
+element Void ngay sau Tracks, nên vị trí mọi element khác (SeekHead, Cues,
+Cluster) giữ nguyên. Không đủ chỗ thì ném NotEnoughSpaceError để người gọi
+quay về remux.
+"""
+from __future__ import annotations
+
+import mmap
+import os
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+from mkv_reader import (
+    FLAG_DEFAULT,
+    FLAG_ENABLED,
+    LANGUAGE,
+    LANGUAGE_IETF,
+    TRACK_ENTRY,
+    TRACK_NAME,
+    TRACKS,
+    VOID,
+    MatroskaFile,
+    MatroskaParseError,
+    parse_matroska,
+    parse_matroska_buffer,
+    read_element_header,
+)
+
+
+CRC32 = 0xBF
+MAX_VINT_LENGTH = 8
+
+
+class MatroskaEditError(MatroskaParseError):
+    """Không sửa được header tại chỗ (file đã bị khôi phục nguyên trạng nếu đã ghi)."""
+
+
+class NotEnoughSpaceError(MatroskaEditError):
+    """Tracks mới không vừa vùng cũ + Void phía sau."""
+
+
+@dataclass
+class TrackEdit:
+    """Thay đổi cho một track; None nghĩa là giữ nguyên."""
+
+    number: int  # TrackNumber Matroska (không phải stream index: xem mkv_reader.track_for_stream)
+    flag_default: Optional[int] = None
+    flag_enabled: Optional[int] = None
+    name: Optional[str] = None
+    language: Optional[str] = None
+    language_ietf: Optional[str] = None
+
+
+def encode_id(element_id: int) -> bytes:
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+
+
+def encode_vint(value: int, length: Optional[int] = None) -> bytes:
+    """Mã hóa size dạng vint. `length` ép số byte (dùng khi cần khớp đúng kích thước)."""
+    minimum = 1
+    while value >= (1 << (7 * minimum)) - 1:
+        minimum += 1
+    length = max(length or minimum, minimum)
+    if length > MAX_VINT_LENGTH:
+        raise MatroskaEditError(f"Kích thước quá lớn cho vint: {value}")
+    return ((1 << (7 * length)) | value).to_bytes(length, "big")
+
+
+def encode_element(element_id: int, data: bytes, size_length: Optional[int] = None) -> bytes:
+    return encode_id(element_id) + encode_vint(len(data), size_length) + data
+
+
+def encode_uint(value: int) -> bytes:
+    return value.to_bytes(max(1, (value.bit_length() + 7) // 8), "big")
+
+
+def void_element(total_size: int) -> bytes:
+    """Element Void chiếm đúng `total_size` byte (tối thiểu 2)."""
+    if total_size < 2:
+        raise NotEnoughSpaceError("Không thể tạo Void nhỏ hơn 2 byte")
+    if total_size - 2 <= 126:
+        return bytes([VOID]) + encode_vint(total_size - 2, 1) + b"\x00" * (total_size - 2)
+    return bytes([VOID]) + encode_vint(total_size - 9, 8) + b"\x00" * (total_size - 9)
+
+
+def _children(buf, start: int, end: int):
+    """(id, offset element, offset data, offset kết thúc) của từng element con."""
+    pos = start
+    while pos < end:
+        element_id, header_len, size, unknown = read_element_header(buf, pos, end)
+        if unknown or pos + header_len + size > end:
+            raise MatroskaEditError(f"Element 0x{element_id:X} không hợp lệ trong Tracks")
+        yield element_id, pos, pos + header_len, pos + header_len + size
+        pos = pos + header_len + size
+
+
+def _with_crc(payload: bytes, had_crc: bool) -> bytes:
+    if not had_crc:
+        return payload
+    crc = zlib.crc32(payload) & 0xFFFFFFFF
+    return encode_element(CRC32, crc.to_bytes(4, "little")) + payload
+
+
+def _rebuild_track_entry(buf, start: int, end: int, edit: TrackEdit) -> bytes:
+    replacements: Dict[int, Optional[bytes]] = {}
+    if edit.flag_default is not None:
+        replacements[FLAG_DEFAULT] = encode_uint(edit.flag_default)
+    if edit.flag_enabled is not None:
+        replacements[FLAG_ENABLED] = encode_uint(edit.flag_enabled)
+    if edit.name is not None:
+        replacements[TRACK_NAME] = edit.name.encode("utf-8")
+    if edit.language is not None:
+        replacements[LANGUAGE] = edit.language.encode("ascii")
+        # LanguageIETF cũ được player ưu tiên -> bỏ đi nếu không có giá trị mới
+        replacements[LANGUAGE_IETF] = edit.language_ietf.encode("ascii") if edit.language_ietf else None
+    elif edit.language_ietf is not None:
+        replacements[LANGUAGE_IETF] = edit.language_ietf.encode("ascii")
+
+    parts: List[bytes] = []
+    written = set()
+    had_crc = False
+    for element_id, offset, data_start, data_end in _children(buf, start, end):
+        if element_id == CRC32:
+            had_crc = True
+        elif element_id in replacements:
+            if element_id not in written and replacements[element_id] is not None:
+                parts.append(encode_element(element_id, replacements[element_id]))
+            written.add(element_id)
+        else:
+            parts.append(bytes(buf[offset:data_end]))
+    for element_id, data in replacements.items():
+        if element_id not in written and data is not None:
+            parts.append(encode_element(element_id, data))
+    return _with_crc(b"".join(parts), had_crc)
+
+
+def build_tracks_element(buf, mkv: MatroskaFile, edits: Sequence[TrackEdit], size_length: Optional[int] = None) -> bytes:
+    """Dựng lại toàn bộ element Tracks với các thay đổi trong `edits`."""
+    offset, header_len, size = mkv.elements[TRACKS]
+    start = offset + header_len
+    by_number = {edit.number: edit for edit in edits}
+    numbers = {track.offset: track.number for track in mkv.tracks}
+    parts: List[bytes] = []
+    had_crc = False
+    edited = set()
+    for element_id, child_offset, data_start, data_end in _children(buf, start, start + size):
+        if element_id == CRC32:
+            had_crc = True
+            continue
+        if element_id == TRACK_ENTRY:
+            edit = by_number.get(numbers.get(child_offset))
+            if edit:
+                edited.add(edit.number)
+                parts.append(encode_element(TRACK_ENTRY, _rebuild_track_entry(buf, data_start, data_end, edit)))
+                continue
+        parts.append(bytes(buf[child_offset:data_end]))
+    missing = sorted(set(by_number) - edited)
+    if missing:
+        raise MatroskaEditError(f"Không có TrackEntry với TrackNumber {missing}")
+    return encode_element(TRACKS, _with_crc(b"".join(parts), had_crc), size_length)
+
+
+def available_space(buf, mkv: MatroskaFile, file_size: int) -> int:
+    """Số byte dành cho Tracks: vùng Tracks cũ cộng Void liền sau (nếu có)."""
+    offset, header_len, size = mkv.elements[TRACKS]
+    end = offset + header_len + size
+    if end < file_size:
+        try:
+            element_id, void_header, void_size, unknown = read_element_header(buf, end, file_size)
+        except MatroskaParseError:
+            element_id, unknown = None, True
+        if element_id == VOID and not unknown and end + void_header + void_size <= file_size:
+            end += void_header + void_size
+    return end - offset
+
+
+def plan_tracks_rewrite(buf, mkv: MatroskaFile, edits: Sequence[TrackEdit], file_size: int) -> bytes:
+    """Bytes mới cho vùng [Tracks, hết Void), cùng độ dài với vùng cũ."""
+    available = available_space(buf, mkv, file_size)
+    offset, header_len, _size = mkv.elements[TRACKS]
+    size_length = header_len - len(encode_id(TRACKS))
+    new_tracks = build_tracks_element(buf, mkv, edits, size_length)
+    leftover = available - len(new_tracks)
+    if leftover == 1:
+        # Không chứa nổi Void 1 byte -> nới size vint của Tracks thêm một byte
+        new_tracks = build_tracks_element(buf, mkv, edits, size_length + 1)
+        leftover = available - len(new_tracks)
+    if leftover < 0 or leftover == 1:
+        raise NotEnoughSpaceError(
+            f"Tracks mới cần {len(new_tracks)} byte, chỉ có {available} byte (kể cả Void)"
+        )
+    if leftover:
+        return new_tracks + void_element(leftover)
+    return new_tracks
+
+
+def _verify(path: str, edits: Sequence[TrackEdit]) -> None:
+    mkv = parse_matroska(path)
+    tracks = {track.number: track for track in mkv.tracks}
+    for edit in edits:
+        track = tracks.get(edit.number)
+        if track is None:
+            raise MatroskaEditError(f"Kiểm tra lại thất bại: mất track {edit.number}")
+        expected = {
+            "flag_default": edit.flag_default,
+            "flag_enabled": edit.flag_enabled,
+            "name": edit.name,
+            "language": edit.language,
+        }
+        for attr, value in expected.items():
+            if value is not None and getattr(track, attr) != value:
+                raise MatroskaEditError(f"Kiểm tra lại thất bại: track {edit.number} {attr}")
+
+
+def edit_tracks_in_place(path: str, edits: Sequence[TrackEdit]) -> int:
+    """Ghi lại Tracks tại chỗ. Trả về số byte đã ghi.
+
+    Ném NotEnoughSpaceError (file chưa bị động tới) hoặc MatroskaEditError
+    (đã khôi phục bytes cũ) khi thất bại.
+    """
+    if not edits:
+        return 0
+    with open(path, "r+b") as f:
+        st = os.fstat(f.fileno())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            mkv = parse_matroska_buffer(buf, path, st.st_size)
+            if TRACKS not in mkv.elements:
+                raise MatroskaEditError("Không tìm thấy Tracks")
+            new_bytes = plan_tracks_rewrite(buf, mkv, edits, st.st_size)
+            offset = mkv.elements[TRACKS][0]
+            backup = bytes(buf[offset:offset + len(new_bytes)])
+
+        current = os.fstat(f.fileno())
+        if (current.st_size, current.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+            raise MatroskaEditError("File đã thay đổi trong lúc chuẩn bị sửa header")
+        f.seek(offset)
+        f.write(new_bytes)
+        f.flush()
+        os.fsync(f.fileno())
+
+    try:
+        _verify(path, edits)
+    except (MatroskaParseError, IndexError) as exc:
+        with open(path, "r+b") as f:
+            f.seek(offset)
+            f.write(backup)
+            f.flush()
+            os.fsync(f.fileno())
+        raise MatroskaEditError(f"Header sau khi sửa không hợp lệ, đã khôi phục: {exc}") from exc
+    return len(new_bytes)
@@ -0,0 +1,806 @@
+"""
+Đọc header Matroska (EBML) bằng Python thuần, không cần ffprobe.
+Chỉ parse Segment Info, Tracks, Tags và Attachments (dùng SeekHead để nhảy tới
+các element nằm cuối file), dừng ở Cluster đầu tiên. Kết quả có thể chuyển
+thành dict giống `ffmpeg.probe` qua `to_probe_data`.
+"""
+from __future__ import annotations
+
+import datetime
+import mmap
+import os
+import struct
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+# Element IDs (giữ nguyên marker bits như trong đặc tả Matroska)
+EBML_HEADER = 0x1A45DFA3
+EBML_DOCTYPE = 0x4282
+SEGMENT = 0x18538067
+SEEKHEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TIMESTAMP_SCALE = 0x2AD7B1
+DURATION = 0x4489
+TITLE = 0x7BA9
+MUXING_APP = 0x4D80
+WRITING_APP = 0x5741
+DATE_UTC = 0x4461
+SEGMENT_UID = 0x73A4
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_UID = 0x73C5
+TRACK_TYPE = 0x83
+FLAG_ENABLED = 0xB9
+FLAG_DEFAULT = 0x88
+FLAG_FORCED = 0x55AA
+FLAG_HEARING_IMPAIRED = 0x55AB
+FLAG_VISUAL_IMPAIRED = 0x55AC
+FLAG_ORIGINAL = 0x55AE
+FLAG_COMMENTARY = 0x55AF
+TRACK_NAME = 0x536E
+LANGUAGE = 0x22B59C
+LANGUAGE_IETF = 0x22B59D
+CODEC_ID = 0x86
+CODEC_PRIVATE = 0x63A2
+DEFAULT_DURATION = 0x23E383
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+AUDIO = 0xE1
+SAMPLING_FREQUENCY = 0xB5
+CHANNELS = 0x9F
+BIT_DEPTH = 0x6264
+CONTENT_ENCODINGS = 0x6D80
+CONTENT_ENCODING = 0x6240
+CONTENT_ENCODING_ORDER = 0x5031
+CONTENT_ENCODING_SCOPE = 0x5032
+CONTENT_ENCODING_TYPE = 0x5033
+CONTENT_COMPRESSION = 0x5034
+CONTENT_COMP_ALGO = 0x4254
+CONTENT_COMP_SETTINGS = 0x4255
+CONTENT_ENCRYPTION = 0x5035
+TAGS = 0x1254C367
+TAG = 0x7373
+TARGETS = 0x63C0
+TARGET_TYPE = 0x63CA
+TAG_TRACK_UID = 0x63C5
+TAG_CHAPTER_UID = 0x63C4
+TAG_ATTACHMENT_UID = 0x63C6
+SIMPLE_TAG = 0x67C8
+TAG_NAME = 0x45A3
+TAG_LANGUAGE = 0x447A
+TAG_DEFAULT = 0x4484
+TAG_STRING = 0x4487
+ATTACHMENTS = 0x1941A469
+ATTACHED_FILE = 0x61A7
+FILE_NAME = 0x466E
+FILE_MIME_TYPE = 0x4660
+CLUSTER = 0x1F43B675
+VOID = 0xEC
+CRC32 = 0xBF
+
+TRACK_TYPE_VIDEO = 1
+TRACK_TYPE_AUDIO = 2
+TRACK_TYPE_SUBTITLE = 17
+
+CODEC_TYPES = {
+    TRACK_TYPE_VIDEO: "video",
+    TRACK_TYPE_AUDIO: "audio",
+    TRACK_TYPE_SUBTITLE: "subtitle",
+}
+
+# CodecID Matroska -> codec_name của ffprobe (khớp tiền tố, giống ff_mkv_codec_tags)
+CODEC_NAMES: Tuple[Tuple[str, str], ...] = (
+    ("V_MPEG4/ISO/AVC", "h264"),
+    ("V_MPEGH/ISO/HEVC", "hevc"),
+    ("V_MPEGI/ISO/VVC", "vvc"),
+    ("V_AV1", "av1"),
+    ("V_VP8", "vp8"),
+    ("V_VP9", "vp9"),
+    ("V_MPEG2", "mpeg2video"),
+    ("V_MPEG1", "mpeg1video"),
+    ("V_MPEG4/ISO/", "mpeg4"),
+    ("V_MPEG4/MS/V3", "msmpeg4v3"),
+    ("V_THEORA", "theora"),
+    ("V_PRORES", "prores"),
+    ("V_FFV1", "ffv1"),
+    ("V_MJPEG", "mjpeg"),
+    ("A_AAC", "aac"),
+    ("A_AC3", "ac3"),
+    ("A_EAC3", "eac3"),
+    ("A_DTS", "dts"),
+    ("A_TRUEHD", "truehd"),
+    ("A_MLP", "mlp"),
+    ("A_FLAC", "flac"),
+    ("A_OPUS", "opus"),
+    ("A_VORBIS", "vorbis"),
+    ("A_MPEG/L3", "mp3"),
+    ("A_MPEG/L2", "mp2"),
+    ("A_MPEG/L1", "mp1"),
+    ("A_ALAC", "alac"),
+    ("A_TTA1", "tta"),
+    ("A_WAVPACK4", "wavpack"),
+    ("S_TEXT/UTF8", "subrip"),
+    ("S_TEXT/ASCII", "text"),
+    ("S_TEXT/ASS", "ass"),
+    ("S_TEXT/SSA", "ass"),
+    ("S_ASS", "ass"),
+    ("S_SSA", "ass"),
+    ("S_TEXT/WEBVTT", "webvtt"),
+    ("S_HDMV/PGS", "hdmv_pgs_subtitle"),
+    ("S_HDMV/TEXTST", "hdmv_text_subtitle"),
+    ("S_VOBSUB", "dvd_subtitle"),
+    ("S_DVBSUB", "dvb_subtitle"),
+)
+
+PCM_CODECS = {
+    ("A_PCM/INT/LIT", 8): "pcm_u8",
+    ("A_PCM/INT/LIT", 16): "pcm_s16le",
+    ("A_PCM/INT/LIT", 24): "pcm_s24le",
+    ("A_PCM/INT/LIT", 32): "pcm_s32le",
+    ("A_PCM/INT/BIG", 16): "pcm_s16be",
+    ("A_PCM/INT/BIG", 24): "pcm_s24be",
+    ("A_PCM/INT/BIG", 32): "pcm_s32be",
+    ("A_PCM/FLOAT/IEEE", 32): "pcm_f32le",
+    ("A_PCM/FLOAT/IEEE", 64): "pcm_f64le",
+}
+
+ATTACHMENT_CODECS = {
+    "application/x-truetype-font": "ttf",
+    "application/x-font-ttf": "ttf",
+    "font/ttf": "ttf",
+    "application/vnd.ms-opentype": "otf",
+    "application/x-font-opentype": "otf",
+    "font/otf": "otf",
+    "font/sfnt": "ttf",
+}
+
+# Mốc thời gian của DateUTC (2001-01-01T00:00:00Z)
+MATROSKA_EPOCH = datetime.datetime(2001, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class MatroskaParseError(ValueError):
+    """File không phải Matroska hoặc header không đọc được bằng parser native."""
+
+
+@dataclass
+class ContentEncoding:
+    order: int = 0
+    scope: int = 1
+    encoding_type: int = 0
+    comp_algo: Optional[int] = None
+    comp_settings: bytes = b""
+    encrypted: bool = False
+
+
+@dataclass
+class MatroskaTrack:
+    number: int = 0
+    uid: int = 0
+    track_type: int = 0
+    codec_id: str = ""
+    codec_private: bytes = b""
+    name: Optional[str] = None
+    language: str = "eng"
+    language_ietf: Optional[str] = None
+    flag_enabled: int = 1
+    flag_default: int = 1
+    flag_forced: int = 0
+    flag_hearing_impaired: int = 0
+    flag_visual_impaired: int = 0
+    flag_original: int = 0
+    flag_commentary: int = 0
+    default_duration: Optional[int] = None
+    pixel_width: Optional[int] = None
+    pixel_height: Optional[int] = None
+    channels: int = 1
+    sampling_frequency: float = 8000.0
+    bit_depth: Optional[int] = None
+    encodings: List[ContentEncoding] = field(default_factory=list)
+    tags: Dict[str, str] = field(default_factory=dict)
+    offset: int = 0  # vị trí TrackEntry trong file
+
+
+@dataclass
+class MatroskaFile:
+    path: str
+    size: int
+    doc_type: str = "matroska"
+    segment_data_offset: int = 0
+    timestamp_scale: int = 1000000
+    duration: Optional[float] = None
+    title: Optional[str] = None
+    muxing_app: Optional[str] = None
+    writing_app: Optional[str] = None
+    date_utc: Optional[int] = None
+    segment_uid: Optional[bytes] = None
+    tracks: List[MatroskaTrack] = field(default_factory=list)
+    tags: Dict[str, str] = field(default_factory=dict)
+    attachments: List[Dict[str, str]] = field(default_factory=list)
+    # id -> (offset element, kích thước header, kích thước data)
+    elements: Dict[int, Tuple[int, int, int]] = field(default_factory=dict)
+
+    @property
+    def duration_us(self) -> Optional[int]:
+        """Duration theo micro giây, làm tròn giống matroskadec."""
+        if self.duration is None:
+            return None
+        return int(self.duration * float(self.timestamp_scale) * 1000 / 1000000)
+
+
+def read_vint(buf, pos: int, end: int) -> Tuple[int, int, bool]:
+    """Đọc số nguyên độ dài thay đổi (size). Trả về (giá trị, số byte, unknown size)."""
+    if pos >= end:
+        raise MatroskaParseError("Hết dữ liệu khi đọc vint")
+    first = buf[pos]
+    if first == 0:
+        raise MatroskaParseError(f"Vint không hợp lệ tại {pos}")
+    length = 1
+    mask = 0x80
+    while not first & mask:
+        mask >>= 1
+        length += 1
+    if pos + length > end:
+        raise MatroskaParseError("Vint vượt quá giới hạn element")
+    value = first & (mask - 1)
+    all_ones = value == mask - 1
+    for i in range(1, length):
+        byte = buf[pos + i]
+        value = (value << 8) | byte
+        all_ones = all_ones and byte == 0xFF
+    return value, length, all_ones
+
+
+def read_element_id(buf, pos: int, end: int) -> Tuple[int, int]:
+    """Đọc Element ID (giữ marker bits). Trả về (id, số byte)."""
+    if pos >= end:
+        raise MatroskaParseError("Hết dữ liệu khi đọc element ID")
+    first = buf[pos]
+    if first >= 0x80:
+        length = 1
+    elif first >= 0x40:
+        length = 2
+    elif first >= 0x20:
+        length = 3
+    elif first >= 0x10:
+        length = 4
+    else:
+        raise MatroskaParseError(f"Element ID không hợp lệ tại {pos}")
+    if pos + length > end:
+        raise MatroskaParseError("Element ID vượt quá giới hạn")
+    return int.from_bytes(buf[pos:pos + length], "big"), length
+
+
+def read_element_header(buf, pos: int, end: int) -> Tuple[int, int, int, bool]:
+    """Trả về (id, kích thước header, kích thước data, unknown size)."""
+    element_id, id_len = read_element_id(buf, pos, end)
+    size, size_len, unknown = read_vint(buf, pos + id_len, end)
+    return element_id, id_len + size_len, size, unknown
+
+
+def iter_children(buf, start: int, end: int) -> Iterator[Tuple[int, int, int]]:
+    """Duyệt các element con trong [start, end). Trả về (id, vị trí data, kích thước data)."""
+    pos = start
+    while pos < end:
+        element_id, header_len, size, unknown = read_element_header(buf, pos, end)
+        data_start = pos + header_len
+        if unknown:
+            raise MatroskaParseError("Element con có kích thước không xác định")
+        if data_start + size > end:
+            raise MatroskaParseError(f"Element 0x{element_id:X} vượt quá element cha")
+        yield element_id, data_start, size
+        pos = data_start + size
+
+
+def read_uint(buf, pos: int, size: int) -> int:
+    return int.from_bytes(buf[pos:pos + size], "big") if size else 0
+
+
+def read_sint(buf, pos: int, size: int) -> int:
+    return int.from_bytes(buf[pos:pos + size], "big", signed=True) if size else 0
+
+
+def read_float(buf, pos: int, size: int) -> float:
+    if size == 0:
+        return 0.0
+    if size == 4:
+        return struct.unpack(">f", buf[pos:pos + 4])[0]
+    if size == 8:
+        return struct.unpack(">d", buf[pos:pos + 8])[0]
+    raise MatroskaParseError(f"Float có kích thước không hợp lệ: {size}")
+
+
+def read_string(buf, pos: int, size: int) -> str:
+    return bytes(buf[pos:pos + size]).split(b"\x00", 1)[0].decode("utf-8", errors="replace")
+
+
+def _parse_info(buf, start: int, end: int, mkv: MatroskaFile) -> None:
+    for element_id, pos, size in iter_children(buf, start, end):
+        if element_id == TIMESTAMP_SCALE:
+            mkv.timestamp_scale = read_uint(buf, pos, size) or 1000000
+        elif element_id == DURATION:
+            mkv.duration = read_float(buf, pos, size)
+        elif element_id == TITLE:
+            mkv.title = read_string(buf, pos, size)
+        elif element_id == MUXING_APP:
+            mkv.muxing_app = read_string(buf, pos, size)
+        elif element_id == WRITING_APP:
+            mkv.writing_app = read_string(buf, pos, size)
+        elif element_id == DATE_UTC:
+            mkv.date_utc = read_sint(buf, pos, size)
+        elif element_id == SEGMENT_UID:
+            mkv.segment_uid = bytes(buf[pos:pos + size])
+
+
+def _parse_content_encodings(buf, start: int, end: int) -> List[ContentEncoding]:
+    encodings = []
+    for element_id, pos, size in iter_children(buf, start, end):
+        if element_id != CONTENT_ENCODING:
+            continue
+        encoding = ContentEncoding()
+        for child_id, child_pos, child_size in iter_children(buf, pos, pos + size):
+            if child_id == CONTENT_ENCODING_ORDER:
+                encoding.order = read_uint(buf, child_pos, child_size)
+            elif child_id == CONTENT_ENCODING_SCOPE:
+                encoding.scope = read_uint(buf, child_pos, child_size)
+            elif child_id == CONTENT_ENCODING_TYPE:
+                encoding.encoding_type = read_uint(buf, child_pos, child_size)
+            elif child_id == CONTENT_COMPRESSION:
+                encoding.comp_algo = 0
+                for comp_id, comp_pos, comp_size in iter_children(buf, child_pos, child_pos + child_size):
+                    if comp_id == CONTENT_COMP_ALGO:
+                        encoding.comp_algo = read_uint(buf, comp_pos, comp_size)
+                    elif comp_id == CONTENT_COMP_SETTINGS:
+                        encoding.comp_settings = bytes(buf[comp_pos:comp_pos + comp_size])
+            elif child_id == CONTENT_ENCRYPTION:
+                encoding.encrypted = True
+        encodings.append(encoding)
+    return encodings
+
+
+def _parse_track_entry(buf, offset: int, start: int, end: int) -> MatroskaTrack:
+    track = MatroskaTrack(offset=offset)
+    for element_id, pos, size in iter_children(buf, start, end):
+        if element_id == TRACK_NUMBER:
+            track.number = read_uint(buf, pos, size)
+        elif element_id == TRACK_UID:
+            track.uid = read_uint(buf, pos, size)
+        elif element_id == TRACK_TYPE:
+            track.track_type = read_uint(buf, pos, size)
+        elif element_id == FLAG_ENABLED:
+            track.flag_enabled = read_uint(buf, pos, size)
+        elif element_id == FLAG_DEFAULT:
+            track.flag_default = read_uint(buf, pos, size)
+        elif element_id == FLAG_FORCED:
+            track.flag_forced = read_uint(buf, pos, size)
+        elif element_id == FLAG_HEARING_IMPAIRED:
+            track.flag_hearing_impaired = read_uint(buf, pos, size)
+        elif element_id == FLAG_VISUAL_IMPAIRED:
+            track.flag_visual_impaired = read_uint(buf, pos, size)
+        elif element_id == FLAG_ORIGINAL:
+            track.flag_original = read_uint(buf, pos, size)
+        elif element_id == FLAG_COMMENTARY:
+            track.flag_commentary = read_uint(buf, pos, size)
+        elif element_id == TRACK_NAME:
+            track.name = read_string(buf, pos, size)
+        elif element_id == LANGUAGE:
+            track.language = read_string(buf, pos, size) or "eng"
+        elif element_id == LANGUAGE_IETF:
+            track.language_ietf = read_string(buf, pos, size)
+        elif element_id == CODEC_ID:
+            track.codec_id = read_string(buf, pos, size)
+        elif element_id == CODEC_PRIVATE:
+            track.codec_private = bytes(buf[pos:pos + size])
+        elif element_id == DEFAULT_DURATION:
+            track.default_duration = read_uint(buf, pos, size)
+        elif element_id == VIDEO:
+            for child_id, child_pos, child_size in iter_children(buf, pos, pos + size):
+                if child_id == PIXEL_WIDTH:
+                    track.pixel_width = read_uint(buf, child_pos, child_size)
+                elif child_id == PIXEL_HEIGHT:
+                    track.pixel_height = read_uint(buf, child_pos, child_size)
+        elif element_id == AUDIO:
+            for child_id, child_pos, child_size in iter_children(buf, pos, pos + size):
+                if child_id == SAMPLING_FREQUENCY:
+                    track.sampling_frequency = read_float(buf, child_pos, child_size)
+                elif child_id == CHANNELS:
+                    track.channels = read_uint(buf, child_pos, child_size)
+                elif child_id == BIT_DEPTH:
+                    track.bit_depth = read_uint(buf, child_pos, child_size)
+        elif element_id == CONTENT_ENCODINGS:
+            track.encodings = _parse_content_encodings(buf, pos, pos + size)
+    return track
+
+
+def _parse_tracks(buf, start: int, end: int, mkv: MatroskaFile) -> None:
+    pos = start
+    for element_id, data_pos, size in iter_children(buf, start, end):
+        if element_id == TRACK_ENTRY:
+            entry_offset = pos
+            mkv.tracks.append(_parse_track_entry(buf, entry_offset, data_pos, data_pos + size))
+        pos = data_pos + size
+
+
+def _set_tag(target: Dict[str, str], key: str, value: str) -> None:
+    """Ghi tag không phân biệt hoa thường, giống AVDictionary của FFmpeg."""
+    lowered = key.lower()
+    for existing in [k for k in target if k.lower() == lowered]:
+        del target[existing]
+    target[key] = value
+
+
+def _convert_simple_tags(buf, start: int, end: int, target: Dict[str, str], prefix: Optional[str]) -> None:
+    for element_id, pos, size in iter_children(buf, start, end):
+        if element_id != SIMPLE_TAG:
+            continue
+        name = None
+        value = None
+        lang = "und"
+        default = 1
+        has_nested = False
+        for child_id, child_pos, child_size in iter_children(buf, pos, pos + size):
+            if child_id == TAG_NAME:
+                name = read_string(buf, child_pos, child_size)
+            elif child_id == TAG_STRING:
+                value = read_string(buf, child_pos, child_size)
+            elif child_id == TAG_LANGUAGE:
+                lang = read_string(buf, child_pos, child_size) or "und"
+            elif child_id == TAG_DEFAULT:
+                default = read_uint(buf, child_pos, child_size)
+            elif child_id == SIMPLE_TAG:
+                has_nested = True
+        if not name:
+            continue
+        key = f"{prefix}/{name}" if prefix else name
+        lang_suffix = lang if lang != "und" else None
+        keys = []
+        if default or not lang_suffix:
+            keys.append(key)
+        if lang_suffix:
+            keys.append(f"{key}-{lang_suffix}")
+        for final_key in keys:
+            if value is not None:
+                _set_tag(target, final_key, value)
+            if has_nested:
+                # SimpleTag lồng nhau được đặt tên dạng "cha/con"
+                _convert_simple_tags(buf, pos, pos + size, target, final_key)
+
+
+def _apply_metadata_conv(target: Dict[str, str]) -> None:
+    for native, generic in (("LEAD_PERFORMER", "performer"), ("PART_NUMBER", "track")):
+        for key in [k for k in target if k.upper() == native]:
+            _set_tag(target, generic, target.pop(key))
+
+
+def _parse_tags(buf, start: int, end: int, mkv: MatroskaFile) -> None:
+    tracks_by_uid = {track.uid: track for track in mkv.tracks}
+    for element_id, pos, size in iter_children(buf, start, end):
+        if element_id != TAG:
+            continue
+        track_uid = 0
+        chapter_uid = 0
+        attachment_uid = 0
+        target_type = None
+        for child_id, child_pos, child_size in iter_children(buf, pos, pos + size):
+            if child_id != TARGETS:
+                continue
+            for target_id, target_pos, target_size in iter_children(buf, child_pos, child_pos + child_size):
+                if target_id == TAG_TRACK_UID:
+                    track_uid = read_uint(buf, target_pos, target_size)
+                elif target_id == TAG_CHAPTER_UID:
+                    chapter_uid = read_uint(buf, target_pos, target_size)
+                elif target_id == TAG_ATTACHMENT_UID:
+                    attachment_uid = read_uint(buf, target_pos, target_size)
+                elif target_id == TARGET_TYPE:
+                    target_type = read_string(buf, target_pos, target_size) or None
+        if attachment_uid or chapter_uid:
+            continue
+        if track_uid:
+            track = tracks_by_uid.get(track_uid)
+            if track is not None:
+                _convert_simple_tags(buf, pos, pos + size, track.tags, None)
+                _apply_metadata_conv(track.tags)
+        else:
+            _convert_simple_tags(buf, pos, pos + size, mkv.tags, target_type)
+            _apply_metadata_conv(mkv.tags)
+
+
+def _parse_attachments(buf, start: int, end: int, mkv: MatroskaFile) -> None:
+    for element_id, pos, size in iter_children(buf, start, end):
+        if element_id != ATTACHED_FILE:
+            continue
+        attachment: Dict[str, str] = {}
+        for child_id, child_pos, child_size in iter_children(buf, pos, pos + size):
+            if child_id == FILE_NAME:
+                attachment["filename"] = read_string(buf, child_pos, child_size)
+            elif child_id == FILE_MIME_TYPE:
+                attachment["mimetype"] = read_string(buf, child_pos, child_size)
+        mkv.attachments.append(attachment)
+
+
+def _parse_seekhead(buf, start: int, end: int) -> List[Tuple[int, int]]:
+    entries = []
+    for element_id, pos, size in iter_children(buf, start, end):
+        if element_id != SEEK:
+            continue
+        seek_id = None
+        seek_pos = None
+        for child_id, child_pos, child_size in iter_children(buf, pos, pos + size):
+            if child_id == SEEK_ID:
+                seek_id = read_uint(buf, child_pos, child_size)
+            elif child_id == SEEK_POSITION:
+                seek_pos = read_uint(buf, child_pos, child_size)
+        if seek_id is not None and seek_pos is not None:
+            entries.append((seek_id, seek_pos))
+    return entries
+
+
+def _check_ebml_header(buf, end: int) -> Tuple[str, int]:
+    element_id, header_len, size, unknown = read_element_header(buf, 0, end)
+    if element_id != EBML_HEADER or unknown:
+        raise MatroskaParseError("Không phải file EBML")
+    data_start = header_len
+    doc_type = "matroska"
+    for child_id, pos, child_size in iter_children(buf, data_start, data_start + size):
+        if child_id == EBML_DOCTYPE:
+            doc_type = read_string(buf, pos, child_size)
+    if doc_type not in ("matroska", "webm"):
+        raise MatroskaParseError(f"DocType không hỗ trợ: {doc_type}")
+    return doc_type, data_start + size
+
+
+WANTED_ELEMENTS = (INFO, TRACKS, TAGS, ATTACHMENTS)
+
+
+def parse_matroska_buffer(buf, file_path: str, file_size: int) -> MatroskaFile:
+    """Parse header Matroska từ buffer (mmap hoặc bytes)."""
+    end = file_size
+    doc_type, pos = _check_ebml_header(buf, end)
+    element_id, header_len, segment_size, unknown = read_element_header(buf, pos, end)
+    if element_id != SEGMENT:
+        raise MatroskaParseError("Không tìm thấy Segment")
+    segment_start = pos + header_len
+    segment_end = end if unknown else min(end, segment_start + segment_size)
+    mkv = MatroskaFile(path=file_path, size=file_size, doc_type=doc_type, segment_data_offset=segment_start)
+
+    parsers = {
+        INFO: _parse_info,
+        TRACKS: _parse_tracks,
+        TAGS: _parse_tags,
+        ATTACHMENTS: _parse_attachments,
+    }
+    found: Dict[int, Tuple[int, int, int]] = {}
+    seek_entries: List[Tuple[int, int]] = []
+    visited_seekheads = set()
+
+    def handle(element_id: int, offset: int, data_start: int, size: int) -> None:
+        if element_id in parsers and element_id not in found:
+            found[element_id] = (offset, data_start - offset, size)
+        elif element_id == SEEKHEAD and offset not in visited_seekheads:
+            visited_seekheads.add(offset)
+            seek_entries.extend(_parse_seekhead(buf, data_start, data_start + size))
+
+    # Duyệt tuần tự các element cấp cao cho tới Cluster đầu tiên
+    pos = segment_start
+    while pos < segment_end:
+        if all(element in found for element in WANTED_ELEMENTS):
+            break
+        element_id, header_len, size, unknown = read_element_header(buf, pos, segment_end)
+        if element_id == CLUSTER:
+            break
+        if unknown:
+            raise MatroskaParseError(f"Element 0x{element_id:X} có kích thước không xác định")
+        data_start = pos + header_len
+        if data_start + size > segment_end:
+            raise MatroskaParseError(f"Element 0x{element_id:X} vượt quá Segment")
+        handle(element_id, pos, data_start, size)
+        pos = data_start + size
+
+    # Các element nằm sau Cluster (thường là Tags) được tìm qua SeekHead
+    index = 0
+    while index < len(seek_entries):
+        seek_id, seek_position = seek_entries[index]
+        index += 1
+        if seek_id not in parsers and seek_id != SEEKHEAD:
+            continue
+        if seek_id in found:
+            continue
+        offset = segment_start + seek_position
+        if offset >= segment_end:
+            continue
+        element_id, header_len, size, unknown = read_element_header(buf, offset, segment_end)
+        if element_id != seek_id or unknown or offset + header_len + size > segment_end:
+            raise MatroskaParseError("SeekHead trỏ tới vị trí không hợp lệ")
+        handle(element_id, offset, offset + header_len, size)
+
+    if TRACKS not in found:
+        raise MatroskaParseError("Không tìm thấy Tracks")
+
+    # Tracks phải parse trước Tags để gắn tag theo TrackUID
+    for element_id in (INFO, TRACKS, ATTACHMENTS, TAGS):
+        if element_id in found:
+            offset, header_len, size = found[element_id]
+            parsers[element_id](buf, offset + header_len, offset + header_len + size, mkv)
+    mkv.elements = found
+    return mkv
+
+
+def parse_matroska(file_path: str) -> MatroskaFile:
+    """Parse header Matroska bằng mmap. Ném MatroskaParseError nếu không đọc được."""
+    try:
+        with open(file_path, "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if file_size < 16:
+                raise MatroskaParseError("File quá nhỏ")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return parse_matroska_buffer(buf, file_path, file_size)
+    except MatroskaParseError:
+        raise
+    except (OSError, ValueError, IndexError, struct.error) as exc:
+        raise MatroskaParseError(str(exc)) from exc
+
+
+def codec_name_for(track: MatroskaTrack) -> Optional[str]:
+    codec_id = track.codec_id
+    if codec_id.startswith("A_PCM/"):
+        return PCM_CODECS.get((codec_id, track.bit_depth or 16))
+    for prefix, name in CODEC_NAMES:
+        if codec_id.startswith(prefix):
+            return name
+    return None
+
+
+def _format_duration(duration_us: int) -> str:
+    return f"{duration_us // 1000000}.{duration_us % 1000000:06d}"
+
+
+def stream_tracks(mkv: MatroskaFile) -> List[MatroskaTrack]:
+    """Các track theo đúng thứ tự stream index của ffprobe.
+
+    FFmpeg bỏ qua TrackEntry không phải video/audio/subtitle (complex, logo, buttons,
+    control...) và TrackEntry không có CodecID, nên stream index khác thứ tự TrackEntry
+    khi có các track đó đứng trước.
+    """
+    return [track for track in mkv.tracks if track.track_type in CODEC_TYPES and track.codec_id]
+
+
+def track_for_stream(mkv: MatroskaFile, stream_index: int) -> Optional[MatroskaTrack]:
+    """Track ứng với stream index của ffprobe/to_probe_data, None nếu không có."""
+    tracks = stream_tracks(mkv)
+    if isinstance(stream_index, int) and 0 <= stream_index < len(tracks):
+        return tracks[stream_index]
+    return None
+
+
+def to_probe_data(mkv: MatroskaFile) -> Dict[str, Any]:
+    """Chuyển kết quả parse thành dict giống `ffmpeg.probe` (streams + format).
+
+    Ném MatroskaParseError nếu có track mà parser native không mô tả được giống ffprobe.
+    Stream index khớp với stream_tracks().
+    """
+    streams: List[Dict[str, Any]] = []
+    for track in mkv.tracks:
+        codec_type = CODEC_TYPES.get(track.track_type)
+        if codec_type is None:
+            if track.track_type in (3, 16, 18, 32):
+                continue  # FFmpeg bỏ qua các loại track này
+            raise MatroskaParseError(f"Loại track không hỗ trợ: {track.track_type}")
+        if not track.codec_id:
+            raise MatroskaParseError("Track thiếu CodecID")
+        if any(encoding.encrypted for encoding in track.encodings):
+            raise MatroskaParseError("Track bị mã hóa")
+        codec_name = codec_name_for(track)
+        if codec_name is None:
+            raise MatroskaParseError(f"CodecID chưa hỗ trợ: {track.codec_id}")
+
+        tags: Dict[str, str] = {}
+        if track.language and track.language != "und":
+            tags["language"] = track.language
+        if track.name:
+            tags["title"] = track.name
+        for key, value in track.tags.items():
+            _set_tag(tags, key, value)
+
+        stream: Dict[str, Any] = {
+            "index": len(streams),
+            "codec_name": codec_name,
+            "codec_type": codec_type,
+            "disposition": {
+                "default": 1 if track.flag_default else 0,
+                "forced": 1 if track.flag_forced else 0,
+                "hearing_impaired": 1 if track.flag_hearing_impaired else 0,
+                "visual_impaired": 1 if track.flag_visual_impaired else 0,
+                "original": 1 if track.flag_original else 0,
+                "comment": 1 if track.flag_commentary else 0,
+            },
+        }
+        if tags:
+            stream["tags"] = tags
+        if codec_type == "video":
+            if track.pixel_width is None or track.pixel_height is None:
+                raise MatroskaParseError("Track video thiếu kích thước")
+            stream["width"] = track.pixel_width
+            stream["height"] = track.pixel_height
+        elif codec_type == "audio":
+            stream["channels"] = track.channels
+            stream["sample_rate"] = str(int(track.sampling_frequency))
+        streams.append(stream)
+
+    for attachment in mkv.attachments:
+        attachment_stream: Dict[str, Any] = {
+            "index": len(streams),
+            "codec_type": "attachment",
+        }
+        if attachment:
+            attachment_stream["tags"] = dict(attachment)
+        codec_name = ATTACHMENT_CODECS.get(attachment.get("mimetype", "").lower())
+        if codec_name:
+            attachment_stream["codec_name"] = codec_name
+        streams.append(attachment_stream)
+
+    duration_us = mkv.duration_us
+    if duration_us is None or duration_us <= 0:
+        raise MatroskaParseError("Segment Info thiếu Duration")
+
+    format_tags: Dict[str, str] = {}
+    if mkv.title:
+        format_tags["title"] = mkv.title
+    if mkv.muxing_app:
+        format_tags["encoder"] = mkv.muxing_app
+    if mkv.date_utc is not None:
+        created = MATROSKA_EPOCH + datetime.timedelta(microseconds=mkv.date_utc // 1000)
+        format_tags["creation_time"] = created.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    for key, value in mkv.tags.items():
+        _set_tag(format_tags, key, value)
+
+    format_info: Dict[str, Any] = {
+        "filename": mkv.path,
+        "nb_streams": len(streams),
+        "format_name": "matroska,webm",
+        "format_long_name": "Matroska / WebM",
+        "duration": _format_duration(duration_us),
+        "size": str(mkv.size),
+        "bit_rate": str(int(mkv.size * 8.0 * 1000000 / duration_us)),
+        "probe_score": 100,
+    }
+    if format_tags:
+        format_info["tags"] = format_tags
+    return {"streams": streams, "format": format_info}
+
+
+def probe_matroska(file_path: str) -> Dict[str, Any]:
+    """Probe file Matroska bằng parser native, trả về dict giống `ffmpeg.probe`."""
+    return to_probe_data(parse_matroska(file_path))
+
+
+def read_segment_uid(buf) -> Optional[bytes]:
+    """Đọc SegmentUID từ phần đầu file (buffer có thể bị cắt). Không tìm thấy thì trả về None."""
+    end = len(buf)
+    try:
+        _, pos = _check_ebml_header(buf, end)
+        element_id, header_len, segment_size, unknown = read_element_header(buf, pos, end)
+        if element_id != SEGMENT:
+            return None
+        pos += header_len
+        segment_end = end if unknown else min(end, pos + segment_size)
+        while pos < segment_end:
+            element_id, header_len, size, unknown = read_element_header(buf, pos, segment_end)
+            if element_id == CLUSTER or unknown:
+                return None
+            data_start = pos + header_len
+            if element_id == INFO:
+                if data_start + size > end:
+                    return None
+                for child_id, child_pos, child_size in iter_children(buf, data_start, data_start + size):
+                    if child_id == SEGMENT_UID:
+                        return bytes(buf[child_pos:child_pos + child_size])
+                return None
+            pos = data_start + size
+    except (MatroskaParseError, IndexError, ValueError):
+        return None
+    return None
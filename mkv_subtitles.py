@@ -0,0 +1,277 @@
+"""
+Trích subtitle text (S_TEXT/UTF8, S_TEXT/ASS, S_TEXT/SSA) từ MKV bằng Python
+thuần, không gọi ffmpeg.
+Duyệt các Cluster theo kích thước element: chỉ đọc header của block và payload
+của các track subtitle cần lấy, còn payload video/audio thì seek qua. Nhiều
+track được trích trong cùng một lượt duyệt. Gặp dữ liệu không xử lý được thì
+ném UnsupportedSubtitleError để người gọi quay về ffmpeg.
+"""
+from __future__ import annotations
+
+import os
+import re
+import zlib
+from dataclasses import dataclass, field
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple
+
+from mkv_reader import (
+    CLUSTER,
+    TRACK_TYPE_SUBTITLE,
+    MatroskaParseError,
+    MatroskaTrack,
+    parse_matroska,
+    read_element_header,
+    read_vint,
+    track_for_stream,
+)
+
+
+CLUSTER_TIMESTAMP = 0xE7
+SIMPLE_BLOCK = 0xA3
+BLOCK_GROUP = 0xA0
+BLOCK = 0xA1
+BLOCK_DURATION = 0x9B
+CUES = 0x1C53BB6B
+# Element cấp Segment: gặp một trong số này trong Cluster unknown-size nghĩa là Cluster đã hết
+TOP_LEVEL_IDS = {CLUSTER, CUES, 0x1254C367, 0x1549A966, 0x1654AE6B, 0x114D9B74, 0x1941A469, 0x1043A770}
+
+TEXT_CODEC_IDS = {"S_TEXT/UTF8", "S_TEXT/ASS", "S_TEXT/SSA", "S_ASS", "S_SSA"}
+MAX_HEADER = 12
+READ_BUFFER = 4096  # nhỏ để seek qua payload video/audio không kéo theo nhiều dữ liệu thừa
+
+
+class UnsupportedSubtitleError(MatroskaParseError):
+    """Track/file mà extractor native không xử lý được (nén lạ, lacing, codec ảnh...)."""
+
+
+@dataclass
+class SubtitleEvent:
+    start_ms: int
+    end_ms: Optional[int]
+    text: str
+
+
+@dataclass
+class ExtractStats:
+    bytes_read: int = 0
+    bytes_skipped: int = 0
+    blocks: int = 0
+    subtitle_blocks: int = 0
+
+
+@dataclass
+class _TrackState:
+    track: MatroskaTrack
+    is_ass: bool
+    events: List[SubtitleEvent] = field(default_factory=list)
+
+
+ASS_TAG_RE = re.compile(r"\{([^}]*)\}")
+
+
+def _ass_overrides_to_srt(match: "re.Match[str]") -> str:
+    """Giữ lại in nghiêng/đậm/gạch chân như ffmpeg, bỏ các override khác."""
+    html = []
+    for tag in match.group(1).split("\\"):
+        if tag in ("i1", "b1", "u1"):
+            html.append(f"<{tag[0]}>")
+        elif tag in ("i0", "b0", "u0"):
+            html.append(f"</{tag[0]}>")
+    return "".join(html)
+
+
+def ass_dialogue_to_text(payload: str) -> str:
+    """Payload block ASS trong MKV: ReadOrder,Layer,Style,Name,MarginL,MarginR,MarginV,Effect,Text."""
+    parts = payload.split(",", 8)
+    text = parts[8] if len(parts) == 9 else payload
+    text = ASS_TAG_RE.sub(_ass_overrides_to_srt, text)
+    return text.replace("\\N", "\n").replace("\\n", "\n").replace("\\h", " ")
+
+
+def _decode_payload(track: MatroskaTrack, data: bytes) -> bytes:
+    for encoding in sorted(track.encodings, key=lambda item: item.order, reverse=True):
+        if encoding.encrypted or encoding.encoding_type != 0:
+            raise UnsupportedSubtitleError("Subtitle bị mã hóa")
+        if not encoding.scope & 1:
+            continue
+        if encoding.comp_algo == 0:
+            try:
+                data = zlib.decompress(data)
+            except zlib.error as exc:
+                raise UnsupportedSubtitleError(f"Không giải nén được block subtitle: {exc}") from exc
+        elif encoding.comp_algo == 3:
+            data = encoding.comp_settings + data  # header stripping
+        else:
+            raise UnsupportedSubtitleError(f"Kiểu nén subtitle chưa hỗ trợ: {encoding.comp_algo}")
+    return data
+
+
+class _Reader:
+    """Đọc header element/block qua seek + read nhỏ, đếm byte đọc và byte bỏ qua."""
+
+    def __init__(self, f: BinaryIO, stats: ExtractStats):
+        self.f = f
+        self.stats = stats
+
+    def read_at(self, pos: int, size: int) -> bytes:
+        self.f.seek(pos)
+        data = self.f.read(size)
+        self.stats.bytes_read += len(data)
+        return data
+
+    def header(self, pos: int, end: int) -> Tuple[int, int, int, bool]:
+        data = self.read_at(pos, min(MAX_HEADER, end - pos))
+        return read_element_header(data, 0, len(data))
+
+
+def _ms(timestamp: int, timestamp_scale: int) -> int:
+    return int(round(timestamp * timestamp_scale / 1000000))
+
+
+def _handle_block(
+    reader: _Reader,
+    data_start: int,
+    size: int,
+    cluster_ts: int,
+    duration: Optional[int],
+    wanted: Dict[int, _TrackState],
+    timestamp_scale: int,
+) -> None:
+    reader.stats.blocks += 1
+    head = reader.read_at(data_start, min(size, 8 + 3))
+    track_number, vint_len, _ = read_vint(head, 0, len(head))
+    state = wanted.get(track_number)
+    if state is None:
+        reader.stats.bytes_skipped += size - len(head)
+        return
+    if len(head) < vint_len + 3:
+        raise UnsupportedSubtitleError("Block subtitle quá ngắn")
+    relative = int.from_bytes(head[vint_len:vint_len + 2], "big", signed=True)
+    flags = head[vint_len + 2]
+    if flags & 0x06:
+        raise UnsupportedSubtitleError("Block subtitle dùng lacing")
+    payload_start = data_start + vint_len + 3
+    payload = _decode_payload(state.track, reader.read_at(payload_start, data_start + size - payload_start))
+    reader.stats.subtitle_blocks += 1
+
+    text = payload.rstrip(b"\x00").decode("utf-8", errors="replace")
+    if state.is_ass:
+        text = ass_dialogue_to_text(text)
+    start = cluster_ts + relative
+    if duration is None and state.track.default_duration:
+        duration = int(state.track.default_duration / timestamp_scale)
+    end = _ms(start + duration, timestamp_scale) if duration is not None else None
+    state.events.append(SubtitleEvent(_ms(start, timestamp_scale), end, text.strip("\r\n")))
+
+
+def _walk_cluster(reader: _Reader, start: int, end: int, wanted: Dict[int, _TrackState], timestamp_scale: int) -> int:
+    """Duyệt một Cluster, trả về vị trí kết thúc thực tế (cho Cluster unknown-size)."""
+    cluster_ts = 0
+    pos = start
+    while pos < end:
+        element_id, header_len, size, unknown = reader.header(pos, end)
+        if element_id in TOP_LEVEL_IDS:
+            return pos
+        if unknown:
+            raise UnsupportedSubtitleError("Element con unknown-size trong Cluster")
+        data_start = pos + header_len
+        if element_id == CLUSTER_TIMESTAMP:
+            cluster_ts = int.from_bytes(reader.read_at(data_start, size), "big")
+        elif element_id == SIMPLE_BLOCK:
+            _handle_block(reader, data_start, size, cluster_ts, None, wanted, timestamp_scale)
+        elif element_id == BLOCK_GROUP:
+            block = None
+            duration = None
+            child = data_start
+            group_end = data_start + size
+            while child < group_end:
+                child_id, child_header, child_size, child_unknown = reader.header(child, group_end)
+                if child_unknown:
+                    raise UnsupportedSubtitleError("BlockGroup hỏng")
+                if child_id == BLOCK:
+                    block = (child + child_header, child_size)
+                elif child_id == BLOCK_DURATION:
+                    duration = int.from_bytes(reader.read_at(child + child_header, child_size), "big")
+                else:
+                    reader.stats.bytes_skipped += child_size
+                child += child_header + child_size
+            if block:
+                _handle_block(reader, block[0], block[1], cluster_ts, duration, wanted, timestamp_scale)
+        else:
+            reader.stats.bytes_skipped += size
+        pos = data_start + size
+    return end
+
+
+def extract_text_subtitles(
+    file_path: str, stream_indexes: Sequence[int], stats: Optional[ExtractStats] = None
+) -> Dict[int, List[SubtitleEvent]]:
+    """Trích các track subtitle text (theo stream index) trong một lượt duyệt file.
+
+    Stream index của ffprobe được đổi sang track qua track_for_stream (không phải thứ tự
+    TrackEntry). Trả về {stream index: danh sách event đã sắp theo thời gian, end đã được điền}.
+    """
+    stats = stats or ExtractStats()
+    mkv = parse_matroska(file_path)
+    wanted: Dict[int, _TrackState] = {}
+    numbers: Dict[int, int] = {}
+    for index in stream_indexes:
+        track = track_for_stream(mkv, index)
+        if track is None:
+            raise UnsupportedSubtitleError(f"Không có track ứng với stream {index}")
+        if track.track_type != TRACK_TYPE_SUBTITLE or track.codec_id not in TEXT_CODEC_IDS:
+            raise UnsupportedSubtitleError(f"Stream {index} không phải subtitle text ({track.codec_id})")
+        numbers[index] = track.number
+        wanted[track.number] = _TrackState(track, is_ass=track.codec_id != "S_TEXT/UTF8")
+
+    with open(file_path, "rb", buffering=READ_BUFFER) as f:
+        reader = _Reader(f, stats)
+        file_size = os.fstat(f.fileno()).st_size
+        pos = mkv.segment_data_offset
+        segment_end = file_size
+        while pos < segment_end:
+            try:
+                element_id, header_len, size, unknown = reader.header(pos, segment_end)
+            except MatroskaParseError:
+                break  # File bị cắt cuối: giữ những gì đã đọc được, giống ffmpeg
+            data_start = pos + header_len
+            if element_id == CLUSTER:
+                cluster_end = segment_end if unknown else min(segment_end, data_start + size)
+                pos = _walk_cluster(reader, data_start, cluster_end, wanted, mkv.timestamp_scale)
+                continue
+            if unknown:
+                raise UnsupportedSubtitleError(f"Element 0x{element_id:X} unknown-size")
+            stats.bytes_skipped += size
+            pos = data_start + size
+
+    results: Dict[int, List[SubtitleEvent]] = {}
+    for index in stream_indexes:
+        events = sorted(wanted[numbers[index]].events, key=lambda event: event.start_ms)
+        for current, following in zip(events, events[1:] + [None]):
+            if current.end_ms is None:
+                current.end_ms = following.start_ms if following else current.start_ms
+        results[index] = events
+    return results
+
+
+def _srt_time(ms: int) -> str:
+    ms = max(0, ms)
+    hours, rest = divmod(ms, 3600000)
+    minutes, rest = divmod(rest, 60000)
+    seconds, millis = divmod(rest, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{millis:03d}"
+
+
+def format_srt(events: Sequence[SubtitleEvent]) -> str:
+    blocks = []
+    for number, event in enumerate(events, 1):
+        blocks.append(f"{number}\n{_srt_time(event.start_ms)} --> {_srt_time(event.end_ms or event.start_ms)}\n{event.text}\n")
+    return "\n".join(blocks) + ("\n" if blocks else "")
+
+
+def write_srt(events: Sequence[SubtitleEvent], output_path: str) -> int:
+    """Ghi file SRT (UTF-8). Trả về số byte đã ghi."""
+    data = format_srt(events).encode("utf-8")
+    with open(output_path, "wb") as f:
+        f.write(data)
+    return len(data)
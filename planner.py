@@ -0,0 +1,194 @@
+"""
+Kế hoạch xử lý (dry-run) cho cả thư viện.
+Mỗi file MKV được quyết định trước: hành động (remux sang thư mục output,
+sửa header tại chỗ, trích subtitle, đổi tên, bỏ qua vì đã xử lý), track được
+chọn, tên output, số byte đọc/ghi. LibraryPlan tổng hợp dung lượng cần cho
+từng thư mục đích và ước lượng thời gian, rồi lưu ra JSON để xem trước hoặc
+để script.execute_plan chạy lại đúng kế hoạch đó.
+Module này chỉ chứa dữ liệu kế hoạch; quy tắc chọn track/đặt tên nằm ở script.py.
+"""
+from __future__ import annotations
+
+import datetime
+import json
+import os
+import shutil
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+
+PLAN_VERSION = 1
+
+ACTION_SKIP = "skip"  # Đã xử lý (theo tên hoặc signature)
+ACTION_REMUX = "remux"  # Tạo file mới: video + audio đã chọn, đổi tên file gốc
+ACTION_INPLACE = "inplace"  # Đặt audio default trong header rồi chuyển file sang thư mục output
+ACTION_RENAME = "rename"  # Không có audio tiếng Việt: chỉ đổi tên
+ACTION_KEEP = "keep"  # Có audio tiếng Việt nhưng không có track nào cần tách
+ACTION_PROBE_ERROR = "probe_error"  # Không probe được: thử đổi tên đơn giản như cũ
+WORK_ACTIONS = (ACTION_REMUX, ACTION_INPLACE, ACTION_RENAME, ACTION_KEEP, ACTION_PROBE_ERROR)
+
+
+class PlanError(ValueError):
+    """File kế hoạch không đọc được hoặc khác phiên bản."""
+
+
+@dataclass
+class SubtitlePlan:
+    index: int
+    language: str
+    title: str
+    codec: str
+    output_path: Optional[str]
+    method: str  # single_pass / native / ffmpeg / exists / unsupported
+    bytes_written: int = 0
+
+    @property
+    def info(self) -> Tuple[int, str, str, str]:
+        """Tuple (index, language, title, codec) như get_subtitle_info trả về."""
+        return (self.index, self.language, self.title, self.codec)
+
+
+@dataclass
+class FilePlan:
+    source_path: str
+    size: int
+    mtime_ns: int
+    action: str
+    signature: Optional[str] = None
+    reason: Optional[str] = None
+    output_folder: Optional[str] = None
+    output_path: Optional[str] = None
+    source_new_name: Optional[str] = None
+    audio_track: Optional[List[Any]] = None  # [index, channels, language, title]
+    single_pass: bool = False
+    subtitles: List[SubtitlePlan] = field(default_factory=list)
+    bytes_read: int = 0
+    bytes_written: Dict[str, int] = field(default_factory=dict)  # thư mục đích -> byte
+
+    @property
+    def file_name(self) -> str:
+        return os.path.basename(self.source_path)
+
+    @property
+    def selected_track(self) -> Optional[tuple]:
+        return tuple(self.audio_track) if self.audio_track else None
+
+    def add_write(self, folder: str, size: int) -> None:
+        folder = os.path.abspath(folder)
+        self.bytes_written[folder] = self.bytes_written.get(folder, 0) + max(0, int(size))
+
+    def source_unchanged(self) -> bool:
+        """File nguồn còn đúng như lúc lập kế hoạch (cùng kích thước và mtime)."""
+        try:
+            st = os.stat(self.source_path)
+        except OSError:
+            return False
+        return st.st_size == self.size and st.st_mtime_ns == self.mtime_ns
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "FilePlan":
+        data = dict(data)
+        data["subtitles"] = [SubtitlePlan(**item) for item in data.get("subtitles", [])]
+        return cls(**data)
+
+
+@dataclass
+class DestinationPlan:
+    path: str
+    bytes_needed: int
+    free_bytes: Optional[int]
+
+    @property
+    def enough_space(self) -> bool:
+        return self.free_bytes is None or self.free_bytes >= self.bytes_needed
+
+
+def _free_bytes(path: str) -> Optional[int]:
+    current = os.path.abspath(path)
+    while True:
+        try:
+            return shutil.disk_usage(current).free
+        except OSError:
+            parent = os.path.dirname(current)
+            if parent == current:
+                return None
+            current = parent  # Thư mục đích chưa tạo: lấy ổ của thư mục cha
+
+
+@dataclass
+class LibraryPlan:
+    input_folder: str
+    files: List[FilePlan] = field(default_factory=list)
+    settings: Dict[str, Any] = field(default_factory=dict)
+    created: str = field(default_factory=lambda: datetime.datetime.utcnow().isoformat())
+    version: int = PLAN_VERSION
+    destinations: List[DestinationPlan] = field(default_factory=list)
+    total_bytes_read: int = 0
+    total_bytes_written: int = 0
+    estimated_seconds: float = 0.0
+
+    def summarize(self, throughput_bytes_per_s: float, jobs: int = 1) -> None:
+        """Tính tổng byte, dung lượng cần cho từng thư mục đích và thời gian ước lượng (thô)."""
+        needed: Dict[str, int] = {}
+        for plan in self.files:
+            for folder, size in plan.bytes_written.items():
+                needed[folder] = needed.get(folder, 0) + size
+        self.destinations = [
+            DestinationPlan(path=folder, bytes_needed=size, free_bytes=_free_bytes(folder))
+            for folder, size in sorted(needed.items())
+        ]
+        self.total_bytes_read = sum(plan.bytes_read for plan in self.files)
+        self.total_bytes_written = sum(needed.values())
+        moved = self.total_bytes_read + self.total_bytes_written
+        self.estimated_seconds = moved / max(1.0, throughput_bytes_per_s) / max(1, jobs)
+
+    @property
+    def action_counts(self) -> Dict[str, int]:
+        return dict(Counter(plan.action for plan in self.files))
+
+    def describe(self) -> List[str]:
+        gb = 1024 ** 3
+        lines = [
+            f"Tổng {len(self.files)} file: "
+            + ", ".join(f"{action} {count}" for action, count in sorted(self.action_counts.items())),
+            f"Đọc {self.total_bytes_read / gb:.2f} GB, ghi {self.total_bytes_written / gb:.2f} GB, "
+            f"ước lượng {self.estimated_seconds / 3600:.1f} giờ",
+        ]
+        for destination in self.destinations:
+            free = "không rõ" if destination.free_bytes is None else f"{destination.free_bytes / gb:.2f} GB"
+            warning = "" if destination.enough_space else "  <-- KHÔNG ĐỦ CHỖ"
+            lines.append(f"  {destination.path}: cần {destination.bytes_needed / gb:.2f} GB, trống {free}{warning}")
+        return lines
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["action_counts"] = self.action_counts
+        return data
+
+    def save(self, path: str) -> str:
+        """Ghi JSON qua file tạm rồi replace để không để lại kế hoạch dở dang."""
+        path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".part"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> "LibraryPlan":
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as exc:
+            raise PlanError(f"Không đọc được kế hoạch {path}: {exc}") from exc
+        if data.get("version") != PLAN_VERSION:
+            raise PlanError(f"Kế hoạch phiên bản {data.get('version')} không được hỗ trợ (cần {PLAN_VERSION})")
+        data.pop("action_counts", None)
+        data["files"] = [FilePlan.from_dict(item) for item in data.get("files", [])]
+        data["destinations"] = [DestinationPlan(**item) for item in data.get("destinations", [])]
+        return cls(**data)
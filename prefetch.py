@@ -0,0 +1,55 @@
+"""
+Pipeline probe trước (prefetch) cho danh sách file.
+Một nhóm worker nền chạy trước tối đa `depth` file, trong khi luồng chính
+đang remux file hiện tại; kết quả được trả về đúng thứ tự đầu vào.
+"""
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Iterable, Iterator, TypeVar
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def prefetch(
+    items: Iterable[T],
+    func: Callable[[T], R],
+    workers: int = 2,
+    depth: int = 4,
+) -> Iterator[R]:
+    """Gọi `func` cho từng item trên thread nền, chạy trước tối đa `depth` item.
+
+    `workers <= 0` chạy tuần tự trên luồng hiện tại (giống vòng lặp cũ).
+    Lỗi trong `func` được ném lại khi tới lượt item đó.
+    """
+    if workers <= 0:
+        for item in items:
+            yield func(item)
+        return
+
+    depth = max(1, depth)
+    iterator = iter(items)
+    pending: Deque[Future] = deque()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+
+    def fill() -> None:
+        while len(pending) < depth:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            pending.append(executor.submit(func, item))
+
+    try:
+        fill()
+        while pending:
+            future = pending.popleft()
+            fill()
+            yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
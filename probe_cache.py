@@ -0,0 +1,129 @@
+"""
+Cache kết quả ffprobe trên đĩa (SQLite trong thư mục cấu hình).
+Khóa theo (device, inode) và tự vô hiệu khi size hoặc mtime_ns thay đổi,
+nên đổi tên file vẫn dùng lại được cache còn sửa nội dung thì probe lại.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+
+DEFAULT_MAX_ENTRIES = 50000
+
+
+def stat_cache_key(st: os.stat_result, file_path: str) -> str:
+    """Khóa cache từ stat. Filesystem không có inode (FAT, một số SMB) dùng đường dẫn."""
+    if st.st_ino:
+        return f"{st.st_dev}:{st.st_ino}"
+    return f"path:{os.path.abspath(file_path)}"
+
+
+class ProbeCache:
+    """Cache LRU giới hạn số entry cho dữ liệu ffprobe đã parse."""
+
+    def __init__(self, db_path: Path, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.db_path = Path(db_path)
+        self.max_entries = max(1, int(max_entries))
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._touched: Set[str] = set()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS probe_cache (
+                cache_key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                path TEXT,
+                probe_json TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_probe_cache_last_used ON probe_cache(last_used)")
+        self._conn.commit()
+
+    def get(self, file_path: str, st: Optional[os.stat_result] = None) -> Optional[Dict[str, Any]]:
+        """Trả về probe data đã cache hoặc None (miss / file đã thay đổi)."""
+        st = st or os.stat(file_path)
+        key = stat_cache_key(st, file_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, probe_json FROM probe_cache WHERE cache_key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            size, mtime_ns, probe_json = row
+            if size != st.st_size or mtime_ns != st.st_mtime_ns:
+                self._conn.execute("DELETE FROM probe_cache WHERE cache_key = ?", (key,))
+                self._conn.commit()
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            try:
+                data = json.loads(probe_json)
+            except json.JSONDecodeError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched.add(key)
+            return data
+
+    def put(self, file_path: str, probe_data: Dict[str, Any], st: Optional[os.stat_result] = None) -> None:
+        st = st or os.stat(file_path)
+        key = stat_cache_key(st, file_path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO probe_cache (cache_key, size, mtime_ns, path, probe_json, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, st.st_size, st.st_mtime_ns, os.path.abspath(file_path), json.dumps(probe_data), time.time()),
+            )
+            self._conn.commit()
+            self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        count = self._conn.execute("SELECT COUNT(*) FROM probe_cache").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        # Xóa bớt 10% entry ít dùng nhất để không phải evict sau mỗi lần ghi
+        keep = int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM probe_cache WHERE cache_key IN "
+            "(SELECT cache_key FROM probe_cache ORDER BY last_used ASC LIMIT ?)",
+            (count - keep,),
+        )
+        self._conn.commit()
+
+    def flush(self) -> None:
+        """Ghi lại thời điểm dùng của các entry hit (gom lại thay vì ghi mỗi lần hit)."""
+        with self._lock:
+            if not self._touched:
+                return
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE probe_cache SET last_used = ? WHERE cache_key = ?",
+                [(now, key) for key in self._touched],
+            )
+            self._conn.commit()
+            self._touched.clear()
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    def summary(self) -> str:
+        return f"{self.hits} hit, {self.misses} miss, {self.invalidations} vô hiệu"
@@ -0,0 +1,291 @@
+"""
+Chạy tiến trình con (ffmpeg, ffprobe, git) trên một event loop asyncio dùng chung.
+Loop chạy ở thread nền riêng nên các job thread (JobScheduler) chỉ việc gửi
+lệnh vào và chờ kết quả; một loop giám sát được nhiều tiến trình con cùng lúc.
+- stderr được đọc liên tục vào RingBuffer có giới hạn: ffmpeg in nhiều cũng
+  chỉ giữ phần cuối (phần chứa thông báo lỗi), không phình bộ nhớ.
+- stdout được giữ nguyên hoặc chuyển từng dòng cho callback (tiến độ ffmpeg).
+- Mỗi lệnh có timeout riêng; quá hạn thì kill tiến trình và trả kết quả với
+  `timed_out=True` thay vì ném lỗi.
+ProcessResult kế thừa subprocess.CompletedProcess nên code cũ đọc
+returncode/stdout/stderr như với subprocess.run.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, Optional, Sequence
+
+
+DEFAULT_STDERR_LIMIT = 256 * 1024
+READ_CHUNK = 64 * 1024
+LINE_LIMIT = 1024 * 1024  # Dòng stdout dài nhất khi đọc theo dòng
+KILL_GRACE = 5.0  # Chờ pipe đóng sau khi kill (tiến trình cháu có thể còn giữ pipe)
+
+
+class RingBuffer:
+    """Buffer bytes giữ tối đa `limit` byte cuối cùng."""
+
+    def __init__(self, limit: int = DEFAULT_STDERR_LIMIT):
+        self.limit = max(1, int(limit))
+        self._chunks: Deque[bytes] = deque()
+        self._size = 0
+        self.dropped = 0
+
+    def write(self, data: bytes) -> None:
+        if not data:
+            return
+        if len(data) >= self.limit:
+            self.dropped += self._size + len(data) - self.limit
+            self._chunks.clear()
+            self._chunks.append(data[-self.limit:])
+            self._size = self.limit
+            return
+        self._chunks.append(data)
+        self._size += len(data)
+        while self._size > self.limit:
+            overflow = self._size - self.limit
+            head = self._chunks[0]
+            if len(head) <= overflow:
+                self._chunks.popleft()
+                self._size -= len(head)
+                self.dropped += len(head)
+            else:
+                self._chunks[0] = head[overflow:]
+                self._size -= overflow
+                self.dropped += overflow
+
+    def getvalue(self) -> bytes:
+        data = b"".join(self._chunks)
+        if self.dropped:
+            return f"...[{self.dropped} byte bị cắt]...\n".encode("utf-8") + data
+        return data
+
+
+class ProcessResult(subprocess.CompletedProcess):
+    """Kết quả một tiến trình con, tương thích subprocess.CompletedProcess."""
+
+    def __init__(
+        self,
+        args,
+        returncode: int,
+        stdout: bytes = b"",
+        stderr: bytes = b"",
+        timed_out: bool = False,
+        kill_reason: Optional[str] = None,
+        elapsed: float = 0.0,
+    ):
+        super().__init__(args, returncode, stdout, stderr)
+        self.timed_out = timed_out
+        self.kill_reason = kill_reason
+        self.elapsed = elapsed
+
+
+class ProcessHandle:
+    """Tiến trình đang chạy: `await handle` trong coroutine, hoặc `handle.result()` từ thread thường."""
+
+    def __init__(self, engine: "ProcessEngine", args: Sequence[str]):
+        self.args = list(args)
+        self.future: Future = Future()
+        self._engine = engine
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self.kill_reason: Optional[str] = None
+        self.started = time.monotonic()
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self._process.pid if self._process else None
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: Optional[float] = None) -> ProcessResult:
+        return self.future.result(timeout)
+
+    def kill(self, reason: str = "killed") -> None:
+        """Kill tiến trình (an toàn khi gọi từ thread bất kỳ)."""
+        if self.kill_reason is None:
+            self.kill_reason = reason
+        self._engine.call_soon(self._kill)
+
+    def _kill(self) -> None:
+        if self._process is not None and self._process.returncode is None:
+            try:
+                self._process.kill()
+            except ProcessLookupError:
+                pass
+
+    def __await__(self):
+        return asyncio.wrap_future(self.future).__await__()
+
+
+class ProcessEngine:
+    """Event loop nền chạy mọi tiến trình con của chương trình."""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()  # Windows: Proactor mặc định, hỗ trợ subprocess
+                ready = threading.Event()
+
+                def run_loop():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run_loop, name="process-engine", daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    def call_soon(self, callback: Callable[[], None]) -> None:
+        loop = self._ensure_loop()
+        if threading.current_thread() is self._thread:
+            callback()
+        else:
+            loop.call_soon_threadsafe(callback)
+
+    def start(
+        self,
+        cmd: Sequence[str],
+        *,
+        timeout: Optional[float] = None,
+        cwd: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None,
+        on_stdout_line: Optional[Callable[[bytes], None]] = None,
+        stderr_limit: int = DEFAULT_STDERR_LIMIT,
+    ) -> ProcessHandle:
+        """Khởi chạy lệnh, trả về ProcessHandle ngay (không chờ tiến trình kết thúc)."""
+        handle = ProcessHandle(self, cmd)
+        loop = self._ensure_loop()
+        coroutine = self._run(handle, timeout, cwd, env, on_stdout_line, stderr_limit)
+        task_future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+        def finish(done: Future) -> None:
+            if done.cancelled():
+                handle.future.cancel()
+            elif done.exception() is not None:
+                handle.future.set_exception(done.exception())
+            else:
+                handle.future.set_result(done.result())
+
+        task_future.add_done_callback(finish)
+        return handle
+
+    def run(self, cmd: Sequence[str], **kwargs) -> ProcessResult:
+        """Bản đồng bộ của start(): chạy và chờ kết quả (ném FileNotFoundError nếu không có binary)."""
+        return self.start(cmd, **kwargs).result()
+
+    async def _run(
+        self,
+        handle: ProcessHandle,
+        timeout: Optional[float],
+        cwd: Optional[str],
+        env: Optional[Dict[str, str]],
+        on_stdout_line: Optional[Callable[[bytes], None]],
+        stderr_limit: int,
+    ) -> ProcessResult:
+        creationflags = getattr(subprocess, "CREATE_NO_WINDOW", 0) if os.name == "nt" else 0
+        process = await asyncio.create_subprocess_exec(
+            *handle.args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            env=env,
+            limit=LINE_LIMIT,
+            creationflags=creationflags,
+        )
+        handle._process = process
+        if handle.kill_reason is not None:
+            handle._kill()  # kill() được gọi trước khi tiến trình kịp khởi động
+        stderr = RingBuffer(stderr_limit)
+        stdout_chunks = []
+
+        async def read_stdout():
+            if on_stdout_line is not None:
+                while True:
+                    try:
+                        line = await process.stdout.readline()
+                    except ValueError:
+                        line = await process.stdout.read(READ_CHUNK)  # Dòng quá dài: bỏ qua phần này
+                        continue
+                    if not line:
+                        return
+                    try:
+                        on_stdout_line(line)
+                    except Exception as exc:
+                        print(f"[PROCESS] Lỗi khi xử lý stdout: {exc}")
+            else:
+                while True:
+                    chunk = await process.stdout.read(READ_CHUNK)
+                    if not chunk:
+                        return
+                    stdout_chunks.append(chunk)
+
+        async def read_stderr():
+            while True:
+                chunk = await process.stderr.read(READ_CHUNK)
+                if not chunk:
+                    return
+                stderr.write(chunk)
+
+        timed_out = False
+        readers = asyncio.gather(read_stdout(), read_stderr())
+        try:
+            await asyncio.wait_for(asyncio.shield(readers), timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            if handle.kill_reason is None:
+                handle.kill_reason = "timeout"
+            handle._kill()
+            try:
+                await asyncio.wait_for(readers, KILL_GRACE)  # Pipe đóng khi tiến trình chết
+            except asyncio.TimeoutError:
+                pass
+        except asyncio.CancelledError:
+            handle._kill()
+            readers.cancel()
+            raise
+        returncode = await process.wait()
+        return ProcessResult(
+            handle.args,
+            returncode,
+            b"".join(stdout_chunks),
+            stderr.getvalue(),
+            timed_out=timed_out,
+            kill_reason=handle.kill_reason,
+            elapsed=time.monotonic() - handle.started,
+        )
+
+
+_ENGINE: Optional[ProcessEngine] = None
+_ENGINE_LOCK = threading.Lock()
+
+
+def get_engine() -> ProcessEngine:
+    global _ENGINE
+    with _ENGINE_LOCK:
+        if _ENGINE is None:
+            _ENGINE = ProcessEngine()
+        return _ENGINE
+
+
+def start_process(cmd: Sequence[str], **kwargs) -> ProcessHandle:
+    return get_engine().start(cmd, **kwargs)
+
+
+def run_process(cmd: Sequence[str], **kwargs) -> ProcessResult:
+    """Thay cho subprocess.run(cmd, capture_output=True[, timeout=...]) nhưng không ném TimeoutExpired."""
+    return get_engine().run(cmd, **kwargs)
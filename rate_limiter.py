@@ -0,0 +1,190 @@
+"""
+Điều tốc request tới GitHub API khi đồng bộ nhiều file song song.
+- Token bucket riêng cho request đọc và request ghi (GitHub giới hạn phụ khoảng
+  80 request tạo nội dung mỗi phút).
+- Đọc X-RateLimit-Remaining/Reset để giãn tốc độ khi quota sắp hết và dừng hẳn
+  tới lúc reset khi hết; Retry-After tạm dừng mọi worker.
+- Thống kê số request, số lần thử lại, thời gian chờ và thông lượng upload để in
+  ở cuối lượt chạy.
+"""
+from __future__ import annotations
+
+import random
+import threading
+import time
+from typing import Callable, Mapping, Optional
+
+
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+DEFAULT_READS_PER_SECOND = 10.0
+DEFAULT_WRITES_PER_MINUTE = 70.0
+DEFAULT_RESERVE = 50  # Chừa lại một phần quota cho lượt chạy khác/GUI
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0, retry_after: Optional[float] = None) -> float:
+    """Full jitter: ngẫu nhiên trong [0, min(cap, base * 2^attempt)], không ít hơn Retry-After."""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _header_number(headers: Mapping[str, str], name: str) -> Optional[float]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """Token bucket an toàn đa luồng; token có thể âm (đặt chỗ) để các worker xếp hàng công bằng."""
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = max(0.001, float(rate))
+        self.base_rate = self.rate
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            self._refill_locked()
+            self.rate = max(0.001, min(self.base_rate, float(rate)))
+
+    def _refill_locked(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Lấy một token; trả về số giây phải chờ trước khi dùng."""
+        with self._lock:
+            self._refill_locked()
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class SyncStats:
+    """Thống kê request GitHub của một lượt chạy (cộng dồn từ mọi worker)."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.requests = 0
+        self.retries = 0
+        self.not_modified = 0  # GET có điều kiện trả về 304 (không tính vào quota)
+        self.throttled_seconds = 0.0
+        self.bytes_uploaded = 0
+        self.uploads = 0
+        self.upload_seconds = 0.0  # Thời gian thực có ít nhất một upload đang chạy
+        self._active = 0
+        self._busy_since = 0.0
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def add_throttle(self, seconds: float) -> None:
+        if seconds > 0:
+            with self._lock:
+                self.throttled_seconds += seconds
+
+    def count_request(self, retry: bool = False) -> None:
+        with self._lock:
+            self.requests += 1
+            if retry:
+                self.retries += 1
+
+    def count_not_modified(self) -> None:
+        with self._lock:
+            self.not_modified += 1
+
+    def begin_upload(self) -> None:
+        with self._lock:
+            if self._active == 0:
+                self._busy_since = self._clock()
+            self._active += 1
+
+    def end_upload(self, size: int, ok: bool) -> None:
+        with self._lock:
+            self._active -= 1
+            if ok:
+                self.uploads += 1
+                self.bytes_uploaded += size
+            if self._active == 0:
+                self.upload_seconds += self._clock() - self._busy_since
+
+    def summary(self) -> str:
+        mb = self.bytes_uploaded / (1024 ** 2)
+        speed = mb / self.upload_seconds if self.upload_seconds > 0 else 0.0
+        return (
+            f"{self.requests} request ({self.not_modified} không đổi), {self.retries} thử lại, upload {self.uploads} file "
+            f"({mb:.2f} MB, {speed:.2f} MB/s), chờ rate limit {self.throttled_seconds:.1f}s"
+        )
+
+
+class GitHubRateLimiter:
+    """Điều tốc theo token bucket và header rate limit của GitHub."""
+
+    def __init__(
+        self,
+        reads_per_second: float = DEFAULT_READS_PER_SECOND,
+        writes_per_minute: float = DEFAULT_WRITES_PER_MINUTE,
+        reserve: int = DEFAULT_RESERVE,
+        stats: Optional[SyncStats] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.reads = TokenBucket(reads_per_second, capacity=max(1.0, reads_per_second))
+        self.writes = TokenBucket(writes_per_minute / 60.0, capacity=10)
+        self.reserve = reserve
+        self.stats = stats or SyncStats()
+        self._clock = clock
+        self._sleep = sleep
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Tạm dừng mọi worker trong `seconds` giây (Retry-After, hết quota)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+    def before(self, method: str) -> None:
+        """Chờ tới lượt gửi request."""
+        with self._lock:
+            wait = max(0.0, self._paused_until - self._clock())
+        bucket = self.writes if method.upper() in WRITE_METHODS else self.reads
+        wait += bucket.reserve()
+        if wait > 0:
+            self.stats.add_throttle(wait)
+            self._sleep(wait)
+
+    def after(self, headers: Mapping[str, str]) -> None:
+        """Cập nhật tốc độ theo header của response."""
+        retry_after = _header_number(headers, "Retry-After")
+        if retry_after is not None:
+            self.pause(retry_after)
+        remaining = _header_number(headers, "X-RateLimit-Remaining")
+        reset = _header_number(headers, "X-RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+        seconds_left = max(1.0, reset - time.time())
+        if remaining <= 0:
+            self.pause(seconds_left)
+        elif remaining <= self.reserve * 4:
+            # Giãn đều phần quota còn lại (trừ phần chừa) tới lúc reset
+            rate = max(0.0, remaining - self.reserve) / seconds_left
+            self.reads.set_rate(rate)
+            self.writes.set_rate(rate)
+        else:
+            self.reads.set_rate(self.reads.base_rate)
+            self.writes.set_rate(self.writes.base_rate)
+
+    def reset_wait(self, headers: Mapping[str, str]) -> Optional[float]:
+        """Số giây tới khi quota chính được reset, nếu response cho biết đã hết quota."""
+        remaining = _header_number(headers, "X-RateLimit-Remaining")
+        reset = _header_number(headers, "X-RateLimit-Reset")
+        if remaining is None or reset is None or remaining > 0:
+            return None
+        return max(1.0, reset - time.time())
@@ -0,0 +1,238 @@
+"""
+Log xử lý trên remote dạng các segment NDJSON chỉ ghi thêm (append-only).
+- Mỗi lần flush tạo segment mới `<segments_dir>/<YYYY-MM>/<thời gian>-<id>.ndjson`
+  (chia theo tháng, tối đa `max_entries` entry mỗi segment); segment đã ghi
+  không bao giờ bị sửa.
+- `manifest.json` nhỏ liệt kê các segment (đường dẫn, số entry, sha256).
+- Segment đã tải được cache ở máy (theo sha256), lần chạy sau chỉ tải manifest
+  và các segment chưa có trong cache.
+- processed.json cũ (một JSON list, bị ghi lại toàn bộ mỗi lần flush) được
+  chuyển thành segment theo tháng rồi xóa khỏi repo.
+- RemoteState lưu sha commit đầu branch, ETag/sha và nội dung các file nhỏ
+  (manifest, log cũ) đã đọc: branch không đổi thì khởi động không cần tải gì,
+  đổi thì chỉ gửi request có điều kiện (If-None-Match).
+"""
+from __future__ import annotations
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+import uuid
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+SEGMENT_SUFFIX = ".ndjson"
+DEFAULT_SEGMENT_MAX_ENTRIES = 2000
+
+
+def encode_segment(entries: Iterable[Dict[str, Any]]) -> bytes:
+    return "".join(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n" for entry in entries).encode("utf-8")
+
+
+def decode_segment(data: bytes) -> List[Dict[str, Any]]:
+    """Đọc NDJSON; bỏ qua dòng hỏng (vd. segment bị cắt) thay vì bỏ cả segment."""
+    entries = []
+    for line in data.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            continue  # Dòng bị cắt giữa ký tự nhiều byte cũng chỉ bỏ dòng đó
+        if isinstance(entry, dict):
+            entries.append(entry)
+    return entries
+
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def entry_month(entry: Dict[str, Any], default: str) -> str:
+    timestamp = str(entry.get("timestamp") or "")
+    if len(timestamp) >= 7 and timestamp[4] == "-":
+        return timestamp[:7]
+    return default
+
+
+@dataclass
+class SegmentInfo:
+    path: str
+    entries: int
+    sha256: str
+    created: str = ""
+
+
+@dataclass
+class Manifest:
+    version: int = MANIFEST_VERSION
+    segments: List[SegmentInfo] = field(default_factory=list)
+
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes]) -> "Manifest":
+        if not data:
+            return cls()
+        raw = json.loads(data.decode("utf-8"))
+        if raw.get("version", MANIFEST_VERSION) > MANIFEST_VERSION:
+            raise ValueError(f"Manifest phiên bản {raw.get('version')} mới hơn bản hỗ trợ ({MANIFEST_VERSION})")
+        segments = [SegmentInfo(**{k: s[k] for k in ("path", "entries", "sha256", "created") if k in s}) for s in raw.get("segments", [])]
+        return cls(version=MANIFEST_VERSION, segments=segments)
+
+    def to_bytes(self) -> bytes:
+        data = {"version": self.version, "segments": [asdict(segment) for segment in self.segments]}
+        return json.dumps(data, ensure_ascii=False, indent=1).encode("utf-8")
+
+    def merged_with(self, new_segments: List[SegmentInfo]) -> "Manifest":
+        """Manifest này cộng các segment mới (bỏ segment đã có)."""
+        known = {segment.path for segment in self.segments}
+        return Manifest(segments=self.segments + [s for s in new_segments if s.path not in known])
+
+    @property
+    def total_entries(self) -> int:
+        return sum(segment.entries for segment in self.segments)
+
+
+def build_segments(
+    entries: List[Dict[str, Any]],
+    segments_dir: str,
+    max_entries: int = DEFAULT_SEGMENT_MAX_ENTRIES,
+    by_entry_month: bool = False,
+    label: str = "",
+) -> Dict[str, bytes]:
+    """Chia entry thành các segment mới. Trả về {đường dẫn: nội dung}.
+
+    Mặc định mọi entry vào thư mục tháng hiện tại; `by_entry_month` (khi chuyển log cũ)
+    chia theo tháng trong timestamp của từng entry.
+    """
+    now = datetime.datetime.utcnow()
+    current_month = now.strftime("%Y-%m")
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for entry in entries:
+        month = entry_month(entry, current_month) if by_entry_month else current_month
+        groups.setdefault(month, []).append(entry)
+    max_entries = max(1, int(max_entries))
+    segments: Dict[str, bytes] = {}
+    for month, group in sorted(groups.items()):
+        for start in range(0, len(group), max_entries):
+            name = f"{now.strftime('%Y%m%dT%H%M%S')}-{label or uuid.uuid4().hex[:8]}-{start // max_entries}{SEGMENT_SUFFIX}"
+            segments[f"{segments_dir}/{month}/{name}"] = encode_segment(group[start:start + max_entries])
+    return segments
+
+
+def segment_infos(segments: Dict[str, bytes]) -> List[SegmentInfo]:
+    created = datetime.datetime.utcnow().isoformat(timespec="seconds")
+    return [
+        SegmentInfo(path=path, entries=data.count(b"\n"), sha256=sha256_hex(data), created=created)
+        for path, data in segments.items()
+    ]
+
+
+class SegmentCache:
+    """Cache segment ở máy, đặt tên theo sha256 nên không bao giờ cũ."""
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, sha256: str) -> Path:
+        return self.cache_dir / f"{sha256}{SEGMENT_SUFFIX}"
+
+    def get(self, segment: SegmentInfo) -> Optional[bytes]:
+        return self.load(segment.sha256)
+
+    def load(self, sha256: str) -> Optional[bytes]:
+        path = self._path(sha256)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        if sha256_hex(data) != sha256:
+            path.unlink(missing_ok=True)
+            return None
+        return data
+
+    def put(self, data: bytes) -> str:
+        digest = sha256_hex(data)
+        path = self._path(digest)
+        if not path.exists():
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        return digest
+
+
+class RemoteState:
+    """Những gì đã biết về repo ở lần đọc trước, lưu trong `state.json` cạnh cache segment.
+
+    - `head`: sha commit đầu branch lúc các file bên dưới được đọc (None nếu không chắc).
+    - `files`: đường dẫn -> {"exists", "sha", "etag", "sha256"}; nội dung nằm trong SegmentCache.
+    """
+
+    STATE_NAME = "state.json"
+
+    def __init__(self, store: SegmentCache):
+        self.store = store
+        self.path = store.cache_dir / self.STATE_NAME
+        self.head: Optional[str] = None
+        self.head_etag: Optional[str] = None
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        try:
+            raw = json.loads(self.path.read_text(encoding="utf-8"))
+            self.head = raw.get("head")
+            self.head_etag = raw.get("head_etag")
+            self.files = dict(raw.get("files") or {})
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    def set_head(self, sha: Optional[str], etag: Optional[str] = None) -> None:
+        with self._lock:
+            self.head, self.head_etag = sha, etag
+            self._dirty = True
+
+    def file(self, path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            info = self.files.get(path)
+            return dict(info) if info else None
+
+    def content(self, path: str) -> Tuple[bool, Optional[bytes], Optional[str]]:
+        """(có trong cache, nội dung, sha). File đã biết là không tồn tại trả về (True, None, None)."""
+        info = self.file(path)
+        if info is None:
+            return False, None, None
+        if not info.get("exists"):
+            return True, None, None
+        data = self.store.load(info.get("sha256", ""))
+        if data is None:
+            return False, None, None
+        return True, data, info.get("sha")
+
+    def remember(self, path: str, content: Optional[bytes], sha: Optional[str] = None, etag: Optional[str] = None) -> None:
+        """Ghi nhận nội dung file `path` (None = không tồn tại)."""
+        info: Dict[str, Any] = {"exists": content is not None, "sha": sha, "etag": etag}
+        if content is not None:
+            info["sha256"] = self.store.put(content)
+        with self._lock:
+            self.files[path] = info
+            self._dirty = True
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps({"head": self.head, "head_etag": self.head_etag, "files": self.files}, ensure_ascii=False)
+            self._dirty = False
+        tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            tmp.write_text(data, encoding="utf-8")
+            os.replace(tmp, self.path)
+        except OSError as exc:
+            print(f"[AUTO PUSH] Không thể lưu trạng thái cache log: {exc}")
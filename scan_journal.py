@@ -0,0 +1,216 @@
+"""
+Nhật ký quét thư mục để lần chạy sau chỉ xử lý file mới hoặc đã thay đổi.
+Mỗi thư mục được lưu một snapshot: mtime của thư mục và (tên, size, mtime,
+inode) của từng file. Khi quét lại:
+- mtime thư mục không đổi và snapshot lần trước đầy đủ -> không cần liệt kê
+  thư mục (trên ổ mạng đây là phần tốn thời gian nhất);
+- ngược lại liệt kê một lần bằng os.scandir và chỉ trả về file mới/thay đổi.
+Snapshot chỉ được ghi sau khi xử lý xong (commit). File xuất hiện trong lúc
+đang chạy hoặc xử lý chưa xong không được ghi, và thư mục bị đánh dấu chưa
+đầy đủ để lần sau liệt kê lại.
+Lưu ý: sửa nội dung file tại chỗ không đổi mtime thư mục; dùng quét đầy đủ
+(`--full-scan`) khi cần.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+DEFAULT_SUFFIXES = (".mkv",)
+
+
+@dataclass(frozen=True)
+class ScanEntry:
+    name: str
+    size: int
+    mtime_ns: int
+    inode: int
+
+    def same_as(self, other: "ScanEntry") -> bool:
+        return (self.size, self.mtime_ns, self.inode) == (other.size, other.mtime_ns, other.inode)
+
+
+@dataclass
+class ScanResult:
+    directory: str
+    unchanged: bool = False  # Thư mục không đổi: không liệt kê lại
+    new: List[ScanEntry] = field(default_factory=list)
+    changed: List[ScanEntry] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    known: int = 0  # File không đổi so với snapshot
+    listed: Dict[str, ScanEntry] = field(default_factory=dict)  # Kết quả liệt kê (rỗng nếu unchanged)
+    dir_mtime_ns: Optional[int] = None
+    filtered: bool = False  # Listing đã lọc theo include/exclude: snapshot không được coi là đầy đủ
+
+    @property
+    def pending(self) -> List[ScanEntry]:
+        return self.new + self.changed
+
+    @property
+    def total(self) -> int:
+        return self.known + len(self.pending)
+
+    def paths(self) -> List[str]:
+        return [os.path.join(self.directory, entry.name) for entry in self.pending]
+
+    def describe(self) -> str:
+        if self.unchanged:
+            return f"thư mục không đổi kể từ lần quét trước ({self.known} file)"
+        return f"{len(self.new)} mới, {len(self.changed)} thay đổi, {self.known} không đổi, {len(self.removed)} đã mất"
+
+
+def list_entries(directory: str, suffixes: Sequence[str] = DEFAULT_SUFFIXES) -> Dict[str, ScanEntry]:
+    """Liệt kê file theo đuôi bằng os.scandir (Windows không cần stat riêng từng file)."""
+    entries: Dict[str, ScanEntry] = {}
+    with os.scandir(directory) as iterator:
+        for entry in iterator:
+            if not entry.name.lower().endswith(tuple(suffixes)):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            entries[entry.name] = ScanEntry(entry.name, st.st_size, st.st_mtime_ns, entry.inode() or st.st_ino)
+    return entries
+
+
+class ScanJournal:
+    """Snapshot thư mục trong SQLite, dùng chung cho CLI và GUI."""
+
+    def __init__(self, db_path: Path, suffixes: Sequence[str] = DEFAULT_SUFFIXES):
+        self.db_path = Path(db_path)
+        self.suffixes = tuple(s.lower() for s in suffixes)
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS scan_dirs (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER,
+                complete INTEGER NOT NULL,
+                scanned_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS scan_entries (
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                PRIMARY KEY (dir, name)
+            );
+            """
+        )
+        self._conn.commit()
+
+    def _load(self, directory: str) -> Tuple[Optional[Tuple[int, bool]], Dict[str, ScanEntry]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT mtime_ns, complete FROM scan_dirs WHERE path = ?", (directory,)
+            ).fetchone()
+            rows = self._conn.execute(
+                "SELECT name, size, mtime_ns, inode FROM scan_entries WHERE dir = ?", (directory,)
+            ).fetchall()
+        state = (row[0], bool(row[1])) if row else None
+        return state, {name: ScanEntry(name, size, mtime_ns, inode) for name, size, mtime_ns, inode in rows}
+
+    def scan(
+        self,
+        directory: str,
+        full: bool = False,
+        listed: Optional[Dict[str, ScanEntry]] = None,
+        filtered: bool = False,
+    ) -> ScanResult:
+        """So sánh thư mục với snapshot. Chỉ đọc, không ghi snapshot.
+
+        `listed`: kết quả liệt kê có sẵn (vd. từ library_walker), khi đó không liệt kê lại;
+        `filtered` cho biết listing đã bỏ bớt file theo include/exclude.
+        """
+        directory = os.path.abspath(directory)
+        dir_mtime_ns = os.stat(directory).st_mtime_ns
+        state, known = self._load(directory)
+        result = ScanResult(directory=directory, dir_mtime_ns=dir_mtime_ns, filtered=filtered)
+        if listed is None and not full and state is not None and state[1] and state[0] == dir_mtime_ns:
+            result.unchanged = True
+            result.known = len(known)
+            return result
+
+        result.listed = list_entries(directory, self.suffixes) if listed is None else listed
+        for name, entry in sorted(result.listed.items()):
+            previous = known.get(name)
+            if previous is None:
+                result.new.append(entry)
+            elif not previous.same_as(entry):
+                result.changed.append(entry)
+            else:
+                result.known += 1
+        result.removed = sorted(set(known) - set(result.listed))
+        return result
+
+    def commit(self, scan: ScanResult, retry: Iterable[str] = ()) -> int:
+        """Ghi snapshot sau khi xử lý xong những file trong `scan`.
+
+        Liệt kê lại thư mục; chỉ ghi file đã có trong lần quét (hoặc là file đó sau khi
+        được đổi tên - cùng inode). File trong `retry` (đường dẫn tuyệt đối; lỗi, bị dừng)
+        và file mới xuất hiện trong lúc chạy không được ghi, thư mục khi đó bị đánh dấu
+        chưa đầy đủ. Trả về số file đã ghi.
+        """
+        directory = scan.directory
+        if scan.unchanged:
+            return scan.known
+        if not scan.pending and not scan.removed:
+            # Không có gì được xử lý: snapshot giữ nguyên, chỉ cập nhật mtime lúc quét (không liệt kê lại)
+            self._write_dir(directory, scan.dir_mtime_ns, not scan.filtered)
+            return scan.known
+        retry = set(retry)
+        dir_mtime_ns = os.stat(directory).st_mtime_ns  # Lấy trước khi liệt kê: thay đổi sau đó vẫn bị phát hiện
+        current = list_entries(directory, self.suffixes)
+        _, previous = self._load(directory)
+        seen_inodes = {entry.inode for entry in scan.listed.values() if entry.inode}
+        keep: List[ScanEntry] = []
+        complete = True
+        for name, entry in current.items():
+            if os.path.join(directory, name) in retry:
+                complete = False
+                continue
+            if name in scan.listed or name in previous or (entry.inode and entry.inode in seen_inodes):
+                keep.append(entry)
+            else:
+                complete = False  # File xuất hiện trong lúc chạy (hoặc bị lọc bỏ): để lần sau xử lý
+        with self._lock:
+            self._conn.execute("DELETE FROM scan_entries WHERE dir = ?", (directory,))
+            self._conn.executemany(
+                "INSERT INTO scan_entries (dir, name, size, mtime_ns, inode) VALUES (?, ?, ?, ?, ?)",
+                [(directory, e.name, e.size, e.mtime_ns, e.inode) for e in keep],
+            )
+        self._write_dir(directory, dir_mtime_ns, complete and not scan.filtered)
+        return len(keep)
+
+    def _write_dir(self, directory: str, mtime_ns: Optional[int], complete: bool) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scan_dirs (path, mtime_ns, complete, scanned_at) VALUES (?, ?, ?, ?)",
+                (directory, mtime_ns, int(complete), time.time()),
+            )
+            self._conn.commit()
+
+    def forget(self, directory: str) -> None:
+        directory = os.path.abspath(directory)
+        with self._lock:
+            self._conn.execute("DELETE FROM scan_entries WHERE dir = ?", (directory,))
+            self._conn.execute("DELETE FROM scan_dirs WHERE path = ?", (directory,))
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
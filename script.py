@@ -7,20 +7,67 @@ import re
 import datetime
 import tempfile
 import io
+import itertools
 import shutil
+import sqlite3
+import threading
 import zipfile
 from pathlib import Path
 from contextlib import contextmanager
-from typing import Optional, List, Dict, Any
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Any, Set, Iterator
 
 import requests
 
 from config_manager import load_user_config, get_config_dir
 from github_sync import build_auto_push_config, RemoteSyncManager
+from media_info import MediaInfo, UNKNOWN_RESOLUTION, probe_media_info
+from probe_cache import ProbeCache, DEFAULT_MAX_ENTRIES as PROBE_CACHE_MAX_ENTRIES
+from fingerprint import FingerprintCache, compute_fingerprint
+from history_store import HISTORY_FILE, HistoryStore
+from log_writer import HISTORY_SYNCHRONOUS, LogWriter
+from sync_outbox import OUTBOX_FILE, SyncOutbox
+from scan_journal import ScanJournal, ScanResult
+from library_walker import DEFAULT_SKIP_DIRS, DEFAULT_WORKERS as WALK_WORKERS, LibraryWalker
+from folder_watcher import WATCH_MODES, FolderWatcher
+from prefetch import prefetch
+from job_scheduler import JobScheduler, device_of
+from mkv_edit import MatroskaEditError, TrackEdit, edit_tracks_in_place
+from mkv_reader import MatroskaParseError, TRACK_TYPE_AUDIO, parse_matroska, stream_tracks, track_for_stream
+from mkv_subtitles import ExtractStats, extract_text_subtitles, write_srt
+from staging import StagingStats, choose_staging_dir, commit_part, discard, make_staging_dir, move_into_place, part_path
+from ffmpeg_progress import ConsolePrinter, add_listener, start_with_progress, with_progress_args
+from job_watchdog import WATCHDOG_REASONS, JobStalledError, JobWatchdog
+from process_engine import run_process, start_process
+from planner import (
+    ACTION_INPLACE, ACTION_KEEP, ACTION_PROBE_ERROR, ACTION_REMUX, ACTION_RENAME, ACTION_SKIP,
+    FilePlan, LibraryPlan, PlanError, SubtitlePlan,
+)
 
 REMOTE_SYNC = None  # Sẽ được khởi tạo trong main nếu có config
+PROBE_CACHE: Optional[ProbeCache] = None  # Cache ffprobe trên đĩa, khởi tạo trong main
+FINGERPRINTS: Optional[FingerprintCache] = None  # Cache dấu vân tay + bảng chuyển chữ ký cũ
+FINGERPRINT_SEGMENT_UID = True
+HISTORY: Optional[HistoryStore] = None  # Lịch sử file đã xử lý (SQLite trong thư mục logs), mở trong main
+LOG_WRITER: Optional[LogWriter] = None  # Ghi lịch sử theo lô + đồng bộ remote ở thread nền
+RETRY_FILES: Set[str] = set()  # Đường dẫn tuyệt đối của file cần xử lý lại ở lần chạy sau (lỗi, bị dừng) - không ghi vào scan journal
+LOGGED_SOURCES: Set[str] = set()  # Đường dẫn tuyệt đối của file nguồn đã có entry video trong lượt chạy này
+INTERACTIVE = True  # False ở chế độ daemon (--watch): không hỏi người dùng, chọn phương án an toàn
+NATIVE_PROBE = True  # Đọc header MKV bằng parser native thay vì gọi ffprobe
+SINGLE_PASS = True  # Tách video + subtitle trong một lệnh ffmpeg (đọc file nguồn một lần)
+FFMPEG_PROGRESS = True  # Chạy ffmpeg với -progress pipe:1 và phát sự kiện tiến độ cho CLI/GUI
+WATCHDOG: Optional[JobWatchdog] = None  # Kill job ffmpeg treo/quá ngân sách, khởi tạo trong main
+NATIVE_SUBTITLES = True  # Trích subtitle text bằng parser native, chỉ dùng ffmpeg khi parser không xử lý được
+OUTPUT_MODE = "remux"  # remux: tạo file mới; inplace: sửa cờ default trong header file gốc
+STAGING_MODE = "auto"  # auto: chỉ staging trong RAM khi đích là ổ mạng; always / never
+STAGING_STATS = StagingStats()
+SUBTITLE_FOLDER = os.path.join(".", "Subtitles")
+TEXT_SUBTITLE_CODECS = ('srt', 'ass', 'ssa', 'subrip')
 RUN_LOG_ENTRIES: List[Dict[str, Any]] = []
+LOG_LOCK = threading.Lock()  # Bảo vệ file log và RUN_LOG_ENTRIES khi chạy nhiều job
 GIT_CACHED_PATH: Optional[str] = None
+TOOL_TIMEOUT = 120  # Giây, cho các lệnh ngắn (ffprobe, git add/commit, -version)
+GIT_PUSH_TIMEOUT = 600
 GIT_RELEASE_API = "https://api.github.com/repos/git-for-windows/git/releases/latest"
 
 
@@ -152,14 +199,49 @@ except ImportError:
     pass  # Nếu không import được, sẽ dùng system FFmpeg
 
 # Helper để chạy FFmpeg với path local nếu có
-def run_ffmpeg_command(cmd, **kwargs):
-    """Wrapper cho subprocess.run để tự động sử dụng FFmpeg local nếu có"""
+def run_ffmpeg_command(cmd, label=None, media_info=None, outputs=(), timeout=None):
+    """Chạy FFmpeg (ưu tiên bản local) qua process_engine, output luôn được capture.
+
+    Lệnh ffmpeg được thêm `-progress pipe:1 -nostats` và phát sự kiện tiến độ
+    (%, MB/s, ETA theo thời lượng trong `media_info`) mang tên `label`. Quá
+    `timeout` giây thì tiến trình bị kill và kết quả có `timed_out=True`.
+    Khi có WATCHDOG, job bị kill vì treo (không tiến độ, `outputs` không lớn
+    thêm) hoặc quá ngân sách thời gian sẽ ném JobStalledError; người gọi tự
+    dọn file dở dang.
+    """
+    is_ffmpeg = bool(cmd) and cmd[0] == 'ffmpeg'
+    track_progress = FFMPEG_PROGRESS and is_ffmpeg
+    if track_progress:
+        cmd = with_progress_args(cmd)
     try:
         from ffmpeg_helper import get_ffmpeg_command
         cmd = get_ffmpeg_command(cmd)
     except ImportError:
         pass  # Fallback về command gốc
-    return subprocess.run(cmd, **kwargs)
+    label = label or os.path.basename(cmd[-1])
+    watchdog = WATCHDOG if is_ffmpeg else None
+    job = watchdog.watch(label, outputs, media_info.size if media_info else 0) if watchdog else None
+    result = None
+    try:
+        if track_progress:
+            try:
+                duration_us = int(float(media_info.duration) * 1000000) if media_info else None
+            except (TypeError, ValueError):
+                duration_us = None
+            handle = start_with_progress(
+                cmd, label, duration_us, timeout=timeout, on_event=job.on_progress if job else None
+            )
+        else:
+            handle = start_process(cmd, timeout=timeout)
+        if job:
+            watchdog.attach(job, handle)
+        result = handle.result()
+    finally:
+        if job:
+            watchdog.finish(job, result)
+    if job and result.kill_reason in WATCHDOG_REASONS:
+        raise JobStalledError(result.kill_reason, label, job.kill_detail or result.kill_reason, result)
+    return result
 
 # Kiểm tra và hướng dẫn cài đặt các package cần thiết
 if __name__ == '__main__':
@@ -286,8 +368,7 @@ from contextlib import contextmanager
 
 def create_folder(folder_name):
     """Tạo folder nếu chưa tồn tại."""
-    if not os.path.exists(folder_name):
-        os.makedirs(folder_name)
+    os.makedirs(folder_name, exist_ok=True)
 
 def log_processed_file(
     log_file,
@@ -296,27 +377,24 @@ def log_processed_file(
     *,
     signature=None,
     metadata=None,
+    media_info=None,
 ):
-    """Ghi lại log file đã được xử lý và đồng bộ lên GitHub nếu cần."""
+    """Ghi lại log file đã được xử lý và đồng bộ lên GitHub nếu cần.
+
+    Entry được đưa cho LOG_WRITER (ghi theo lô, đồng bộ remote ở thread nền); `log_file`
+    chỉ được ghi trực tiếp khi chưa có writer.
+    Chữ ký phải được truyền vào qua `signature`, `media_info` hoặc metadata - hàm này không probe file.
+    """
     global RUN_LOG_ENTRIES
     metadata = metadata or {}
     current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
+    if signature is None and media_info is not None:
+        signature = media_info.signature
     if signature is None:
         signature = metadata.get("signature")
-    source_path = metadata.get("source_path")
-    if signature is None and source_path and os.path.exists(source_path):
-        signature = get_file_signature(source_path)
-
-    file_path = os.path.join(".", old_name)
-    fallback_signature = ""
-    if signature:
-        fallback_signature = signature
-    elif os.path.exists(file_path):
-        fallback_signature = get_file_signature(file_path) or ""
-
-    with open(log_file, "a", encoding='utf-8') as f:
-        f.write(f"{old_name}|{new_name}|{current_time}|{fallback_signature}\n")
+    fallback_signature = signature or ""
+    legacy_signature = media_info.legacy_signature if media_info is not None else metadata.get("legacy_signature")
 
     # Đồng bộ lên GitHub nếu được cấu hình
     remote_entry = {
@@ -324,20 +402,33 @@ def log_processed_file(
         "new_name": new_name,
         "timestamp": datetime.datetime.utcnow().isoformat(),
         "signature": signature or fallback_signature,
+        "legacy_signature": legacy_signature if legacy_signature != signature else None,
         "category": metadata.get("category", "video"),
         "output_path": metadata.get("output_path"),
         "language": metadata.get("language"),
         "notes": metadata.get("notes"),
     }
-    RUN_LOG_ENTRIES.append(remote_entry)
-
-    if REMOTE_SYNC:
-        local_path = metadata.get("local_path") or metadata.get("output_path")
+    local_path = metadata.get("local_path") or metadata.get("output_path")
+    with LOG_LOCK:
+        RUN_LOG_ENTRIES.append(remote_entry)
+        if remote_entry["category"] == "video" and metadata.get("source_path"):
+            LOGGED_SOURCES.add(os.path.abspath(metadata["source_path"]))
+        if LOG_WRITER is None:
+            with open(log_file, "a", encoding='utf-8') as f:
+                f.write(f"{old_name}|{new_name}|{current_time}|{fallback_signature}\n")
+    if LOG_WRITER is not None:
+        LOG_WRITER.write(remote_entry, local_path=local_path)
+    elif REMOTE_SYNC:
         try:
             REMOTE_SYNC.record_entry(remote_entry, local_path=local_path)
         except Exception as sync_err:
             print(f"[AUTO PUSH] Không thể ghi log lên GitHub: {sync_err}")
 
+def source_was_logged(file_path) -> bool:
+    """File nguồn đã được ghi log (xử lý xong) trong lượt chạy này chưa."""
+    with LOG_LOCK:
+        return os.path.abspath(file_path) in LOGGED_SOURCES
+
 def read_processed_files(log_file):
     """Đọc danh sách các file đã xử lý từ log."""
     processed_files = {}
@@ -360,16 +451,13 @@ def read_processed_files(log_file):
     return processed_files, processed_signatures
 
 
-def convert_legacy_log_file(log_path: Path, logs_dir: Path) -> Optional[Path]:
-    """Chuyển file processed_files.log cũ sang JSON và xóa file cũ."""
-    if not log_path.exists():
-        return None
-
+def read_legacy_log_entries(log_path: Path) -> List[Dict[str, Any]]:
+    """Đọc processed_files.log (old|new|time|signature) thành các entry JSON."""
     try:
         lines = log_path.read_text(encoding="utf-8").splitlines()
     except Exception as exc:
         print(f"[LOG] Không thể đọc {log_path}: {exc}")
-        return None
+        return []
 
     entries = []
     for line in lines:
@@ -385,83 +473,223 @@ def convert_legacy_log_file(log_path: Path, logs_dir: Path) -> Optional[Path]:
                 "category": "video",
             }
         )
+    return entries
 
-    if not entries:
-        return None
-
-    logs_dir.mkdir(parents=True, exist_ok=True)
-    new_file = logs_dir / f"legacy_{datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.json"
-    new_file.write_text(json.dumps(entries, ensure_ascii=False, indent=2), encoding="utf-8")
-    log_path.unlink(missing_ok=True)
-    print(f"[LOG] Đã chuyển {log_path} thành {new_file}")
+def convert_legacy_log_file(log_path: Path, logs_dir: Path, history: HistoryStore, keep_log: bool = False) -> int:
+    """Import một lần các định dạng cũ vào kho lịch sử. Trả về số entry mới.
 
-    if REMOTE_SYNC:
-        for entry in entries:
-            try:
-                REMOTE_SYNC.record_entry(entry, local_path=None)
-            except Exception as exc:
-                print(f"[AUTO PUSH] Không thể đồng bộ entry legacy: {exc}")
+    - processed_files.log: import rồi xóa (giữ lại nếu `keep_log`, ví dụ khi dry-run).
+    - Snapshot legacy_*.json / run_*.json / remote_sync_*.json trong `logs_dir`: giữ nguyên file,
+      mỗi file chỉ import một lần.
+    """
+    added = 0
+    if log_path.exists():
+        entries = read_legacy_log_entries(log_path)
+        st = log_path.stat()
+        added += history.import_entries(f"{log_path.name}:{st.st_size}:{st.st_mtime_ns}", entries)
+        if not keep_log:
+            if LOG_WRITER:
+                for entry in entries:
+                    LOG_WRITER.sync_remote(entry)
+            elif REMOTE_SYNC:
+                for entry in entries:
+                    try:
+                        REMOTE_SYNC.record_entry(entry, local_path=None)
+                    except Exception as exc:
+                        print(f"[AUTO PUSH] Không thể đồng bộ entry legacy: {exc}")
+            log_path.unlink(missing_ok=True)
+            print(f"[LOG] Đã chuyển {log_path} vào {history.db_path}")
+
+    if logs_dir.is_dir():
+        for pattern in ("legacy_*.json", "run_*.json", "remote_sync_*.json"):
+            for snapshot in sorted(logs_dir.glob(pattern)):
+                if history.was_imported(snapshot.name):
+                    continue
+                try:
+                    entries = json.loads(snapshot.read_text(encoding="utf-8"))
+                except Exception as exc:
+                    print(f"[LOG] Không thể đọc {snapshot}: {exc}")
+                    continue
+                if isinstance(entries, list):
+                    added += history.import_entries(snapshot.name, [e for e in entries if isinstance(e, dict)])
+    return added
+
+def open_history_store(logs_dir: Path, fsync: str = "batch") -> Optional[HistoryStore]:
+    """Mở kho lịch sử trong thư mục logs của thư viện (tương đối với thư mục đang xử lý)."""
+    try:
+        return HistoryStore(logs_dir / HISTORY_FILE, synchronous=HISTORY_SYNCHRONOUS.get(fsync, "NORMAL"))
+    except Exception as exc:
+        print(f"[LOG] Không thể mở lịch sử xử lý: {exc}. Dùng processed_files.log.")
+        return None
 
-    return new_file
+def open_sync_outbox(logs_dir: Path, fsync: str = "batch") -> Optional[SyncOutbox]:
+    """Mở outbox đồng bộ GitHub trong thư mục logs của thư viện."""
+    try:
+        return SyncOutbox(logs_dir / OUTBOX_FILE, fsync=fsync != "none")
+    except Exception as exc:
+        print(f"[AUTO PUSH] Không thể mở outbox đồng bộ: {exc}. Entry chỉ được giữ trong bộ nhớ.")
+        return None
 
+def history_snapshot(logs_dir: Path) -> HistoryStore:
+    """Bản sao trong bộ nhớ của kho lịch sử thư viện (dry-run: không tạo/sửa file nào trong logs)."""
+    history = HistoryStore(Path(":memory:"))
+    db_path = logs_dir / HISTORY_FILE
+    if db_path.exists():
+        try:
+            history.copy_from(db_path)
+        except sqlite3.Error as exc:
+            print(f"[LOG] Không thể đọc lịch sử xử lý {db_path}: {exc}")
+    return history
+
+def history_from_legacy_log(log_file) -> HistoryStore:
+    """Kho lịch sử tạm trong bộ nhớ, nạp từ processed_files.log (khi không mở được file SQLite)."""
+    history = HistoryStore(Path(":memory:"))
+    if os.path.exists(log_file):
+        history.append_many(read_legacy_log_entries(Path(log_file)), source="legacy")
+    return history
 
 def write_run_log_snapshot(logs_dir: Path, prefix: str = "run") -> Optional[Path]:
+    """Ghi nốt lô lịch sử đang chờ và upload snapshot phiên làm việc lên remote (nếu có)."""
     global RUN_LOG_ENTRIES
-    if not RUN_LOG_ENTRIES:
+    with LOG_LOCK:
+        entries = RUN_LOG_ENTRIES
+        RUN_LOG_ENTRIES = []
+    if LOG_WRITER:
+        LOG_WRITER.flush()
+    if not entries:
         return None
-    logs_dir.mkdir(parents=True, exist_ok=True)
-    file_path = logs_dir / f"{prefix}_{datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.json"
-    file_path.write_text(json.dumps(RUN_LOG_ENTRIES, ensure_ascii=False, indent=2), encoding="utf-8")
     if REMOTE_SYNC:
-        REMOTE_SYNC.upload_log_snapshot(RUN_LOG_ENTRIES, filename_prefix=prefix)
-    RUN_LOG_ENTRIES = []
-    print(f"[LOG] Đã lưu log phiên làm việc tại {file_path}")
-    return file_path
+        REMOTE_SYNC.upload_log_snapshot(entries, filename_prefix=prefix)
+    if HISTORY:
+        print(f"[LOG] Đã ghi {len(entries)} entry phiên làm việc vào {HISTORY.db_path}")
+        return HISTORY.db_path
+    return None
 
 def sanitize_filename(name):
     """Loại bỏ các ký tự không hợp lệ trong tên tệp để tránh lỗi FFmpeg."""
     # Thay thế các ký tự không hợp lệ bằng dấu gạch dưới
     return re.sub(r'[<>:"/\\|?*\n\r\t]', '_', name)
 
-def get_video_resolution_label(file_path):
+def file_fingerprint(file_path, st=None) -> str:
+    """Dấu vân tay nội dung của file (qua cache nếu có), không cần probe."""
+    if FINGERPRINTS:
+        return FINGERPRINTS.fingerprint(file_path, st)
+    return compute_fingerprint(file_path, include_segment_uid=FINGERPRINT_SEGMENT_UID)
+
+def load_media_info(file_path) -> MediaInfo:
+    """Probe file (qua probe cache nếu có) và trả về MediaInfo có dấu vân tay nội dung."""
+    try:
+        signature = file_fingerprint(file_path)
+    except OSError:
+        signature = None  # Để probe báo lỗi đọc file như trước
+    info = probe_media_info(file_path, cache=PROBE_CACHE, native=NATIVE_PROBE, signature=signature)
+    if FINGERPRINTS and signature:
+        # Lần sau file này khớp log cũ (size_duration) mà không cần probe
+        try:
+            FINGERPRINTS.record_migration(info.legacy_signature, signature)
+        except Exception as exc:
+            print(f"[CACHE] Không thể ghi bảng chuyển chữ ký: {exc}")
+    return info
+
+
+def open_probe_cache(settings) -> Optional[ProbeCache]:
+    """Mở probe cache trong thư mục cấu hình nếu được bật."""
+    if not settings.get("probe_cache", True):
+        return None
+    try:
+        max_entries = int(settings.get("probe_cache_max_entries", PROBE_CACHE_MAX_ENTRIES))
+        return ProbeCache(get_config_dir() / "probe_cache.sqlite3", max_entries=max_entries)
+    except Exception as exc:
+        print(f"[CACHE] Không thể mở probe cache: {exc}")
+        return None
+
+def open_scan_journal(settings) -> Optional[ScanJournal]:
+    """Mở scan journal trong thư mục cấu hình (dùng chung với GUI) nếu được bật."""
+    if not settings.get("scan_journal", True):
+        return None
+    try:
+        return ScanJournal(get_config_dir() / "scan_journal.sqlite3")
+    except Exception as exc:
+        print(f"[SCAN] Không thể mở scan journal: {exc}")
+        return None
+
+def build_library_walker(input_folder, settings) -> Optional[LibraryWalker]:
+    """Walker đệ quy theo config ("recursive", "scan_include", "scan_exclude", "scan_max_depth")."""
+    if not settings.get("recursive", False):
+        return None
+    max_depth = settings.get("scan_max_depth")
+    return LibraryWalker(
+        input_folder,
+        include=settings.get("scan_include") or (),
+        exclude=settings.get("scan_exclude") or (),
+        max_depth=None if max_depth in (None, "") else int(max_depth),
+        workers=int(settings.get("scan_workers", WALK_WORKERS)),
+        skip_dirs=DEFAULT_SKIP_DIRS,
+    )
+
+def iter_library_paths(
+    input_folder,
+    walker: Optional[LibraryWalker] = None,
+    journal: Optional[ScanJournal] = None,
+    full_scan=False,
+    scans: Optional[List[ScanResult]] = None,
+) -> Iterator[str]:
+    """Các file MKV cần xét, trả về dần cho prefetch (không dựng cả danh sách).
+
+    Không có walker: chỉ thư mục gốc như trước. Có walker: duyệt đệ quy, mỗi thư mục
+    vừa liệt kê xong được so với scan journal (dùng luôn kết quả scandir của walker).
+    Kết quả quét được thêm vào `scans` để commit sau khi xử lý xong.
+    """
+    if scans is None:
+        scans = []
+    if walker is None:
+        scan = journal.scan(input_folder, full=full_scan) if journal else None
+        if scan is None:
+            yield from sorted(os.path.join(input_folder, f) for f in os.listdir(input_folder) if f.lower().endswith(".mkv"))
+            return
+        print(f"[SCAN] {scan.describe()}")
+        scans.append(scan)
+        if full_scan:
+            yield from (os.path.join(input_folder, name) for name in sorted(scan.listed))
+        else:
+            yield from scan.paths()
+        return
+
+    for directory in walker.directories():
+        if journal is None:
+            yield from directory.paths()
+            continue
+        scan = journal.scan(directory.path, listed=directory.entries, filtered=directory.filtered)
+        scans.append(scan)
+        yield from directory.paths() if full_scan else scan.paths()
+
+def open_fingerprint_cache(settings) -> Optional[FingerprintCache]:
+    """Mở cache dấu vân tay trong thư mục cấu hình nếu được bật."""
+    if not settings.get("fingerprint_cache", True):
+        return None
+    try:
+        return FingerprintCache(
+            get_config_dir() / "fingerprints.sqlite3",
+            include_segment_uid=bool(settings.get("fingerprint_segment_uid", True)),
+        )
+    except Exception as exc:
+        print(f"[CACHE] Không thể mở cache dấu vân tay: {exc}")
+        return None
+
+def get_video_resolution_label(file_path, media_info=None):
     """Lấy tên độ phân giải video (FHD, 4K, 2K, HD)."""
     try:
-        probe = ffmpeg.probe(file_path)
-        video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
-        if video_stream and 'width' in video_stream and 'height' in video_stream:
-            width = int(video_stream['width'])
-            height = int(video_stream['height'])
-            # 8k
-            if width >= 7680 or height >= 4320:
-                return "8K"
-            # 4k
-            elif width >= 3840 or height >= 2160:  # Bao gồm cả 3840x1608
-                return "4K"
-            # 2k
-            elif width >= 2560 or height >= 1440:
-                return "2K"
-            # FHD
-            elif width >= 1920 or height >= 1080:
-                return "FHD"
-            # HD
-            elif width >= 1280 or height >= 720:
-                return "HD"
-            # 480p
-            elif width >= 720 or height >= 480:
-                return "480p"
-            else:
-                return f"{width}p"
+        info = media_info or load_media_info(file_path)
+        return info.resolution_label
     except Exception as e:
         print(f"Error getting resolution for {file_path}: {e}")
-    return "unknown_resolution"
+    return UNKNOWN_RESOLUTION
 
-def get_movie_year(file_path):
+def get_movie_year(file_path, media_info=None):
     """Lấy năm của phim từ metadata."""
     try:
-        probe = ffmpeg.probe(file_path)
-        format_tags = probe.get("format", {}).get("tags", {})
-        year = format_tags.get("year", "")
-        return year.strip()
+        info = media_info or load_media_info(file_path)
+        return info.year
     except Exception as e:
         print(f"Error getting year for {file_path}: {e}")
     return ""
@@ -530,32 +758,35 @@ def get_language_abbreviation(language_code):
     }
     return language_map.get(language_code, language_code.upper()[:3])
 
-def rename_simple(file_path):
+def simple_rename_name(file_path, media_info: MediaInfo):
+    """Tên mới của file khi chỉ đổi tên đơn giản (độ phân giải + ngôn ngữ audio đầu tiên)."""
+    resolution_label = media_info.resolution_label
+    # Lấy ngôn ngữ từ audio stream đầu tiên
+    audio_stream = media_info.first_audio
+    language = 'und'  # mặc định là undefined
+    audio_title = ''
+    if audio_stream:
+        language = audio_stream.get('tags', {}).get('language', 'und')
+        audio_title = audio_stream.get('tags', {}).get('title', '')
+    
+    language_abbr = get_language_abbreviation(language)
+    # Chỉ thêm audio_title nếu khác với language_abbr và không rỗng
+    if audio_title and audio_title != language_abbr:
+        lang_part = f"{language_abbr}_{audio_title}"
+    else:
+        lang_part = language_abbr
+    
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    
+    new_name = f"{resolution_label}_{lang_part}_{base_name}.mkv"
+    return sanitize_filename(new_name)
+
+def rename_simple(file_path, media_info=None):
     """Đổi tên file đơn giản cho trường hợp không có audio để tách."""
     try:
-        resolution_label = get_video_resolution_label(file_path)
-        probe = ffmpeg.probe(file_path)
-        # Lấy ngôn ngữ từ audio stream đầu tiên
-        audio_stream = next((stream for stream in probe['streams'] 
-                           if stream['codec_type'] == 'audio'), None)
-        language = 'und'  # mặc định là undefined
-        audio_title = ''
-        if audio_stream:
-            language = audio_stream.get('tags', {}).get('language', 'und')
-            audio_title = audio_stream.get('tags', {}).get('title', '')
-        
-        language_abbr = get_language_abbreviation(language)
-        # Chỉ thêm audio_title nếu khác với language_abbr và không rỗng
-        if audio_title and audio_title != language_abbr:
-            lang_part = f"{language_abbr}_{audio_title}"
-        else:
-            lang_part = language_abbr
-        
-        base_name = os.path.splitext(os.path.basename(file_path))[0]
-        
-        new_name = f"{resolution_label}_{lang_part}_{base_name}.mkv"
-        new_name = sanitize_filename(new_name)
-        
+        if media_info is None:
+            media_info = load_media_info(file_path)
+        new_name = simple_rename_name(file_path, media_info)
         dir_path = os.path.dirname(file_path)
         new_path = os.path.join(dir_path, new_name)
         
@@ -566,19 +797,56 @@ def rename_simple(file_path):
         print(f"Error simple renaming file {file_path}: {e}")
         return file_path
 
-def extract_video_with_audio(file_path, vn_folder, original_folder, log_file, probe_data, file_signature=None):
+def select_audio_track(media_info: MediaInfo, vn_folder, original_folder):
+    """Chọn track audio cần tách và thư mục output. Trả về (output_folder, track) hoặc None."""
+    audio_streams = media_info.audio_streams
+    if not audio_streams:
+        return None
+
+    # Lấy thông tin audio đầu tiên để xác định trường hợp
+    first_audio = audio_streams[0]
+    first_audio_language = first_audio.get('tags', {}).get('language', 'und')
+
+    # Tạo danh sách audio tracks với thông tin cần thiết
+    audio_tracks = []
+    for stream in audio_streams:
+        index = stream.get('index', -1)
+        channels = stream.get('channels', 0)
+        language = stream.get('tags', {}).get('language', 'und')
+        title = stream.get('tags', {}).get('title', get_language_abbreviation(language))
+        audio_tracks.append((index, channels, language, title))
+
+    # Sắp xếp theo số kênh giảm dần
+    audio_tracks.sort(key=lambda x: x[1], reverse=True)
+    
+    vietnamese_tracks = [track for track in audio_tracks if track[2] == 'vie']
+    non_vietnamese_tracks = [track for track in audio_tracks if track[2] != 'vie']
+
+    if first_audio_language == 'vie':
+        # Trường hợp 1: Audio đầu tiên là tiếng Việt
+        if non_vietnamese_tracks:
+            # Chọn audio không phải tiếng Việt có nhiều kênh nhất
+            return original_folder, non_vietnamese_tracks[0]
+    else:
+        # Trường hợp 2: Audio đầu tiên không phải tiếng Việt
+        if vietnamese_tracks:
+            # Chọn audio tiếng Việt có nhiều kênh nhất
+            return vn_folder, vietnamese_tracks[0]
+    return None
+
+def extract_video_with_audio(file_path, vn_folder, original_folder, log_file, media_info: MediaInfo):
     """Tách video với audio theo yêu cầu."""
     try:
-        audio_streams = [stream for stream in probe_data['streams'] if stream['codec_type'] == 'audio']
+        audio_streams = media_info.audio_streams
         
         if not audio_streams:
             print(f"No audio found in {file_path}. Performing simple rename.")
-            new_path = rename_simple(file_path)
+            new_path = rename_simple(file_path, media_info)
             log_processed_file(
                 log_file,
                 os.path.basename(file_path),
                 os.path.basename(new_path),
-                signature=file_signature,
+                media_info=media_info,
                 metadata={
                     "category": "video",
                     "source_path": file_path,
@@ -587,46 +855,23 @@ def extract_video_with_audio(file_path, vn_folder, original_folder, log_file, pr
             )
             return
 
-        # Lấy thông tin audio đầu tiên để xác định trường hợp
-        first_audio = audio_streams[0]
-        first_audio_language = first_audio.get('tags', {}).get('language', 'und')
-
-        # Tạo danh sách audio tracks với thông tin cần thiết
-        audio_tracks = []
-        for stream in audio_streams:
-            index = stream.get('index', -1)
-            channels = stream.get('channels', 0)
-            language = stream.get('tags', {}).get('language', 'und')
-            title = stream.get('tags', {}).get('title', get_language_abbreviation(language))
-            audio_tracks.append((index, channels, language, title))
-
-        # Sắp xếp theo số kênh giảm dần
-        audio_tracks.sort(key=lambda x: x[1], reverse=True)
-        
-        vietnamese_tracks = [track for track in audio_tracks if track[2] == 'vie']
-        non_vietnamese_tracks = [track for track in audio_tracks if track[2] != 'vie']
-
-        if first_audio_language == 'vie':
-            # Trường hợp 1: Audio đầu tiên là tiếng Việt
-            if non_vietnamese_tracks:
-                # Chọn audio không phải tiếng Việt có nhiều kênh nhất
-                selected_track = non_vietnamese_tracks[0]
-                process_video(file_path, original_folder, selected_track, log_file, probe_data, file_signature=file_signature)
-        else:
-            # Trường hợp 2: Audio đầu tiên không phải tiếng Việt
-            if vietnamese_tracks:
-                # Chọn audio tiếng Việt có nhiều kênh nhất
-                selected_track = vietnamese_tracks[0]
-                process_video(file_path, vn_folder, selected_track, log_file, probe_data, file_signature=file_signature)
+        selection = select_audio_track(media_info, vn_folder, original_folder)
+        if selection:
+            output_folder, selected_track = selection
+            process_video(file_path, output_folder, selected_track, log_file, media_info)
 
+    except JobStalledError:
+        raise
     except Exception as e:
         print(f"Exception while processing {file_path}: {e}")
 
-def rename_file(file_path, audio_info, is_output=False):
+def rename_file(file_path, audio_info, is_output=False, media_info=None):
     """Đổi tên file theo format yêu cầu."""
     try:
-        resolution_label = get_video_resolution_label(file_path)
-        year = get_movie_year(file_path)
+        if media_info is None:
+            media_info = load_media_info(file_path)
+        resolution_label = media_info.resolution_label
+        year = media_info.year
         language = audio_info[2]  # Mã ngôn ngữ
         audio_title = audio_info[3]  # Tiêu đề audio
         
@@ -656,49 +901,208 @@ def rename_file(file_path, audio_info, is_output=False):
         print(f"Error renaming file {file_path}: {e}")
         return file_path
 
-def process_video(file_path, output_folder, selected_track, log_file, probe_data, file_signature=None):
-    """Xử lý video với track audio đã chọn và trích xuất subtitle."""
+def build_video_output_names(file_path, media_info: MediaInfo, selected_track):
+    """Tên mới cho file gốc và file output. Trả về (source_name, output_name) hoặc None nếu không có audio."""
+    first_audio = media_info.first_audio
+    if not first_audio:
+        return None
+    resolution_label = media_info.resolution_label
+    year = media_info.year
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+
+    first_audio_lang = first_audio.get('tags', {}).get('language', 'und')
+    first_audio_title = first_audio.get('tags', {}).get('title', '')
+    # Sử dụng title chỉ khi khác với language abbreviation
+    first_audio_display = get_language_abbreviation(first_audio_lang)
+    if first_audio_title and first_audio_title != first_audio_display:
+        first_audio_display += f"_{first_audio_title}"
+
+    # Logic tương tự cho selected track
+    selected_lang_abbr = get_language_abbreviation(selected_track[2])
+    selected_title = selected_track[3]
+    selected_display = selected_lang_abbr
+    if selected_title and selected_title != selected_lang_abbr:
+        selected_display += f"_{selected_title}"
+
+    source_name = f"{resolution_label}_{first_audio_display}"
+    output_name = f"{resolution_label}_{selected_display}"
+
+    # Thêm năm và tên gốc
+    if year:
+        source_name += f"_{year}"
+        output_name += f"_{year}"
+    source_name += f"_{base_name}.mkv"
+    output_name += f"_{base_name}.mkv"
+    return source_name, output_name
+
+def rename_source_after_output(file_path, source_name, log_file, media_info: MediaInfo):
+    """Đổi tên file gốc sau khi đã tạo output thành công và ghi log."""
+    new_source_path = os.path.join(os.path.dirname(file_path), sanitize_filename(source_name))
+    os.rename(file_path, new_source_path)
+    print(f"Đã đổi tên file gốc thành: {source_name}")
+
+    log_processed_file(
+        log_file,
+        os.path.basename(file_path),
+        os.path.basename(new_source_path),
+        media_info=media_info,
+        metadata={
+            "category": "video",
+            "source_path": file_path,
+            "output_path": os.path.abspath(new_source_path),
+        },
+    )
+    return new_source_path
+
+def has_enough_disk_space(output_dir, min_free_gb=2):
+    """Tạo thư mục output nếu cần và kiểm tra dung lượng trống (mặc định >= 2GB)."""
     try:
-        original_filename = os.path.basename(file_path)
-        
-        # Lấy thông tin cơ bản
-        resolution_label = get_video_resolution_label(file_path)
-        year = get_movie_year(file_path)
-        base_name = os.path.splitext(os.path.basename(file_path))[0]
-        
-        # Lấy thông tin audio đầu tiên
-        first_audio = next((stream for stream in probe_data['streams'] 
-                          if stream['codec_type'] == 'audio'), None)
+        os.makedirs(output_dir, exist_ok=True)
+        disk_usage = shutil.disk_usage(output_dir)
+        free_space_gb = disk_usage.free / (1024**3)
+        print(f"Dung lượng trống trên ổ đĩa: {free_space_gb:.2f} GB")
+
+        if free_space_gb < min_free_gb:
+            print(f"CẢNH BÁO: Quá ít dung lượng trống trên ổ đĩa. Cần ít nhất {min_free_gb}GB")
+            return False
+    except Exception as disk_err:
+        print(f"Lỗi khi kiểm tra dung lượng ổ đĩa: {disk_err}")
+    return True
+
+def write_ffmpeg_output(file_path, output_args, final_output_path, output_format, size_bytes, media_info=None):
+    """Chạy ffmpeg ghi một output tới `final_output_path`.
+
+    Mặc định ffmpeg ghi thẳng vào `<đích>.part` (cần `-f` vì đuôi .part) rồi
+    đổi tên khi xong. Chỉ staging trong RAM khi staging.choose_staging_dir
+    thấy có lợi (đích là ổ mạng); staging lỗi thì quay về ghi trực tiếp.
+    `media_info` của file nguồn dùng cho tiến độ (%, ETA) và ngân sách thời gian
+    của watchdog. Job bị watchdog kill thì dọn file dở dang rồi ném JobStalledError.
+    Trả về (thành công, kết quả subprocess cuối cùng).
+    """
+    label = os.path.basename(final_output_path)
+    output_dir = os.path.dirname(final_output_path) or "."
+    result = None
+    try:
+        available_ram = psutil.virtual_memory().available
+    except Exception:
+        available_ram = 0
+    staging_location = choose_staging_dir(output_dir, size_bytes, available_ram, STAGING_MODE)
+
+    if staging_location:
+        staging_dir = make_staging_dir(staging_location)
+        try:
+            staged_path = os.path.join(staging_dir, os.path.basename(final_output_path))
+            cmd = ['ffmpeg', '-i', file_path, *output_args, '-y', staged_path]
+            print(f"Đang chạy lệnh (staging trong {staging_location}): {' '.join(cmd)}")
+            result = run_ffmpeg_command(cmd, label=label, media_info=media_info, outputs=[staged_path])
+            if result.returncode == 0 and os.path.exists(staged_path):
+                move_into_place(staged_path, final_output_path, STAGING_STATS)
+                return True, result
+            print("Staging thất bại. Chuyển sang ghi trực tiếp ra ổ đĩa...")
+        except JobStalledError:
+            raise  # Thư mục staging được xóa ở finally, không thử ghi lại
+        except Exception as stage_err:
+            print(f"Lỗi khi staging: {stage_err}")
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    part = part_path(final_output_path)
+    cmd = ['ffmpeg', '-i', file_path, *output_args, '-f', output_format, '-y', part]
+    print(f"Đang chạy lệnh trên ổ đĩa: {' '.join(cmd)}")
+    try:
+        result = run_ffmpeg_command(cmd, label=label, media_info=media_info, outputs=[part])
+    except JobStalledError:
+        discard(part)
+        raise
+    if result.returncode == 0 and os.path.exists(part):
+        STAGING_STATS.add_direct(commit_part(part, final_output_path))
+        return True, result
+    discard(part)
+    return False, result
+
+def set_default_audio_in_place(file_path, final_output_path, selected_track, log_file, media_info: MediaInfo):
+    """Đặt track audio đã chọn làm default ngay trong header rồi chuyển file sang thư mục output.
+
+    Giữ nguyên mọi track, chỉ đổi FlagDefault/FlagEnabled (giống mkvpropedit).
+    Trả về False nếu không sửa được (hoặc đã khôi phục header khi không chuyển được file)
+    để người gọi remux như cũ.
+    """
+    # Kiểm tra đích trước khi động vào file nguồn: rename phải chắc chắn thành công
+    output_dir = os.path.dirname(os.path.abspath(final_output_path))
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        if os.path.exists(final_output_path):
+            print(f"File đích đã tồn tại: {final_output_path}")
+            return False
+        if os.stat(file_path).st_dev != os.stat(output_dir).st_dev:
+            print("Thư mục output nằm trên ổ khác, không thể chỉ đổi tên file")
+            return False
+    except OSError as check_err:
+        print(f"Không thể kiểm tra thư mục output: {check_err}")
+        return False
+
+    try:
+        mkv = parse_matroska(file_path)
+        # selected_track[0] là stream index của ffprobe, khác thứ tự TrackEntry khi có track bị FFmpeg bỏ qua
+        selected = track_for_stream(mkv, selected_track[0])
+        if selected is None or selected.track_type != TRACK_TYPE_AUDIO:
+            print(f"Stream {selected_track[0]} không phải track audio trong header Matroska")
+            return False
+        if selected_track[1] and selected.channels != selected_track[1]:
+            print(f"Track {selected.number} có {selected.channels} kênh, khác thông tin probe ({selected_track[1]})")
+            return False
+        audio_tracks = [track for track in stream_tracks(mkv) if track.track_type == TRACK_TYPE_AUDIO]
+        edits = [
+            TrackEdit(track.number, flag_default=1, flag_enabled=1) if track is selected
+            else TrackEdit(track.number, flag_default=0)
+            for track in audio_tracks
+        ]
+        originals = [
+            TrackEdit(track.number, flag_default=track.flag_default, flag_enabled=track.flag_enabled)
+            for track in audio_tracks
+        ]
+        written = edit_tracks_in_place(file_path, edits)
+    except (MatroskaEditError, MatroskaParseError, OSError) as edit_err:
+        print(f"Lỗi khi sửa header Matroska: {edit_err}")
+        return False
+
+    print(f"Đã đặt audio index={selected_track[0]} (track {selected.number}) làm mặc định (ghi {written} byte header)")
+    metadata = {
+        "category": "video",
+        "source_path": file_path,
+        "output_path": os.path.abspath(final_output_path),
+        "notes": "inplace",
+    }
+    try:
+        os.rename(file_path, final_output_path)
+        print(f"Đã chuyển file tới: {final_output_path}")
+    except OSError as rename_err:
+        print(f"Không thể chuyển file tới {final_output_path}: {rename_err}")
+        try:
+            edit_tracks_in_place(file_path, originals)
+            print("Đã khôi phục cờ audio trong header file gốc")
+            return False
+        except (MatroskaEditError, MatroskaParseError, OSError) as restore_err:
+            # File gốc đã bị sửa và ở nguyên chỗ cũ: ghi log để không xử lý lại
+            print(f"Không thể khôi phục header: {restore_err}. Giữ file đã sửa tại chỗ.")
+            final_output_path = file_path
+            metadata.update(output_path=os.path.abspath(file_path), notes="inplace-not-moved")
+    log_processed_file(
+        log_file,
+        os.path.basename(file_path),
+        os.path.basename(final_output_path),
+        media_info=media_info,
+        metadata=metadata,
+    )
+    return True
+
+def process_video(file_path, output_folder, selected_track, log_file, media_info: MediaInfo, output_mode=None):
+    """Xử lý video với track audio đã chọn. `output_mode` (remux/inplace) mặc định theo OUTPUT_MODE."""
+    try:
+        names = build_video_output_names(file_path, media_info, selected_track)
         
-        if first_audio:
-            first_audio_lang = first_audio.get('tags', {}).get('language', 'und')
-            first_audio_title = first_audio.get('tags', {}).get('title', '')
-            # Sử dụng title chỉ khi khác với language abbreviation
-            first_audio_display = get_language_abbreviation(first_audio_lang)
-            if first_audio_title and first_audio_title != first_audio_display:
-                first_audio_display += f"_{first_audio_title}"
-            
-            # Logic tương tự cho selected track
-            selected_lang_abbr = get_language_abbreviation(selected_track[2])
-            selected_title = selected_track[3]
-            selected_display = selected_lang_abbr
-            if selected_title and selected_title != selected_lang_abbr:
-                selected_display += f"_{selected_title}"
-            
-            # Format tên file
-            if first_audio_lang == 'vie':
-                source_name = f"{resolution_label}_{first_audio_display}"
-                output_name = f"{resolution_label}_{selected_display}"
-            else:
-                source_name = f"{resolution_label}_{first_audio_display}"
-                output_name = f"{resolution_label}_{selected_display}"
-            
-            # Thêm năm và tên gốc
-            if year:
-                source_name += f"_{year}"
-                output_name += f"_{year}"
-            source_name += f"_{base_name}.mkv"
-            output_name += f"_{base_name}.mkv"
+        if names:
+            source_name, output_name = names
             
             # Đường dẫn output cuối cùng
             final_output_path = os.path.join(output_folder, sanitize_filename(output_name))
@@ -708,127 +1112,35 @@ def process_video(file_path, output_folder, selected_track, log_file, probe_data
                 print(f"File đích đã tồn tại: {final_output_path}. Bỏ qua.")
                 return True
             
-            # Kiểm tra không gian trống trên đĩa
-            try:
-                output_dir = os.path.dirname(final_output_path)
-                if not os.path.exists(output_dir):
-                    os.makedirs(output_dir)
-                disk_usage = shutil.disk_usage(output_dir)
-                free_space_gb = disk_usage.free / (1024**3)
-                print(f"Dung lượng trống trên ổ đĩa: {free_space_gb:.2f} GB")
-                
-                if free_space_gb < 2:  # Cần ít nhất 2GB không gian trống để an toàn
-                    print(f"CẢNH BÁO: Quá ít dung lượng trống trên ổ đĩa. Cần ít nhất 2GB")
-                    return False
-            except Exception as disk_err:
-                print(f"Lỗi khi kiểm tra dung lượng ổ đĩa: {disk_err}")
-            
-            # Kiểm tra RAM khả dụng
-            file_size = get_file_size_gb(file_path)
-            available_ram = check_available_ram()
-            
-            # Ưu tiên xử lý trong RAM nếu có đủ RAM
-            ram_required = file_size * 2  # Cần ít nhất 200% kích thước file
-            try_ram_first = available_ram > ram_required
-            
-            if try_ram_first:
-                print(f"Đủ RAM để xử lý file ({available_ram:.2f}GB > {ram_required:.2f}GB). Thử xử lý trong RAM...")
-                
-                # Xử lý trong RAM
-                ram_success = False
-                try:
-                    with temp_directory_in_memory(use_ram=True, file_size_gb=file_size) as temp_dir:
-                        # Đường dẫn tạm thời trong RAM
-                        temp_output_path = os.path.join(temp_dir, sanitize_filename(output_name))
-                        
-                        # Xử lý tách audio trong RAM
-                        cmd = [
-                            'ffmpeg',
-                            '-i', file_path,
-                            '-map', '0:v',
-                            '-map', f'0:{selected_track[0]}',
-                            '-c', 'copy',
-                            '-y',
-                            temp_output_path
-                        ]
-                        
-                        print(f"Đang chạy lệnh trong RAM: {' '.join(cmd)}")
-                        result = run_ffmpeg_command(cmd, capture_output=True)
-                        
-                        if result.returncode == 0 and os.path.exists(temp_output_path):
-                            print(f"Xử lý trong RAM thành công. Di chuyển file tới: {final_output_path}")
-                            # Chuyển từ RAM sang ổ đĩa
-                            shutil.copy2(temp_output_path, final_output_path)
-                            ram_success = True
-                except Exception as ram_error:
-                    print(f"Lỗi khi xử lý trong RAM: {ram_error}")
-                    
-                # Nếu xử lý trong RAM thành công
-                if ram_success and os.path.exists(final_output_path):
-                    print(f"Video đã được lưu tới: {final_output_path}")
-                    
-                    # Rename file gốc sau khi xử lý thành công
-                    new_source_path = os.path.join(os.path.dirname(file_path), sanitize_filename(source_name))
-                    os.rename(file_path, new_source_path)
-                    print(f"Đã đổi tên file gốc thành: {source_name}")
-                    
-                    # Ghi log
-                    log_processed_file(
-                        log_file,
-                        original_filename,
-                        os.path.basename(new_source_path),
-                        signature=file_signature,
-                        metadata={
-                            "category": "video",
-                            "source_path": file_path,
-                            "output_path": os.path.abspath(new_source_path),
-                        },
-                    )
+            # Chế độ inplace: chỉ sửa vài KB header thay vì copy cả file
+            if (output_mode or OUTPUT_MODE) == "inplace":
+                if set_default_audio_in_place(file_path, final_output_path, selected_track, log_file, media_info):
                     return True
-                else:
-                    print("Xử lý trong RAM thất bại. Chuyển sang xử lý trực tiếp trên ổ đĩa...")
-            else:
-                print(f"Không đủ RAM để xử lý ({available_ram:.2f}GB < {ram_required:.2f}GB). Xử lý trực tiếp trên ổ đĩa.")
+                print("Không sửa được header tại chỗ. Chuyển sang remux toàn bộ file...")
             
-            # Nếu không đủ RAM hoặc xử lý trong RAM thất bại, xử lý trực tiếp trên ổ đĩa
-            print("Xử lý video trực tiếp trên ổ đĩa...")
-            cmd = [
-                'ffmpeg',
-                '-i', file_path,
-                '-map', '0:v',
-                '-map', f'0:{selected_track[0]}',
-                '-c', 'copy',
-                '-y',
-                final_output_path
-            ]
+            # Kiểm tra không gian trống trên đĩa (cần ít nhất 2GB để an toàn)
+            if not has_enough_disk_space(os.path.dirname(final_output_path)):
+                return False
             
-            print(f"Đang chạy lệnh trên ổ đĩa: {' '.join(cmd)}")
-            result = run_ffmpeg_command(cmd, capture_output=True)
+            # Ghi thẳng ra .part cạnh file đích, chỉ staging trong RAM khi đích là ổ mạng
+            ok, result = write_ffmpeg_output(
+                file_path,
+                ['-map', '0:v', '-map', f'0:{selected_track[0]}', '-c', 'copy'],
+                final_output_path,
+                'matroska',
+                media_info.size,
+                media_info=media_info,
+            )
             
-            if result.returncode == 0 and os.path.exists(final_output_path):
+            if ok:
                 print(f"Video đã được lưu thành công tới: {final_output_path}")
                 
-                # Rename file gốc sau khi xử lý thành công
-                new_source_path = os.path.join(os.path.dirname(file_path), sanitize_filename(source_name))
-                os.rename(file_path, new_source_path)
-                print(f"Đã đổi tên file gốc thành: {source_name}")
-                
-                # Ghi log
-                log_processed_file(
-                    log_file,
-                    original_filename,
-                    os.path.basename(new_source_path),
-                    signature=file_signature,
-                    metadata={
-                        "category": "video",
-                        "source_path": file_path,
-                        "output_path": os.path.abspath(new_source_path),
-                    },
-                )
+                # Rename file gốc sau khi xử lý thành công và ghi log
+                rename_source_after_output(file_path, source_name, log_file, media_info)
                 return True
             else:
                 print(f"Xử lý thất bại: {file_path}")
-                if result.stderr:
+                if result is not None and result.stderr:
                     stderr_text = result.stderr.decode('utf-8', errors='replace')
                     print(f"Lỗi: {stderr_text}")
                 return False
@@ -836,205 +1148,267 @@ def process_video(file_path, output_folder, selected_track, log_file, probe_data
             print(f"Không tìm thấy audio trong {file_path}")
             return False
             
+    except JobStalledError:
+        raise  # Không thử lại file đang treo, để process_mkv_job ghi nhận và chuyển file khác
     except Exception as e:
         print(f"Lỗi khi xử lý {file_path}: {e}")
         return False
 
-def extract_subtitle(file_path, subtitle_info, log_file, probe_data, file_signature=None):
+def subtitle_output_path(file_path, language):
+    """Đường dẫn file .srt trong ./Subtitles: giữ nguyên tên gốc và thêm mã ngôn ngữ."""
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    
+    # Rút gọn tên file nếu quá dài
+    if len(base_name) > 100:
+        base_name = base_name[:100]
+    
+    return os.path.join(SUBTITLE_FOLDER, sanitize_filename(f"{base_name}_{language}.srt"))
+
+def log_subtitle_output(log_file, file_path, final_output_path, language, media_info: MediaInfo):
+    """Ghi log một subtitle đã trích xuất."""
+    log_processed_file(
+        log_file,
+        os.path.basename(file_path),
+        os.path.basename(final_output_path),
+        media_info=media_info,
+        metadata={
+            "category": "subtitle",
+            "language": language,
+            "output_path": os.path.abspath(final_output_path),
+            "local_path": os.path.abspath(final_output_path),
+        },
+    )
+
+def extract_subtitle(file_path, subtitle_info, log_file, media_info: MediaInfo):
     """Trích xuất subtitle tiếng Việt từ file video."""
     try:
         # Tạo thư mục ./Subtitles nếu chưa tồn tại
-        sub_root_folder = os.path.join(".", "Subtitles")
-        create_folder(sub_root_folder)
+        create_folder(SUBTITLE_FOLDER)
         
         index, language, title, codec = subtitle_info
         
         # Chỉ xử lý subtitle và định dạng text-based
-        text_based_codecs = ['srt', 'ass', 'ssa', 'subrip']
-        if codec.lower() not in text_based_codecs:
+        if codec.lower() not in TEXT_SUBTITLE_CODECS:
             print(f"Bỏ qua subtitle: định dạng {codec} không được hỗ trợ (chỉ hỗ trợ text-based)")
             return False
             
-        base_name = os.path.splitext(os.path.basename(file_path))[0]
-        
-        # Rút gọn tên file nếu quá dài
-        if len(base_name) > 100:
-            base_name = base_name[:100]
-        
-        # Đặt tên file subtitle giữ nguyên tên gốc và thêm mã ngôn ngữ
-        sub_filename = sanitize_filename(f"{base_name}_{language}.srt")
-        final_output_path = os.path.join(sub_root_folder, sub_filename)
+        final_output_path = subtitle_output_path(file_path, language)
         
         # Kiểm tra nếu subtitle đã tồn tại
         if os.path.exists(final_output_path):
             print(f"Subtitle đã tồn tại: {final_output_path}. Bỏ qua.")
-            log_processed_file(
-                log_file,
-                os.path.basename(file_path),
-                sub_filename,
-                signature=file_signature,
-                metadata={
-                    "category": "subtitle",
-                    "language": language,
-                    "output_path": os.path.abspath(final_output_path),
-                    "local_path": os.path.abspath(final_output_path),
-                },
-            )
+            log_subtitle_output(log_file, file_path, final_output_path, language, media_info)
             return final_output_path
         
-        # Kiểm tra RAM khả dụng - subtitle thường nhỏ nên yêu cầu ít RAM hơn
-        available_ram = check_available_ram()
-        print(f"Xử lý subtitle với {available_ram:.2f} GB RAM khả dụng")
-        
-        # Ưu tiên xử lý trong RAM nếu có đủ RAM (>= 0.5GB)
-        try_ram_first = available_ram >= 0.5
-        
-        if try_ram_first:
-            print(f"Thử trích xuất subtitle trong RAM...")
-            
-            # Xử lý trong RAM
-            ram_success = False
-            try:
-                with temp_directory_in_memory(use_ram=True, file_size_gb=None) as temp_dir:
-                    # Đường dẫn tạm thời trong RAM
-                    temp_output_path = os.path.join(temp_dir, sub_filename)
-                    
-                    # Lệnh ffmpeg để trích xuất subtitle vào RAM
-                    cmd = [
-                        'ffmpeg',
-                        '-i', file_path,
-                        '-map', f'0:{index}',
-                        '-c:s', 'srt',
-                        '-y',
-                        temp_output_path
-                    ]
-                    
-                    print(f"Đang chạy lệnh trong RAM: {' '.join(cmd)}")
-                    result = run_ffmpeg_command(cmd, capture_output=True)
-                    
-                    if result.returncode == 0 and os.path.exists(temp_output_path):
-                        print(f"Trích xuất trong RAM thành công. Di chuyển file tới: {final_output_path}")
-                        # Chuyển từ RAM sang ổ đĩa
-                        shutil.copy2(temp_output_path, final_output_path)
-                        ram_success = True
-            except Exception as ram_error:
-                print(f"Lỗi khi xử lý trong RAM: {ram_error}")
-                
-            # Nếu xử lý trong RAM thành công
-            if ram_success and os.path.exists(final_output_path):
-                print(f"Subtitle đã được lưu thành công tới: {final_output_path}")
-                
-                # Ghi vào log
-                log_processed_file(
-                    log_file,
-                    os.path.basename(file_path),
-                    sub_filename,
-                    signature=file_signature,
-                    metadata={
-                        "category": "subtitle",
-                        "language": language,
-                        "output_path": os.path.abspath(final_output_path),
-                        "local_path": os.path.abspath(final_output_path),
-                    },
-                )
-                return final_output_path
-            else:
-                print("Xử lý trong RAM thất bại. Chuyển sang xử lý trực tiếp trên ổ đĩa...")
-        else:
-            print(f"Không đủ RAM để xử lý. Xử lý trực tiếp trên ổ đĩa.")
-        
-        # Xử lý trực tiếp vào thư mục đích nếu không thể xử lý trong RAM
+        # Subtitle nhỏ: ghi thẳng ra .part trong ./Subtitles rồi đổi tên
         print(f"Trích xuất subtitle trực tiếp vào: {final_output_path}")
+        ok, result = write_ffmpeg_output(
+            file_path, ['-map', f'0:{index}', '-c:s', 'srt'], final_output_path, 'srt', 0,
+            media_info=media_info,
+        )
         
-        # Lệnh ffmpeg để trích xuất subtitle
-        cmd = [
-            'ffmpeg',
-            '-i', file_path,
-            '-map', f'0:{index}',
-            '-c:s', 'srt',
-            '-y',
-            final_output_path
-        ]
-        
-        print(f"Đang chạy lệnh trên ổ đĩa: {' '.join(cmd)}")
-        result = run_ffmpeg_command(cmd, capture_output=True)
-        
-        if result.returncode == 0 and os.path.exists(final_output_path):
+        if ok:
             print(f"Subtitle đã được trích xuất thành công: {final_output_path}")
-            
-            # Ghi vào log
-            log_processed_file(
-                log_file,
-                os.path.basename(file_path),
-                sub_filename,
-                signature=file_signature,
-                metadata={
-                    "category": "subtitle",
-                    "language": language,
-                    "output_path": os.path.abspath(final_output_path),
-                    "local_path": os.path.abspath(final_output_path),
-                },
-            )
+            log_subtitle_output(log_file, file_path, final_output_path, language, media_info)
             return final_output_path
         else:
             print("Lỗi khi trích xuất subtitle trực tiếp")
-            if result.stderr:
+            if result is not None and result.stderr:
                 stderr_text = result.stderr.decode('utf-8', errors='replace')
                 print(f"Lỗi: {stderr_text}")
             
-            # Thử phương pháp khác nếu cách trên thất bại
+            # Thử phương pháp khác nếu cách trên thất bại: để muxer srt tự chọn encoder
             print("Thử phương pháp thay thế để trích xuất subtitle...")
-            with tempfile.TemporaryDirectory() as temp_dir:
-                temp_output_path = os.path.join(temp_dir, sub_filename)
-                
-                alt_cmd = [
-                    'ffmpeg',
-                    '-i', file_path,
-                    '-map', f'0:{index}',
-                    '-f', 'srt',
-                    '-y',
-                    temp_output_path
-                ]
-                
-                print(f"Đang chạy lệnh thay thế: {' '.join(alt_cmd)}")
-                alt_result = run_ffmpeg_command(alt_cmd, capture_output=True)
-                
-                if alt_result.returncode == 0 and os.path.exists(temp_output_path):
-                    print(f"Subtitle được trích xuất tạm thời: {temp_output_path}")
-                    # Di chuyển tới đường dẫn cuối cùng
-                    shutil.move(temp_output_path, final_output_path)
-                    print(f"Subtitle đã được di chuyển tới: {final_output_path}")
-                    
-                    # Ghi vào log
-                    log_processed_file(
-                        log_file,
-                        os.path.basename(file_path),
-                        sub_filename,
-                        signature=file_signature,
-                        metadata={
-                            "category": "subtitle",
-                            "language": language,
-                            "output_path": os.path.abspath(final_output_path),
-                            "local_path": os.path.abspath(final_output_path),
-                        },
-                    )
-                    return final_output_path
-                else:
-                    print("Không thể trích xuất subtitle bằng cả hai phương pháp")
-                    if alt_result.stderr:
-                        stderr_text = alt_result.stderr.decode('utf-8', errors='replace')
-                        print(f"Lỗi: {stderr_text}")
-                    return None
+            alt_ok, alt_result = write_ffmpeg_output(
+                file_path, ['-map', f'0:{index}'], final_output_path, 'srt', 0,
+                media_info=media_info,
+            )
+            
+            if alt_ok:
+                print(f"Subtitle đã được trích xuất thành công: {final_output_path}")
+                log_subtitle_output(log_file, file_path, final_output_path, language, media_info)
+                return final_output_path
+            else:
+                print("Không thể trích xuất subtitle bằng cả hai phương pháp")
+                if alt_result is not None and alt_result.stderr:
+                    stderr_text = alt_result.stderr.decode('utf-8', errors='replace')
+                    print(f"Lỗi: {stderr_text}")
+                return None
+    except JobStalledError:
+        raise
     except Exception as e:
         print(f"Lỗi khi trích xuất subtitle: {e}")
         return None
 
-def get_subtitle_info(file_path):
+def extract_subtitles_native(file_path, subtitle_infos, log_file, media_info: MediaInfo):
+    """Trích các subtitle text trong một lượt duyệt Cluster, không gọi ffmpeg.
+
+    Trả về các subtitle chưa trích được (codec/nén không hỗ trợ, file đã tồn tại...)
+    để người gọi xử lý bằng extract_subtitle.
+    """
+    targets = {}
+    for subtitle_info in subtitle_infos:
+        index, language, _title, codec = subtitle_info
+        if codec.lower() not in TEXT_SUBTITLE_CODECS:
+            continue
+        sub_path = subtitle_output_path(file_path, language)
+        if os.path.exists(sub_path) or any(sub_path == path for _info, path in targets.values()):
+            continue  # extract_subtitle sẽ báo và ghi log "đã tồn tại" như cũ
+        targets[index] = (subtitle_info, sub_path)
+    if not targets:
+        return list(subtitle_infos)
+
+    create_folder(SUBTITLE_FOLDER)
+    stats = ExtractStats()
+    try:
+        results = extract_text_subtitles(file_path, list(targets), stats)
+    except (MatroskaParseError, OSError) as native_err:
+        print(f"Không trích được subtitle bằng parser native: {native_err}. Dùng ffmpeg...")
+        return list(subtitle_infos)
+    print(
+        f"[SUBTITLE] Trích {len(results)} subtitle native: đọc {stats.bytes_read / 1024:.0f} KB, "
+        f"bỏ qua {stats.bytes_skipped / (1024 ** 2):.1f} MB payload audio/video"
+    )
+
+    done = set()
+    for index, events in results.items():
+        subtitle_info, sub_path = targets[index]
+        part = part_path(sub_path)
+        try:
+            write_srt(events, part)
+            STAGING_STATS.add_direct(commit_part(part, sub_path))
+        except OSError as write_err:
+            discard(part)
+            print(f"Lỗi khi ghi subtitle {sub_path}: {write_err}")
+            continue
+        print(f"Subtitle đã được trích xuất thành công: {sub_path} ({len(events)} dòng)")
+        log_subtitle_output(log_file, file_path, sub_path, subtitle_info[1], media_info)
+        done.add(index)
+    return [subtitle_info for subtitle_info in subtitle_infos if subtitle_info[0] not in done]
+
+def extract_subtitles(file_path, subtitle_infos, log_file, media_info: MediaInfo):
+    """Trích nhiều subtitle: parser native một lượt trước, phần còn lại dùng ffmpeg từng track."""
+    pending = list(subtitle_infos)
+    if NATIVE_SUBTITLES and pending:
+        pending = extract_subtitles_native(file_path, pending, log_file, media_info)
+    for subtitle_info in pending:
+        extract_subtitle(file_path, subtitle_info, log_file, media_info)
+
+@dataclass
+class SinglePassResult:
+    """Kết quả từng output của một lần chạy ffmpeg nhiều output."""
+    source_name: str
+    video_path: Optional[str]
+    subtitles: List[tuple]  # (subtitle_info, đường dẫn .srt hoặc None nếu thất bại)
+
+    @property
+    def failed_subtitles(self):
+        return [info for info, path in self.subtitles if not path]
+
+def run_single_pass(file_path, output_folder, selected_track, subtitle_infos, log_file, media_info: MediaInfo):
+    """Remux video + audio đã chọn và trích mọi subtitle trong một lệnh ffmpeg.
+
+    File nguồn chỉ được đọc một lần. Subtitle thành công và subtitle đã có sẵn
+    chỉ được ghi log khi lệnh chạy xong; việc đổi tên file gốc để cho người gọi
+    (sau khi trích lại các subtitle lỗi).
+    Các output được ghi thẳng ra `.part` cạnh đích rồi đổi tên khi xong.
+    Trả về None nếu không chạy được, người gọi sẽ dùng cách xử lý từng bước.
+    """
+    names = build_video_output_names(file_path, media_info, selected_track)
+    if not names:
+        return None
+    source_name, output_name = names
+    final_output_path = os.path.join(output_folder, sanitize_filename(output_name))
+    if os.path.exists(final_output_path):
+        return None  # Để process_video báo và bỏ qua như cũ
+    if not has_enough_disk_space(output_folder):
+        return None
+
+    create_folder(SUBTITLE_FOLDER)
+    subtitles = []
+    subtitle_outputs = []
+    for subtitle_info in subtitle_infos:
+        index, language, _title, codec = subtitle_info
+        if codec.lower() not in TEXT_SUBTITLE_CODECS:
+            print(f"Bỏ qua subtitle: định dạng {codec} không được hỗ trợ (chỉ hỗ trợ text-based)")
+            continue
+        sub_path = subtitle_output_path(file_path, language)
+        if os.path.exists(sub_path):
+            subtitles.append((subtitle_info, sub_path))  # Chỉ ghi log khi lượt chạy thành công
+            continue
+        if sub_path in (path for _info, path in subtitle_outputs):
+            continue  # Trùng tên với track trước (cùng ngôn ngữ), giống cách cũ: track đầu thắng
+        subtitle_outputs.append((subtitle_info, sub_path))
+
+    cmd = [
+        'ffmpeg',
+        '-i', file_path,
+        '-map', '0:v',
+        '-map', f'0:{selected_track[0]}',
+        '-c', 'copy',
+        '-f', 'matroska',
+        '-y',
+        part_path(final_output_path),
+    ]
+    for subtitle_info, sub_path in subtitle_outputs:
+        cmd += ['-map', f'0:{subtitle_info[0]}', '-c:s', 'srt', '-f', 'srt', '-y', part_path(sub_path)]
+
+    outputs = [final_output_path] + [path for _info, path in subtitle_outputs]
+    print(f"Đang chạy lệnh một lượt ({len(outputs)} output): {' '.join(cmd)}")
+    try:
+        result = run_ffmpeg_command(
+            cmd,
+            label=os.path.basename(final_output_path),
+            media_info=media_info,
+            outputs=[part_path(path) for path in outputs],
+        )
+    except JobStalledError:
+        for path in outputs:
+            discard(part_path(path))
+        raise
+    except Exception as e:
+        print(f"Lỗi khi chạy ffmpeg một lượt: {e}")
+        result = None
+
+    if result is None or result.returncode != 0:
+        # ffmpeg dừng cả lệnh khi một output lỗi -> xóa các .part dở dang, quay về cách cũ
+        print("Xử lý một lượt thất bại. Chuyển sang xử lý từng bước...")
+        if result is not None and result.stderr:
+            print(f"Lỗi: {result.stderr.decode('utf-8', errors='replace')}")
+        for path in outputs:
+            discard(part_path(path))
+        return None
+
+    # Subtitle đã có sẵn chỉ ghi log ở đây; khi thất bại, extract_subtitle ở bước dự phòng tự ghi
+    for subtitle_info, sub_path in subtitles:
+        print(f"Subtitle đã tồn tại: {sub_path}. Bỏ qua.")
+        log_subtitle_output(log_file, file_path, sub_path, subtitle_info[1], media_info)
+
+    video_path = None
+    if os.path.exists(part_path(final_output_path)):
+        STAGING_STATS.add_direct(commit_part(part_path(final_output_path), final_output_path))
+        video_path = final_output_path
+        print(f"Video đã được lưu thành công tới: {video_path}")
+    else:
+        print(f"Không tìm thấy output video: {final_output_path}")
+    for subtitle_info, sub_path in subtitle_outputs:
+        if os.path.exists(part_path(sub_path)):
+            STAGING_STATS.add_direct(commit_part(part_path(sub_path), sub_path))
+            print(f"Subtitle đã được trích xuất thành công: {sub_path}")
+            log_subtitle_output(log_file, file_path, sub_path, subtitle_info[1], media_info)
+            subtitles.append((subtitle_info, sub_path))
+        else:
+            print(f"Không tìm thấy output subtitle: {sub_path}")
+            subtitles.append((subtitle_info, None))
+    return SinglePassResult(source_name=source_name, video_path=video_path, subtitles=subtitles)
+
+def get_subtitle_info(file_path, media_info=None):
     """Lấy thông tin về các track subtitle trong file video."""
     try:
-        probe = ffmpeg.probe(file_path)
+        if media_info is None:
+            media_info = load_media_info(file_path)
         subtitle_tracks = []
-        for stream in probe['streams']:
+        for stream in media_info.streams:
             if stream['codec_type'] == 'subtitle':
                 index = stream.get('index', -1)
                 language = stream.get('tags', {}).get('language', 'und')
@@ -1051,13 +1425,12 @@ def get_subtitle_info(file_path):
         print(f"Lỗi khi lấy thông tin subtitle từ {file_path}: {e}")
         return []
 
-def get_file_signature(file_path):
-    """Lấy chữ ký của file (size và duration) để nhận diện file trùng."""
+def get_file_signature(file_path, media_info=None):
+    """Lấy dấu vân tay nội dung của file để nhận diện file trùng (không cần probe)."""
     try:
-        file_size = os.path.getsize(file_path)
-        probe = ffmpeg.probe(file_path)
-        duration = probe.get('format', {}).get('duration', '0')
-        return f"{file_size}_{duration}"
+        if media_info is None:
+            return file_fingerprint(file_path)
+        return media_info.signature
     except Exception as e:
         print(f"Error getting file signature: {e}")
         return None
@@ -1070,9 +1443,8 @@ def check_ffmpeg_available():
     except ImportError:
         # Fallback nếu không có helper
         try:
-            subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
-            return True
-        except (subprocess.CalledProcessError, FileNotFoundError):
+            return run_process(['ffmpeg', '-version'], timeout=TOOL_TIMEOUT).returncode == 0
+        except FileNotFoundError:
             return False
 
 def check_available_ram():
@@ -1097,121 +1469,6 @@ def get_file_size_gb(file_path):
         print(f"Lỗi khi lấy kích thước file: {e}")
         return 0
 
-@contextmanager
-def temp_directory_in_memory(use_ram=True, file_size_gb=None):
-    """Tạo thư mục tạm trong RAM hoặc trên đĩa tùy thuộc vào tham số use_ram.
-    
-    Args:
-        use_ram (bool): Có sử dụng RAM không
-        file_size_gb (float, optional): Kích thước file đang xử lý theo GB, dùng để tính toán không gian cần thiết
-    """
-    if not use_ram:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            print(f"Tạo thư mục tạm trên ổ đĩa: {temp_dir}")
-            yield temp_dir
-        return
-    
-    # Tính toán không gian tối thiểu cần thiết dựa trên kích thước file nếu có
-    # Đối với subtitle, chỉ cần một phần nhỏ dung lượng, còn video cần nhiều hơn
-    if file_size_gb:
-        # Đối với file nhỏ, yêu cầu ít nhất 400MB
-        required_space_gb = max(0.4, file_size_gb * 0.5)
-        print(f"Cần ít nhất {required_space_gb:.2f} GB cho file {file_size_gb:.2f} GB")
-    else:
-        # Mặc định yêu cầu 1GB nếu không biết kích thước file
-        required_space_gb = 1.0
-    
-    # Tạo danh sách các vị trí RAM có thể sử dụng
-    ram_locations = []
-    
-    # 1. Ubuntu/Linux: Các vị trí RAM disk tiềm năng
-    if os.name == 'posix':
-        # /dev/shm - thường là RAM disk trên hầu hết các hệ thống Linux
-        if os.path.exists('/dev/shm') and os.access('/dev/shm', os.W_OK):
-            ram_locations.append(('/dev/shm', 'RAM disk'))
-        
-        # /run/user/<uid> - thư mục người dùng trên systemd, thường nằm trong RAM
-        uid = os.getuid() if hasattr(os, 'getuid') else None
-        if uid is not None:
-            user_runtime_dir = f"/run/user/{uid}"
-            if os.path.exists(user_runtime_dir) and os.access(user_runtime_dir, os.W_OK):
-                ram_locations.append((user_runtime_dir, 'Runtime user directory'))
-        
-        # /run - thư mục runtime cho các tiến trình của hệ thống 
-        if os.path.exists('/run') and os.access('/run', os.W_OK):
-            ram_locations.append(('/run', 'Runtime directory'))
-        
-        # /tmp - có thể được cấu hình là tmpfs trên RAM trên một số hệ thống
-        if os.path.exists('/tmp') and os.access('/tmp', os.W_OK):
-            ram_locations.append(('/tmp', 'Temporary directory'))
-    
-    # 2. macOS: Thử /private/tmp (có thể được lưu trữ trong RAM trên một số cấu hình)
-    if platform.system() == 'Darwin':
-        if os.path.exists('/private/tmp') and os.access('/private/tmp', os.W_OK):
-            ram_locations.append(('/private/tmp', 'macOS temporary directory'))
-    
-    # Kiểm tra từng vị trí và tìm nơi có không gian trống nhiều nhất
-    best_location = None
-    best_location_desc = None
-    max_free_space = 0
-    
-    print(f"Tìm kiếm vị trí lưu trữ tạm (yêu cầu ít nhất {required_space_gb:.2f} GB)...")
-    for location, desc in ram_locations:
-        try:
-            usage = shutil.disk_usage(location)
-            free_space_gb = usage.free / (1024**3)
-            print(f"- {desc} ({location}): {free_space_gb:.2f} GB trống")
-            
-            # Lưu lại vị trí có không gian trống lớn nhất
-            if free_space_gb > max_free_space:
-                max_free_space = free_space_gb
-                best_location = location
-                best_location_desc = desc
-        except Exception as e:
-            print(f"- {desc} ({location}): Không thể kiểm tra ({e})")
-    
-    # Tạo thư mục tạm trong vị trí tốt nhất nếu có đủ không gian
-    if best_location and max_free_space >= required_space_gb:
-        try:
-            temp_dir = tempfile.mkdtemp(dir=best_location)
-            print(f"Sử dụng {best_location_desc} ({max_free_space:.2f} GB trống) cho xử lý RAM: {temp_dir}")
-            try:
-                yield temp_dir
-            finally:
-                if os.path.exists(temp_dir):
-                    shutil.rmtree(temp_dir)
-                    print(f"Đã xóa thư mục tạm: {temp_dir}")
-            return
-        except Exception as e:
-            print(f"Lỗi khi tạo thư mục tạm trong {best_location}: {e}")
-    
-    # Nếu không có RAM disk nào hoặc không đủ không gian, sử dụng ổ đĩa thay thế
-    try:
-        # Cố gắng tạo thư mục tạm ưu tiên trong /tmp nếu có
-        if os.path.exists('/tmp') and os.access('/tmp', os.W_OK):
-            temp_dir = tempfile.mkdtemp(dir='/tmp')
-        else:
-            temp_dir = tempfile.mkdtemp()
-        
-        if best_location:
-            print(f"THÔNG BÁO: Không đủ không gian trong {best_location_desc} ({max_free_space:.2f} GB < {required_space_gb:.2f} GB)")
-            print(f"Sử dụng ổ đĩa thay thế: {temp_dir}")
-        else:
-            print(f"THÔNG BÁO: Không tìm thấy RAM disk phù hợp. Sử dụng ổ đĩa thay thế: {temp_dir}")
-        
-        try:
-            yield temp_dir
-        finally:
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
-                print(f"Đã xóa thư mục tạm: {temp_dir}")
-    except Exception as e:
-        print(f"Lỗi khi xử lý thư mục tạm: {e}")
-        # Fallback cuối cùng: sử dụng tempfile thông thường
-        with tempfile.TemporaryDirectory() as temp_dir:
-            print(f"Fallback: Sử dụng thư mục tạm trên ổ đĩa: {temp_dir}")
-            yield temp_dir
-
 def ensure_git_available() -> Optional[str]:
     """Đảm bảo có git, tải MinGit nếu cần."""
     global GIT_CACHED_PATH
@@ -1224,9 +1481,9 @@ def ensure_git_available() -> Optional[str]:
 
     if git_cmd:
         try:
-            subprocess.run([git_cmd, "--version"], capture_output=True, check=True)
-            GIT_CACHED_PATH = git_cmd
-            return git_cmd
+            if run_process([git_cmd, "--version"], timeout=TOOL_TIMEOUT).returncode == 0:
+                GIT_CACHED_PATH = git_cmd
+                return git_cmd
         except Exception:
             pass
     print("Warning: Git không khả dụng. Bỏ qua auto-commit.")
@@ -1254,8 +1511,7 @@ def auto_commit_subtitles(subtitle_folder):
     
     try:
         # Kiểm tra xem có trong git repository không
-        result = subprocess.run([git_cmd, 'rev-parse', '--git-dir'],
-                              capture_output=True, cwd='.')
+        result = run_process([git_cmd, 'rev-parse', '--git-dir'], cwd='.', timeout=TOOL_TIMEOUT)
         if result.returncode != 0:
             print("Không phải git repository. Bỏ qua auto-commit.")
             return False
@@ -1295,15 +1551,13 @@ def auto_commit_subtitles(subtitle_folder):
         
         # Add files to git
         for file_path in files_to_commit:
-            add_result = subprocess.run([git_cmd, 'add', file_path],
-                                       capture_output=True, cwd='.')
+            add_result = run_process([git_cmd, 'add', file_path], cwd='.', timeout=TOOL_TIMEOUT)
             if add_result.returncode != 0:
                 print(f"Lỗi khi add file {file_path}: {add_result.stderr.decode()}")
                 return False
         
         # Check if there are changes to commit
-        status_result = subprocess.run([git_cmd, 'status', '--porcelain'],
-                                     capture_output=True, cwd='.')
+        status_result = run_process([git_cmd, 'status', '--porcelain'], cwd='.', timeout=TOOL_TIMEOUT)
         if not status_result.stdout.strip():
             print("Không có thay đổi mới để commit.")
             return True
@@ -1312,16 +1566,14 @@ def auto_commit_subtitles(subtitle_folder):
         current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         commit_message = f"Auto-commit subtitles: {len(files_to_commit)} files - {current_time}"
         
-        commit_result = subprocess.run([git_cmd, 'commit', '-m', commit_message],
-                                     capture_output=True, cwd='.')
+        commit_result = run_process([git_cmd, 'commit', '-m', commit_message], cwd='.', timeout=TOOL_TIMEOUT)
         
         if commit_result.returncode == 0:
             print(f"✅ Đã commit thành công: {commit_message}")
             
             # Thử push nếu có remote
             try:
-                push_result = subprocess.run([git_cmd, 'push'],
-                                           capture_output=True, cwd='.')
+                push_result = run_process([git_cmd, 'push'], cwd='.', timeout=GIT_PUSH_TIMEOUT)
                 if push_result.returncode == 0:
                     print("✅ Đã push lên remote repository thành công.")
                 else:
@@ -1338,17 +1590,584 @@ def auto_commit_subtitles(subtitle_folder):
         print(f"Lỗi trong quá trình auto-commit: {e}")
         return False
 
-def main(input_folder=None):
+def find_skip_reason(file_name, file_signatures, history: HistoryStore) -> Optional[str]:
+    """Trả về lý do bỏ qua nếu file đã được xử lý (theo tên hoặc một trong các signature)."""
+    if not file_signatures:
+        info = history.lookup_name(file_name)
+        if info:
+            return f"File {file_name} đã được xử lý thành {info['new_name']} vào {info['timestamp']}. Bỏ qua."
+        return None
+    info = history.lookup_signature(file_signatures)
+    if info:
+        return f"File {file_name} có cùng nội dung với file đã xử lý {info['new_name']}. Bỏ qua."
+    return None
+
+
+def migrate_processed_signatures(history: HistoryStore) -> int:
+    """Đổi các chữ ký cũ `size_duration` trong lịch sử sang dấu vân tay đã biết.
+
+    Nhờ vậy file đã xử lý theo log cũ được bỏ qua chỉ bằng dấu vân tay, không cần probe.
+    """
+    if not FINGERPRINTS:
+        return 0
+    try:
+        mapping = FINGERPRINTS.migration_map(history.legacy_signatures())
+        return history.migrate_signatures(mapping)
+    except Exception as exc:
+        print(f"[CACHE] Không thể chuyển chữ ký cũ: {exc}")
+        return 0
+
+
+SKIP_TIERS = ("name", "stat", "fingerprint", "probe")
+SKIP_TIER_LABELS = {"name": "tên", "stat": "stat", "fingerprint": "dấu vân tay", "probe": "probe"}
+
+
+class SkipStats:
+    """Đếm số file bị bỏ qua ở từng tầng kiểm tra (tên -> stat -> dấu vân tay -> probe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {tier: 0 for tier in SKIP_TIERS}
+        self.new_files = 0
+
+    def record(self, tier: Optional[str]) -> None:
+        with self._lock:
+            if tier is None:
+                self.new_files += 1
+            else:
+                self.counts[tier] += 1
+
+    def summary(self) -> str:
+        tiers = ", ".join(f"{SKIP_TIER_LABELS[tier]} {self.counts[tier]}" for tier in SKIP_TIERS)
+        return f"bỏ qua theo {tiers} | cần xử lý {self.new_files}"
+
+
+SKIP_STATS = SkipStats()
+
+
+@dataclass
+class FileJob:
+    """Kết quả probe + phân loại một file, được chuẩn bị trước bởi worker prefetch."""
+
+    file_path: str
+    media_info: Optional[MediaInfo] = None
+    probe_error: Optional[Exception] = None
+    skip_reason: Optional[str] = None
+    skip_tier: Optional[str] = None  # Tầng kiểm tra đã nhận ra file đã xử lý
+    plan: Optional[FilePlan] = None  # Kế hoạch đã lưu (khi chạy lại một plan JSON)
+
+    @property
+    def file_name(self) -> str:
+        return os.path.basename(self.file_path)
+
+
+def classify_file(file_path, history: HistoryStore) -> FileJob:
+    """Phân loại file theo các tầng từ rẻ tới đắt, chỉ probe khi các tầng trước không nhận ra.
+
+    1. tên file có trong log
+    2. bộ (inode, size, mtime) đã có dấu vân tay trong cache - không đọc file
+    3. dấu vân tay tính mới - chỉ đọc vài khối mẫu
+    4. probe đầy đủ - khớp cả chữ ký cũ size_duration
+    Chạy được trong thread nền, không in log.
+    """
+    job = FileJob(file_path=file_path)
+    job.skip_reason = find_skip_reason(job.file_name, (), history)
+    if job.skip_reason:
+        job.skip_tier = "name"
+    else:
+        classify_by_content(job, history)
+    SKIP_STATS.record(job.skip_tier)
+    return job
+
+
+def classify_by_content(job: FileJob, history: HistoryStore) -> None:
+    fingerprint = None
+    try:
+        st = os.stat(job.file_path)
+        if FINGERPRINTS:
+            fingerprint = FINGERPRINTS.lookup(job.file_path, st)
+            job.skip_reason = find_skip_reason(job.file_name, (fingerprint,), history)
+            if job.skip_reason:
+                job.skip_tier = "stat"
+                return
+        if fingerprint is None:
+            fingerprint = file_fingerprint(job.file_path, st)
+            job.skip_reason = find_skip_reason(job.file_name, (fingerprint,), history)
+            if job.skip_reason:
+                job.skip_tier = "fingerprint"
+                return
+    except OSError:
+        pass  # Để probe báo lỗi đọc file như trước
+    try:
+        job.media_info = load_media_info(job.file_path)
+    except Exception as e:
+        job.probe_error = e
+        return
+    job.skip_reason = find_skip_reason(job.file_name, (job.media_info.legacy_signature,), history)
+    if job.skip_reason:
+        job.skip_tier = "probe"
+
+
+def record_stalled_job(file_path, stall: JobStalledError, media_info: Optional[MediaInfo] = None):
+    """Ghi job bị watchdog dừng vào run log.
+
+    Không ghi vào log file đã xử lý để lần chạy sau file được xử lý lại.
+    """
+    print(f"[WATCHDOG] Bỏ qua {file_path}: {stall.detail}. File sẽ được xử lý lại ở lần chạy sau.")
+    entry = {
+        "old_name": os.path.basename(file_path),
+        "new_name": None,
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "signature": media_info.signature if media_info else "",
+        "category": "stalled",
+        "output_path": None,
+        "language": None,
+        "notes": f"{stall.reason}: {stall.detail}",
+    }
+    with LOG_LOCK:
+        RUN_LOG_ENTRIES.append(entry)
+        RETRY_FILES.add(os.path.abspath(file_path))
+    if LOG_WRITER:
+        LOG_WRITER.write(entry, sync_remote=False)
+
+def process_mkv_job(file_path, media_info, log_file, vn_folder, original_folder, probe_error=None, plan=None):
+    """process_mkv_file, nhưng job bị watchdog dừng chỉ được ghi nhận rồi chuyển sang file khác."""
+    try:
+        return process_mkv_file(file_path, media_info, log_file, vn_folder, original_folder, probe_error, plan)
+    except JobStalledError as stall:
+        record_stalled_job(file_path, stall, media_info)
+        return False
+
+def process_mkv_file(file_path, media_info, log_file, vn_folder, original_folder, probe_error=None, plan=None):
+    """Xử lý một file MKV đã probe: lập kế hoạch (hoặc dùng `plan` đã lưu) rồi thực hiện."""
+    # In thông tin streams đã probe
+    try:
+        if media_info is None:
+            raise probe_error or RuntimeError("Không có thông tin probe")
+        audio_streams = media_info.audio_streams
+        subtitle_streams = media_info.subtitle_streams
+        
+        # In thông tin streams để người dùng biết
+        print("\nThông tin streams:")
+        print("- Video streams:")
+        for i, stream in enumerate(media_info.video_streams):
+            width = stream.get('width', 'N/A')
+            height = stream.get('height', 'N/A')
+            codec = stream.get('codec_name', 'N/A')
+            print(f"  Stream #{i}: {codec}, {width}x{height}")
+        
+        print("- Audio streams:")
+        for i, stream in enumerate(audio_streams):
+            lang = stream.get('tags', {}).get('language', 'und')
+            title = stream.get('tags', {}).get('title', '')
+            channels = stream.get('channels', 'N/A')
+            codec = stream.get('codec_name', 'N/A')
+            lang_display = f"{get_language_abbreviation(lang)}"
+            if title:
+                lang_display += f" - {title}"
+            print(f"  Stream #{stream.get('index', i)}: {codec}, {channels} channels, {lang_display}")
+        
+        print("- Subtitle streams:")
+        for i, stream in enumerate(subtitle_streams):
+            lang = stream.get('tags', {}).get('language', 'und')
+            title = stream.get('tags', {}).get('title', '')
+            codec = stream.get('codec_name', 'N/A')
+            lang_display = f"{get_language_abbreviation(lang)}"
+            if title:
+                lang_display += f" - {title}"
+            print(f"  Stream #{stream.get('index', i)}: {codec}, {lang_display}")
+        
+    except Exception as e:
+        print(f"Lỗi khi đọc thông tin file {file_path}: {e}")
+        # Không đọc được thông tin file: kế hoạch probe_error sẽ thử rename đơn giản
+        media_info, probe_error = None, e
+
+    if plan is None:
+        job = FileJob(file_path=file_path, media_info=media_info, probe_error=probe_error)
+        plan = plan_file(job, vn_folder, original_folder)
+    return execute_file_plan(plan, media_info, log_file)
+
+def estimate_stream_bytes(stream, media_info: MediaInfo) -> Optional[int]:
+    """Kích thước một stream: tag NUMBER_OF_BYTES (mkvmerge) hoặc bitrate x thời lượng."""
+    tags = stream.get('tags', {}) or {}
+    bit_rate = stream.get('bit_rate')
+    for key, value in tags.items():
+        name = key.upper().split('-')[0]
+        if name == 'NUMBER_OF_BYTES':
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                pass
+        elif name == 'BPS' and not bit_rate:
+            bit_rate = value
+    try:
+        return int(int(bit_rate) * float(media_info.duration) / 8) if bit_rate else None
+    except (TypeError, ValueError):
+        return None
+
+def plan_file(job: FileJob, vn_folder, original_folder) -> FilePlan:
+    """Quyết định cách xử lý một file đã probe (chỉ stat, không ghi gì).
+
+    Dùng chung cho lượt chạy thật (process_mkv_file) và dry-run (plan_library),
+    nên kế hoạch luôn khớp với những gì sẽ thực sự chạy.
+    """
+    try:
+        st = os.stat(job.file_path)
+        size, mtime_ns = st.st_size, st.st_mtime_ns
+    except OSError:
+        size, mtime_ns = 0, 0
+    media_info = job.media_info
+    plan = FilePlan(
+        source_path=os.path.abspath(job.file_path),
+        size=size,
+        mtime_ns=mtime_ns,
+        action=ACTION_SKIP,
+        signature=media_info.signature if media_info else None,
+    )
+    if job.skip_reason:
+        plan.reason = job.skip_reason
+        return plan
+    if media_info is None:
+        plan.action = ACTION_PROBE_ERROR
+        plan.reason = str(job.probe_error or "Không có thông tin probe")
+        return plan
+
+    audio_streams = media_info.audio_streams
+    has_vie_audio = any(stream.get('tags', {}).get('language', 'und') == 'vie' for stream in audio_streams)
+    selection = select_audio_track(media_info, vn_folder, original_folder) if has_vie_audio else None
+    output_exists = False
+    if not has_vie_audio:
+        plan.action = ACTION_RENAME
+        plan.source_new_name = simple_rename_name(job.file_path, media_info)
+    elif selection is None:
+        plan.action = ACTION_KEEP
+    else:
+        output_folder, selected_track = selection
+        source_name, output_name = build_video_output_names(job.file_path, media_info, selected_track)
+        plan.action = ACTION_INPLACE if OUTPUT_MODE == "inplace" else ACTION_REMUX
+        plan.output_folder = output_folder
+        plan.audio_track = list(selected_track)
+        plan.source_new_name = sanitize_filename(source_name)
+        plan.output_path = os.path.abspath(os.path.join(output_folder, sanitize_filename(output_name)))
+        output_exists = os.path.exists(plan.output_path)
+        if output_exists:
+            plan.reason = "File đích đã tồn tại"
+        elif plan.action == ACTION_REMUX:
+            kept = [stream for stream in media_info.video_streams]
+            kept += [stream for stream in audio_streams if stream.get('index') == selected_track[0]]
+            sizes = [estimate_stream_bytes(stream, media_info) for stream in kept]
+            plan.bytes_read += size
+            plan.add_write(output_folder, sum(sizes) if sizes and None not in sizes else size)
+        # inplace: chỉ ghi lại vài KB header, file được rename sang thư mục output
+
+    vie_subtitles = [
+        stream for stream in media_info.subtitle_streams
+        if stream.get('tags', {}).get('language', 'und') == 'vie'
+    ]
+    plan.single_pass = SINGLE_PASS and plan.action == ACTION_REMUX and bool(vie_subtitles) and not output_exists
+    planned_paths = set()
+    for stream in vie_subtitles:
+        codec = stream.get('codec_name', '')
+        subtitle = SubtitlePlan(
+            index=stream['index'],
+            language='vie',
+            title=stream.get('tags', {}).get('title', ''),
+            codec=codec,
+            output_path=None,
+            method="unsupported",
+        )
+        plan.subtitles.append(subtitle)
+        if codec.lower() not in TEXT_SUBTITLE_CODECS:
+            continue
+        sub_path = subtitle_output_path(job.file_path, 'vie')
+        subtitle.output_path = os.path.abspath(sub_path)
+        if os.path.exists(sub_path) or sub_path in planned_paths:
+            subtitle.method = "exists"
+            continue
+        planned_paths.add(sub_path)
+        if plan.single_pass:
+            subtitle.method = "single_pass"
+        elif NATIVE_SUBTITLES:
+            subtitle.method = "native"
+        else:
+            subtitle.method = "ffmpeg"
+            plan.bytes_read += size  # ffmpeg đọc cả file cho mỗi subtitle
+        subtitle.bytes_written = estimate_stream_bytes(stream, media_info) or 0
+        plan.add_write(SUBTITLE_FOLDER, subtitle.bytes_written)
+    return plan
+
+def execute_file_plan(plan: FilePlan, media_info: Optional[MediaInfo], log_file):
+    """Thực hiện kế hoạch của một file: trích subtitle, tách audio hoặc đổi tên.
+
+    Trả về False nếu file chưa được ghi log (lỗi ffmpeg, đổi tên thất bại...): file được
+    xử lý lại ở lần chạy sau thay vì bị scan journal coi là đã biết. File giữ nguyên
+    (ACTION_KEEP) không có log nhưng vẫn trả về True.
+    """
+    file_path = plan.source_path
+    if plan.action == ACTION_SKIP:
+        print(plan.reason)
+        return True
+
+    if plan.action == ACTION_PROBE_ERROR:
+        # Nếu không thể đọc thông tin file, vẫn thử rename đơn giản
+        try:
+            new_path = rename_simple(file_path)
+            log_processed_file(
+                log_file,
+                os.path.basename(file_path),
+                os.path.basename(new_path),
+                metadata={
+                    "category": "video",
+                    "source_path": file_path,
+                    "output_path": os.path.abspath(new_path),
+                },
+            )
+        except Exception as rename_err:
+            print(f"Không thể đổi tên: {rename_err}")
+        return source_was_logged(file_path)
+
+    processed = False  # Flag để đánh dấu file đã được xử lý
+    subtitle_infos = [subtitle.info for subtitle in plan.subtitles]
+
+    # Chế độ một lượt: video + mọi subtitle tiếng Việt trong cùng một lệnh ffmpeg
+    single_pass = None
+    if plan.single_pass:
+        print(f"\nPhát hiện audio và {len(subtitle_infos)} subtitle tiếng Việt. Xử lý một lượt...")
+        single_pass = run_single_pass(
+            file_path, plan.output_folder, plan.selected_track, subtitle_infos, log_file, media_info
+        )
+
+    # Xử lý subtitle tiếng Việt (các subtitle chưa trích được ở chế độ một lượt)
+    pending_subtitles = single_pass.failed_subtitles if single_pass else subtitle_infos
+    if pending_subtitles:
+        print(f"\nPhát hiện {len(pending_subtitles)} subtitle tiếng Việt. Bắt đầu trích xuất...")
+        extract_subtitles(file_path, pending_subtitles, log_file, media_info)
+
+    if single_pass and single_pass.video_path:
+        try:
+            rename_source_after_output(file_path, single_pass.source_name, log_file, media_info)
+            processed = True
+        except Exception as e:
+            print(f"Lỗi khi đổi tên file gốc: {e}")
+            # Output đã tạo xong, không đổi tên lại theo kiểu đơn giản
+            return source_was_logged(file_path)
+
+    # Tách video với audio đã chọn
+    if plan.action in (ACTION_REMUX, ACTION_INPLACE) and not processed:
+        try:
+            print("\nPhát hiện audio tiếng Việt. Bắt đầu xử lý...")
+            selected_track = plan.selected_track
+            print(f"Chọn track audio index={selected_track[0]} với {selected_track[1]} kênh")
+            process_video(file_path, plan.output_folder, selected_track, log_file, media_info, plan.action)
+            processed = True  # Đánh dấu file đã được xử lý
+        except JobStalledError:
+            raise
+        except Exception as e:
+            print(f"Lỗi khi xử lý audio: {e}")
+    elif plan.action == ACTION_KEEP:
+        processed = True
+
+    # Nếu không có audio tiếng Việt HOẶC xử lý audio thất bại
+    if not processed:
+        print(f"\nKhông tìm thấy subtitle hoặc audio tiếng Việt hoặc xử lý thất bại. Chỉ đổi tên file...")
+        try:
+            new_path = rename_simple(file_path, media_info)
+            log_processed_file(
+                log_file,
+                os.path.basename(file_path),
+                os.path.basename(new_path),
+                media_info=media_info,
+                metadata={
+                    "category": "video",
+                    "source_path": file_path,
+                    "output_path": os.path.abspath(new_path),
+                },
+            )
+        except Exception as rename_err:
+            print(f"Không thể đổi tên: {rename_err}")
+    if plan.action == ACTION_KEEP:
+        return True  # Không có gì để tách/đổi tên nên không có log; file vẫn là đã xử lý xong
+    return source_was_logged(file_path)
+
+def apply_settings(settings):
+    """Đặt các biến cấu hình cấp module theo config người dùng."""
+    global PROBE_CACHE, NATIVE_PROBE, SINGLE_PASS, STAGING_MODE, STAGING_STATS, OUTPUT_MODE, NATIVE_SUBTITLES
+    global FFMPEG_PROGRESS, WATCHDOG, FINGERPRINTS, FINGERPRINT_SEGMENT_UID
+    PROBE_CACHE = open_probe_cache(settings)
+    FINGERPRINTS = open_fingerprint_cache(settings)
+    FINGERPRINT_SEGMENT_UID = bool(settings.get("fingerprint_segment_uid", True))
+    NATIVE_PROBE = bool(settings.get("native_probe", True))
+    SINGLE_PASS = bool(settings.get("single_pass", True))
+    STAGING_MODE = str(settings.get("staging", "auto")).lower()
+    OUTPUT_MODE = str(settings.get("output_mode", "remux")).lower()
+    NATIVE_SUBTITLES = bool(settings.get("native_subtitles", True))
+    FFMPEG_PROGRESS = bool(settings.get("ffmpeg_progress", True))
+    stall_timeout = float(settings.get("stall_timeout", 300))
+    budget_factor = float(settings.get("job_budget_factor", 4.0))
+    WATCHDOG = None
+    if stall_timeout > 0 or budget_factor > 0:
+        WATCHDOG = JobWatchdog(
+            stall_seconds=stall_timeout,
+            budget_factor=budget_factor,
+            min_budget=float(settings.get("job_budget_min", 900)),
+            assumed_mb_per_s=float(settings.get("job_budget_mb_per_s", 10)),
+        )
+    STAGING_STATS = StagingStats()
+
+def plan_settings():
+    """Các thiết lập ảnh hưởng tới quyết định trong kế hoạch, lưu kèm plan JSON."""
+    return {"output_mode": OUTPUT_MODE, "single_pass": SINGLE_PASS, "native_subtitles": NATIVE_SUBTITLES}
+
+def apply_plan_settings(saved):
+    global SINGLE_PASS, OUTPUT_MODE, NATIVE_SUBTITLES
+    OUTPUT_MODE = str(saved.get("output_mode", OUTPUT_MODE))
+    SINGLE_PASS = bool(saved.get("single_pass", SINGLE_PASS))
+    NATIVE_SUBTITLES = bool(saved.get("native_subtitles", NATIVE_SUBTITLES))
+
+def close_probe_cache():
+    global PROBE_CACHE, FINGERPRINTS
+    if PROBE_CACHE:
+        print(f"[CACHE] Probe cache: {PROBE_CACHE.summary()}")
+        try:
+            PROBE_CACHE.close()
+        except Exception:
+            pass
+        PROBE_CACHE = None
+    if FINGERPRINTS:
+        print(f"[CACHE] Dấu vân tay: {FINGERPRINTS.summary()}")
+        try:
+            FINGERPRINTS.close()
+        except Exception:
+            pass
+        FINGERPRINTS = None
+
+def load_planned_file(file_plan: FilePlan) -> FileJob:
+    """Chuẩn bị một file trong plan đã lưu: kiểm tra file nguồn chưa đổi, lấy probe từ cache."""
+    job = FileJob(file_path=file_plan.source_path, plan=file_plan)
+    if not file_plan.source_unchanged():
+        job.skip_reason = f"File {file_plan.file_name} đã thay đổi hoặc không còn kể từ lúc lập kế hoạch. Bỏ qua."
+        return job
+    if file_plan.action == ACTION_PROBE_ERROR:
+        return job
+    try:
+        job.media_info = load_media_info(file_plan.source_path)
+    except Exception as e:
+        job.probe_error = e
+        job.skip_reason = f"Không probe lại được {file_plan.file_name}: {e}. Bỏ qua."
+    return job
+
+def plan_library(input_folder=None, plan_path=None, jobs=None, scan_options=None):
+    """Dry-run: lập kế hoạch cho mọi file MKV trong thư mục và ghi ra JSON, không sửa file nào.
+
+    Trả về LibraryPlan (đã lưu tại `plan_path`, mặc định logs/plan_<thời gian>.json).
+    """
+    global SKIP_STATS
+    input_folder = os.path.abspath(input_folder or ".")
+    settings = load_user_config()
+    settings.update(scan_options or {})
+    apply_settings(settings)
+    SKIP_STATS = SkipStats()
+    logs_dir = Path(settings.get("logs_dir", "logs"))
+    vn_folder = "Lồng Tiếng - Thuyết Minh"
+    original_folder = "Original"
+    log_file = os.path.join(SUBTITLE_FOLDER, "processed_files.log")
+
+    original_cwd = os.getcwd()
+    os.chdir(input_folder)
+    history = history_snapshot(logs_dir)
+    try:
+        # Dry-run giữ nguyên processed_files.log; mọi thứ chỉ được nạp vào kho trong bộ nhớ
+        convert_legacy_log_file(Path(log_file), logs_dir, history, keep_log=True)
+        auto_config = build_auto_push_config(settings)
+        if auto_config:
+            # Chỉ đọc log trên GitHub để biết file nào đã xử lý, không ghi gì lên repo
+            remote_entries = RemoteSyncManager(auto_config, read_only=True).load_remote_logs()
+            history.append_many((e for e in remote_entries if e.get("category") == "video"), source="remote")
+        migrate_processed_signatures(history)
+
+        walker = build_library_walker(input_folder, settings)
+        library_plan = LibraryPlan(input_folder=input_folder, settings=plan_settings())
+        for job in prefetch(
+            iter_library_paths(input_folder, walker),
+            lambda path: classify_file(path, history),
+            workers=int(settings.get("prefetch_workers", 2)),
+            depth=int(settings.get("prefetch_depth", 4)),
+        ):
+            library_plan.files.append(plan_file(job, vn_folder, original_folder))
+
+        max_jobs = int(jobs if jobs is not None else settings.get("jobs", 1))
+        throughput = float(settings.get("plan_mb_per_s", 80)) * 1024 ** 2
+        library_plan.summarize(throughput, max_jobs)
+        if plan_path is None:
+            plan_path = logs_dir / f"plan_{datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.json"
+        saved = library_plan.save(str(plan_path))
+        if walker:
+            print(f"[SCAN] Đã duyệt {walker.summary()}")
+    finally:
+        history.close()
+        os.chdir(original_cwd)
+        close_probe_cache()
+
+    print("\n=== KẾ HOẠCH XỬ LÝ (DRY-RUN) ===")
+    for line in library_plan.describe():
+        print(line)
+    print(f"[SKIP] {SKIP_STATS.summary()}")
+    print(f"[PLAN] Đã lưu kế hoạch tại {saved}")
+    return library_plan
+
+def print_strategy(staging_mode):
+    """In chiến lược ghi output theo chế độ staging trong config."""
+    if staging_mode == "always":
+        lines = [
+            "Output được staging trong RAM nếu RAM trống > 1.2x kích thước file, rồi chuyển ra thư mục đích",
+            "Không đủ RAM hoặc staging thất bại: ghi thẳng ra file .part cạnh file đích",
+        ]
+    elif staging_mode == "never":
+        lines = ["Output được ghi thẳng ra file .part cạnh file đích rồi đổi tên khi xong (không staging trong RAM)"]
+    else:
+        lines = [
+            "Output được ghi thẳng ra file .part cạnh file đích rồi đổi tên khi xong",
+            "Chỉ staging trong RAM khi thư mục đích là ổ mạng và RAM trống > 1.2x kích thước file",
+            "Nếu staging thất bại, sẽ tự động ghi thẳng ra ổ đĩa",
+        ]
+    lines.append("Trích xuất subtitle trực tiếp vào thư mục đích")
+    print(f"\n=== CHIẾN LƯỢC XỬ LÝ ===")
+    for number, line in enumerate(lines, 1):
+        print(f"{number}. {line}")
+    print(f"======================\n")
+
+def main(input_folder=None, jobs=None, plan_path=None, full_scan=False, scan_options=None, only_files=None):
     """
     Hàm main xử lý video
     
     Args:
         input_folder: Thư mục chứa file MKV cần xử lý. 
                      Nếu None, sử dụng thư mục hiện tại.
+        jobs: Số file xử lý cùng lúc. Nếu None, lấy từ config ("jobs").
+        plan_path: Chạy lại kế hoạch JSON đã lưu bởi plan_library thay vì tự
+                   quyết định (thư mục lấy từ kế hoạch).
+        full_scan: Bỏ qua scan journal, liệt kê và kiểm tra lại mọi file.
+        scan_options: Ghi đè các khóa quét trong config ("recursive", "scan_include",
+                      "scan_exclude", "scan_max_depth"), vd. từ command line.
+        only_files: Chỉ xử lý các file này (vd. file mới từ watch_folders), không quét thư mục.
     """
     if not check_ffmpeg_available():
         return
     
+    plan = None
+    if plan_path:
+        try:
+            plan = LibraryPlan.load(plan_path)
+        except PlanError as exc:
+            print(f"[PLAN] {exc}")
+            return
+        input_folder = plan.input_folder
+        short = [d for d in plan.destinations if not d.enough_space]
+        for destination in short:
+            print(f"[PLAN] Không đủ dung lượng tại {destination.path}: cần {destination.bytes_needed / (1024 ** 3):.2f} GB")
+        if short:
+            return
+    
     # Sử dụng thư mục được chỉ định hoặc thư mục hiện tại
     if input_folder is None:
         input_folder = "."
@@ -1406,240 +2225,228 @@ def main(input_folder=None):
             print(f"RAM disk (/dev/shm): {shm_total_gb:.2f} GB, còn trống: {shm_free_gb:.2f} GB")
         except Exception as e:
             print(f"Không thể kiểm tra /dev/shm: {e}")
-    
-    # Cập nhật thông tin chiến lược xử lý
-    print(f"\n=== CHIẾN LƯỢC XỬ LÝ ===")
-    print(f"1. Ưu tiên xử lý trong RAM để tối ưu tốc độ")
-    print(f"2. Nếu có đủ RAM (200% kích thước file), sẽ xử lý trong RAM")
-    print(f"3. Nếu xử lý trong RAM thất bại, sẽ tự động chuyển sang xử lý trên ổ đĩa")
-    print(f"4. Trích xuất subtitle trực tiếp vào thư mục đích")
-    print(f"======================\n")
-
-    # Đọc danh sách file đã xử lý
-    processed_files, processed_signatures = read_processed_files(log_file)
 
     settings = load_user_config()
+    settings.update(scan_options or {})
+    print_strategy(str(settings.get("staging", "auto")).lower())
     logs_dir = Path(settings.get("logs_dir", "logs"))
 
-    # Khởi tạo đồng bộ GitHub nếu có cấu hình
-    global REMOTE_SYNC, RUN_LOG_ENTRIES
+    global REMOTE_SYNC, RUN_LOG_ENTRIES, SKIP_STATS, HISTORY, LOG_WRITER
     RUN_LOG_ENTRIES = []
-    remote_entries = []
+    RETRY_FILES.clear()
+    LOGGED_SOURCES.clear()
+    SKIP_STATS = SkipStats()
+    apply_settings(settings)
+    if plan is not None:
+        # Chạy đúng như lúc lập kế hoạch
+        apply_plan_settings(plan.settings)
+
+    # Khởi tạo đồng bộ GitHub nếu có cấu hình
+    remote_refresh = None
     auto_config = build_auto_push_config(settings)
     if auto_config:
         print("\n[AUTO PUSH] Đã bật đồng bộ subtitle lên GitHub.")
         REMOTE_SYNC = RemoteSyncManager(auto_config)
-        # Convert legacy log trên remote nếu còn
-        REMOTE_SYNC.convert_remote_legacy_log()
-        remote_entries = REMOTE_SYNC.load_remote_logs()
-        if remote_entries:
-            logs_dir.mkdir(parents=True, exist_ok=True)
-            snapshot_path = logs_dir / f"remote_sync_{datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.json"
-            snapshot_path.write_text(json.dumps(remote_entries, ensure_ascii=False, indent=2), encoding="utf-8")
-            print(f"[AUTO PUSH] Đã lưu log từ repo tại {snapshot_path}")
-        for entry in remote_entries:
-            if entry.get("category") != "video":
-                continue
-            info = {
-                "new_name": entry.get("new_name", ""),
-                "time": entry.get("timestamp", ""),
-                "signature": entry.get("signature", ""),
-            }
-            processed_files[entry.get("old_name", "")] = info
-            signature = entry.get("signature")
-            if signature:
-                processed_signatures[signature] = info
+        # Log remote (và chuyển đổi log cũ nếu còn) được tải ở thread nền trong lúc quét thư mục
+        remote_refresh = REMOTE_SYNC.refresh_async()
     else:
         REMOTE_SYNC = None
 
-    # Nếu local vẫn còn log cũ -> chuyển đổi
-    legacy_json = convert_legacy_log_file(Path(log_file), logs_dir)
-    if legacy_json and legacy_json.exists():
-        try:
-            legacy_entries = json.loads(legacy_json.read_text(encoding="utf-8"))
-            for entry in legacy_entries:
-                info = {
-                    "new_name": entry.get("new_name", ""),
-                    "time": entry.get("timestamp", ""),
-                    "signature": entry.get("signature", ""),
-                }
-                processed_files[entry.get("old_name", "")] = info
-                signature = entry.get("signature")
-                if signature:
-                    processed_signatures[signature] = info
-        except Exception as exc:
-            print(f"[LOG] Không thể đọc log đã chuyển: {exc}")
-
+    # Lịch sử xử lý: một file SQLite; log cũ và snapshot JSON chỉ được import lần đầu
+    log_fsync = str(settings.get("log_fsync", "batch")).lower()
+    HISTORY = open_history_store(logs_dir, log_fsync)
+    history = HISTORY or history_from_legacy_log(log_file)
+    LOG_WRITER = LogWriter(
+        history=HISTORY,
+        fallback_log=None if HISTORY else log_file,
+        remote=REMOTE_SYNC,
+        batch_size=int(settings.get("log_batch_size", 50)),
+        flush_interval=float(settings.get("log_flush_interval", 5)),
+        fsync=log_fsync if log_fsync in ("always", "batch", "none") else "batch",
+        outbox=open_sync_outbox(logs_dir, log_fsync) if REMOTE_SYNC else None,
+        remote_flush_interval=float(settings.get("remote_flush_interval", 300)),
+    )
+    replayed = LOG_WRITER.replay_outbox()
+    if replayed:
+        print(f"[AUTO PUSH] {replayed} entry chưa đồng bộ từ lần chạy trước sẽ được đẩy lên GitHub")
+    if HISTORY:
+        imported = convert_legacy_log_file(Path(log_file), logs_dir, HISTORY)
+        if imported:
+            print(f"[LOG] Đã import {imported} entry từ log cũ vào {HISTORY.db_path}")
+    migrated = migrate_processed_signatures(history)
+    if migrated:
+        print(f"[LOG] {migrated} chữ ký cũ đã được chuyển sang dấu vân tay nội dung")
+
+    remote_lock = threading.Lock()
+
+    def merge_remote_history() -> None:
+        """Gộp log remote vào lịch sử (một lần) trước khi phân loại file đầu tiên."""
+        nonlocal remote_refresh
+        with remote_lock:
+            if remote_refresh is None:
+                return
+            future, remote_refresh = remote_refresh, None
+            try:
+                remote_entries = future.result()
+            except Exception as exc:
+                print(f"[AUTO PUSH] Không thể tải log từ GitHub: {exc}")
+                return
+            added = history.append_many(
+                (entry for entry in remote_entries if entry.get("category") == "video"), source="remote"
+            )
+            if added:
+                print(f"[AUTO PUSH] Đã thêm {added} entry từ repo vào lịch sử")
+                migrate_processed_signatures(history)
+
+    def classify_with_remote(path: str) -> FileJob:
+        merge_remote_history()
+        return classify_file(path, history)
+
+    scanning = plan is None and only_files is None
+    journal = open_scan_journal(settings) if scanning else None
+    walker = build_library_walker(input_folder, settings) if scanning else None
+    scans: List[ScanResult] = []
     try:
-        mkv_files = [f for f in os.listdir(input_folder) if f.lower().endswith(".mkv")]
-        if not mkv_files:
-            print("Không tìm thấy file MKV nào trong thư mục hiện tại.")
+        if plan is not None:
+            planned = {file_plan.source_path: file_plan for file_plan in plan.files if file_plan.action != ACTION_SKIP}
+            file_paths = list(planned)
+            prepare = lambda path: load_planned_file(planned[path])
+            print(f"[PLAN] Thực hiện kế hoạch {plan_path}: {len(file_paths)} file cần xử lý")
+        elif only_files is not None:
+            file_paths = [os.path.abspath(path) for path in only_files]
+            prepare = classify_with_remote
+        else:
+            if walker:
+                print(f"[SCAN] Duyệt đệ quy {input_folder} ({walker.workers} thread)")
+            # Generator: file đầu tiên được xử lý trong lúc walker còn duyệt các thư mục khác
+            paths = iter_library_paths(input_folder, walker, journal, full_scan, scans)
+            first = next(paths, None)
+            file_paths = [] if first is None else itertools.chain([first], paths)
+            prepare = classify_with_remote
+        if not file_paths:
+            if any(scan.total for scan in scans):
+                print("Không có file MKV mới hoặc thay đổi kể từ lần chạy trước.")
+                for scan in scans:
+                    journal.commit(scan, RETRY_FILES)
+            else:
+                print("Không tìm thấy file MKV nào trong thư mục hiện tại.")
+            if replayed:
+                LOG_WRITER.flush_remote()
             return
 
-        for mkv_file in mkv_files:
-            file_path = os.path.join(input_folder, mkv_file)
-            print(f"\n===== ĐANG XỬ LÝ FILE: {file_path} =====")
-            
-            # Hiển thị kích thước file
-            file_size = get_file_size_gb(file_path)
+        workers = int(settings.get("prefetch_workers", 2))
+        depth = int(settings.get("prefetch_depth", 4))
+
+        # Nhiều job: mỗi ổ nguồn/đích chỉ chạy tối đa jobs_per_device job cùng lúc
+        max_jobs = int(jobs if jobs is not None else settings.get("jobs", 1))
+        scheduler = None
+        if max_jobs > 1:
+            scheduler = JobScheduler(max_jobs, per_device=int(settings.get("jobs_per_device", 1)))
+            output_devices = {device_of(folder) for folder in (vn_folder, original_folder, SUBTITLE_FOLDER)}
+            print(f"Xử lý song song tối đa {max_jobs} file ({scheduler.per_device} job mỗi ổ đĩa)")
+        futures = []
+
+        try:
+            # Worker nền probe và phân loại trước các file kế tiếp trong lúc file hiện tại đang remux
+            for job in prefetch(
+                file_paths,
+                prepare,
+                workers=workers,
+                depth=depth,
+            ):
+                file_path = job.file_path
+                mkv_file = job.file_name
+
+                # File đã xử lý bị loại ngay ở bước phân loại: chỉ in một dòng, không stat/probe thêm
+                if job.skip_reason:
+                    print(job.skip_reason)
+                    continue
+
+                print(f"\n===== ĐANG XỬ LÝ FILE: {file_path} =====")
             
-            # Kiểm tra file đã xử lý bằng tên và signature
-            file_signature = get_file_signature(file_path)
-            if mkv_file in processed_files:
-                print(f"File {mkv_file} đã được xử lý thành {processed_files[mkv_file]['new_name']} vào {processed_files[mkv_file]['time']}. Bỏ qua.")
-                continue
-            elif file_signature and file_signature in processed_signatures:
-                print(f"File {mkv_file} có cùng nội dung với file đã xử lý {processed_signatures[file_signature]['new_name']}. Bỏ qua.")
-                continue
+                # Hiển thị kích thước file
+                file_size = get_file_size_gb(file_path)
 
-            # Kiểm tra dung lượng trống trước khi xử lý
-            try:
-                disk_usage = shutil.disk_usage(".")
-                free_gb = disk_usage.free / (1024**3)
-                if free_gb < file_size * 1.5:
-                    print(f"CẢNH BÁO: Không đủ dung lượng trống trên ổ đĩa để xử lý an toàn. Cần ít nhất {file_size * 1.5:.2f} GB, hiện có {free_gb:.2f} GB")
-                    response = input("Bạn có muốn tiếp tục mặc dù có thể gặp lỗi? (y/n): ")
-                    if response.lower() != 'y':
-                        print("Bỏ qua file này.")
-                        continue
-            except Exception as e:
-                print(f"Không thể kiểm tra dung lượng ổ đĩa: {e}")
-
-            # Đọc thông tin file một lần duy nhất
-            try:
-                probe_data = ffmpeg.probe(file_path)
-                audio_streams = [stream for stream in probe_data['streams'] if stream['codec_type'] == 'audio']
-                subtitle_streams = [stream for stream in probe_data['streams'] if stream['codec_type'] == 'subtitle']
-                
-                # In thông tin streams để người dùng biết
-                print("\nThông tin streams:")
-                print("- Video streams:")
-                for i, stream in enumerate([s for s in probe_data['streams'] if s['codec_type'] == 'video']):
-                    width = stream.get('width', 'N/A')
-                    height = stream.get('height', 'N/A')
-                    codec = stream.get('codec_name', 'N/A')
-                    print(f"  Stream #{i}: {codec}, {width}x{height}")
-                
-                print("- Audio streams:")
-                for i, stream in enumerate(audio_streams):
-                    lang = stream.get('tags', {}).get('language', 'und')
-                    title = stream.get('tags', {}).get('title', '')
-                    channels = stream.get('channels', 'N/A')
-                    codec = stream.get('codec_name', 'N/A')
-                    lang_display = f"{get_language_abbreviation(lang)}"
-                    if title:
-                        lang_display += f" - {title}"
-                    print(f"  Stream #{stream.get('index', i)}: {codec}, {channels} channels, {lang_display}")
-                
-                print("- Subtitle streams:")
-                for i, stream in enumerate(subtitle_streams):
-                    lang = stream.get('tags', {}).get('language', 'und')
-                    title = stream.get('tags', {}).get('title', '')
-                    codec = stream.get('codec_name', 'N/A')
-                    lang_display = f"{get_language_abbreviation(lang)}"
-                    if title:
-                        lang_display += f" - {title}"
-                    print(f"  Stream #{stream.get('index', i)}: {codec}, {lang_display}")
-                
-            except Exception as e:
-                print(f"Lỗi khi đọc thông tin file {file_path}: {e}")
-                # Nếu không thể đọc thông tin file, vẫn thử rename đơn giản
-                try:
-                    new_path = rename_simple(file_path)
-                    log_processed_file(
-                        log_file,
-                        mkv_file,
-                        os.path.basename(new_path),
-                        signature=file_signature,
-                        metadata={
-                            "category": "video",
-                            "source_path": file_path,
-                            "output_path": os.path.abspath(new_path),
-                        },
-                    )
-                except Exception as rename_err:
-                    print(f"Không thể đổi tên: {rename_err}")
-                continue 
-
-            # Kiểm tra subtitle và audio tiếng Việt
-            has_vie_subtitle = any(stream.get('tags', {}).get('language', 'und') == 'vie' 
-                                 for stream in subtitle_streams)
-            has_vie_audio = any(stream.get('tags', {}).get('language', 'und') == 'vie' 
-                               for stream in audio_streams)
-
-            processed = False  # Flag để đánh dấu file đã được xử lý
-
-            # Xử lý subtitle tiếng Việt
-            vie_subtitle_streams = [stream for stream in subtitle_streams
-                                    if stream.get('tags', {}).get('language', 'und') == 'vie']
-            if vie_subtitle_streams:
-                print(f"\nPhát hiện {len(vie_subtitle_streams)} subtitle tiếng Việt. Bắt đầu trích xuất...")
-                for stream in vie_subtitle_streams:
-                    subtitle_info = (
-                        stream['index'],
-                        'vie',
-                        stream.get('tags', {}).get('title', ''),
-                        stream.get('codec_name', '')
-                    )
-                    extract_subtitle(file_path, subtitle_info, log_file, probe_data, file_signature=file_signature)
+                media_info = job.media_info
+                if job.probe_error:
+                    print(f"Error getting file signature: {job.probe_error}")
 
-            # Xử lý video nếu có audio tiếng Việt
-            if has_vie_audio:
+                # Kiểm tra dung lượng trống trước khi xử lý
                 try:
-                    print("\nPhát hiện audio tiếng Việt. Bắt đầu xử lý...")
-                    # Tìm audio track tiếng Việt có nhiều kênh nhất
-                    vie_audio_tracks = [(stream.get('index', i), stream.get('channels', 0), 'vie', 
-                                      stream.get('tags', {}).get('title', 'VIE'))
-                                      for i, stream in enumerate(audio_streams)
-                                      if stream.get('tags', {}).get('language', 'und') == 'vie']
-                    if vie_audio_tracks:
-                        # Sắp xếp theo số kênh giảm dần
-                        vie_audio_tracks.sort(key=lambda x: x[1], reverse=True)
-                        selected_track = vie_audio_tracks[0]
-                        print(f"Chọn track audio tiếng Việt index={selected_track[0]} với {selected_track[1]} kênh")
-                        extract_video_with_audio(
-                            file_path,
-                            vn_folder,
-                            original_folder,
-                            log_file,
-                            probe_data,
-                            file_signature=file_signature,
-                        )
-                        processed = True  # Đánh dấu file đã được xử lý
+                    disk_usage = shutil.disk_usage(".")
+                    free_gb = disk_usage.free / (1024**3)
+                    if free_gb < file_size * 1.5:
+                        print(f"CẢNH BÁO: Không đủ dung lượng trống trên ổ đĩa để xử lý an toàn. Cần ít nhất {file_size * 1.5:.2f} GB, hiện có {free_gb:.2f} GB")
+                        response = input("Bạn có muốn tiếp tục mặc dù có thể gặp lỗi? (y/n): ") if INTERACTIVE else "n"
+                        if response.lower() != 'y':
+                            print("Bỏ qua file này.")
+                            RETRY_FILES.add(os.path.abspath(file_path))
+                            continue
                 except Exception as e:
-                    print(f"Lỗi khi xử lý audio: {e}")
-
-            # Nếu không có cả subtitle và audio tiếng Việt HOẶC xử lý audio thất bại
-            if (not has_vie_subtitle and not has_vie_audio) or not processed:
-                print(f"\nKhông tìm thấy subtitle hoặc audio tiếng Việt hoặc xử lý thất bại. Chỉ đổi tên file...")
-                try:
-                    new_path = rename_simple(file_path)
-                    log_processed_file(
-                        log_file,
-                        mkv_file,
-                        os.path.basename(new_path),
-                        signature=file_signature,
-                        metadata={
-                            "category": "video",
-                            "source_path": file_path,
-                            "output_path": os.path.abspath(new_path),
-                        },
+                    print(f"Không thể kiểm tra dung lượng ổ đĩa: {e}")
+
+                if scheduler:
+                    devices = output_devices | {device_of(file_path)}
+                    future = scheduler.submit(
+                        lambda job=job: process_mkv_job(
+                            job.file_path, job.media_info, log_file, vn_folder, original_folder, job.probe_error, job.plan
+                        ),
+                        devices=devices,
+                        label=mkv_file,
                     )
-                except Exception as rename_err:
-                    print(f"Không thể đổi tên: {rename_err}")
+                    futures.append((file_path, future))
+                elif not process_mkv_job(
+                    file_path, media_info, log_file, vn_folder, original_folder, job.probe_error, job.plan
+                ):
+                    RETRY_FILES.add(os.path.abspath(file_path))
+        finally:
+            if scheduler:
+                scheduler.shutdown(wait=True)
+
+        if scheduler:
+            for file_path, future in futures:
+                error = future.exception()
+                if error:
+                    print(f"Lỗi khi xử lý {file_path}: {error}")
+                    RETRY_FILES.add(os.path.abspath(file_path))
+                elif not future.result():
+                    RETRY_FILES.add(os.path.abspath(file_path))
 
         # Auto-commit subtitles sau khi xử lý xong tất cả files
         print("\n=== HOÀN THÀNH XỬ LÝ ===")
+        print(f"[SKIP] {SKIP_STATS.summary()}")
+        if walker:
+            print(f"[SCAN] Đã duyệt {walker.summary()}")
         print("Bắt đầu auto-commit subtitle files...")
         auto_commit_subtitles(subtitle_folder)
 
-        if REMOTE_SYNC:
-            REMOTE_SYNC.flush()
+        LOG_WRITER.drain_remote()  # Chờ upload nền xong rồi mới cập nhật log trên GitHub
         write_run_log_snapshot(logs_dir)
+        if REMOTE_SYNC:
+            # Subtitle, log và snapshot còn chờ vào cùng một commit (khi commit theo lô); outbox được ack
+            LOG_WRITER.flush_remote()
+            print(f"[AUTO PUSH] {REMOTE_SYNC.summary()}")
+        # Ghi snapshot sau cùng: lần sau chỉ file mới/thay đổi mới được xử lý
+        for scan in scans:
+            journal.commit(scan, RETRY_FILES)
 
     except Exception as e:
         print(f"Lỗi khi truy cập thư mục '{input_folder}': {e}")
     finally:
+        if WATCHDOG:
+            WATCHDOG.stop()
+        print(f"[STAGING] {STAGING_STATS.summary()}")
+        close_probe_cache()
+        if journal:
+            journal.close()
+        if LOG_WRITER:
+            LOG_WRITER.close()
+            LOG_WRITER = None
+        if REMOTE_SYNC:
+            REMOTE_SYNC.close()
+        if HISTORY:
+            HISTORY.close()
+            HISTORY = None
         # Khôi phục thư mục làm việc ban đầu
         if need_restore_cwd:
             try:
@@ -1647,12 +2454,104 @@ def main(input_folder=None):
             except:
                 pass
 
+def watch_folders(folders=None, jobs=None, scan_options=None):
+    """Chế độ daemon: theo dõi thư mục inbox, xử lý file MKV mới ngay khi copy xong.
+
+    Mỗi lô file đã ổn định được xử lý bằng main(only_files=...) trong thư mục gốc đang
+    theo dõi (output nằm trong thư mục đó như lượt chạy thường). `folders` mặc định lấy
+    từ config "watch_folders", không có thì dùng thư mục hiện tại. Dừng bằng Ctrl+C.
+    """
+    global INTERACTIVE
+    if not check_ffmpeg_available():
+        return
+    settings = load_user_config()
+    settings.update(scan_options or {})
+    folders = [os.path.abspath(folder) for folder in (folders or settings.get("watch_folders") or ["."])]
+    logs_dir = Path(settings.get("logs_dir", "logs"))
+    mode = str(settings.get("watch_mode", "auto")).lower()
+    max_depth = settings.get("scan_max_depth")
+    watcher = FolderWatcher(
+        folders,
+        recursive=bool(settings.get("recursive", False)),
+        settle_seconds=float(settings.get("watch_settle_seconds", 10)),
+        poll_interval=float(settings.get("watch_poll_interval", 30)),
+        mode=mode if mode in WATCH_MODES else "auto",
+        include=settings.get("scan_include") or (),
+        exclude=settings.get("scan_exclude") or (),
+        max_depth=None if max_depth in (None, "") else int(max_depth),
+    )
+    watcher.start()
+    INTERACTIVE = False
+    print(
+        f"[WATCH] Đang theo dõi {', '.join(folders)} ({watcher.mode}, file ổn định sau "
+        f"{watcher.settle_seconds:g} giây). Nhấn Ctrl+C để dừng."
+    )
+    try:
+        while True:
+            batch = watcher.get_batch(timeout=1.0)  # Có timeout để Ctrl+C vẫn dừng được trên Windows
+            if batch is None:
+                continue
+            root, paths = batch
+            # File vừa được chính tool đổi tên cũng phát sự kiện: bỏ qua nếu đã có trong lịch sử
+            history = open_history_store(Path(root) / logs_dir)
+            if history:
+                try:
+                    done = [path for path in paths if history.lookup_name(os.path.basename(path))]
+                finally:
+                    history.close()
+                paths = [path for path in paths if path not in done]
+            if not paths:
+                continue
+            print(f"\n[WATCH] {len(paths)} file mới trong {root}: {', '.join(os.path.basename(p) for p in paths)}")
+            main(root, jobs=jobs, scan_options=scan_options, only_files=paths)
+            if RETRY_FILES:
+                print(f"[WATCH] {len(RETRY_FILES)} file chưa xử lý xong, sẽ thử lại khi file thay đổi hoặc ở lượt quét thường")
+            print(f"[WATCH] Tiếp tục theo dõi ({watcher.waiting} file đang chờ copy xong)")
+    except KeyboardInterrupt:
+        print("\n[WATCH] Dừng theo dõi.")
+    finally:
+        watcher.close()
+        INTERACTIVE = True
+
 if __name__ == "__main__":
-    import sys
-    # Cho phép truyền thư mục từ command line
-    if len(sys.argv) > 1:
-        folder = sys.argv[1]
-        print(f"Xử lý thư mục: {folder}")
-        main(folder)
+    import argparse
+
+    # Cho phép truyền thư mục và số job từ command line
+    parser = argparse.ArgumentParser(description="Tách audio/subtitle tiếng Việt từ file MKV")
+    parser.add_argument("folder", nargs="?", help="Thư mục chứa file MKV (mặc định: thư mục hiện tại)")
+    parser.add_argument("-j", "--jobs", type=int, help="Số file xử lý cùng lúc (mặc định theo config)")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ lập kế hoạch và ghi ra JSON, không sửa file nào")
+    parser.add_argument("--plan-file", help="Nơi ghi kế hoạch khi --dry-run (mặc định logs/plan_<thời gian>.json)")
+    parser.add_argument("--execute-plan", metavar="PLAN", help="Thực hiện kế hoạch JSON đã lưu bởi --dry-run")
+    parser.add_argument("--full-scan", action="store_true", help="Bỏ qua scan journal, kiểm tra lại mọi file")
+    parser.add_argument("-r", "--recursive", action="store_true", default=None, help="Duyệt cả các thư mục con")
+    parser.add_argument("--include", action="append", metavar="GLOB", help="Chỉ xử lý file khớp glob (lặp lại được)")
+    parser.add_argument("--exclude", action="append", metavar="GLOB", help="Bỏ qua file/thư mục khớp glob (lặp lại được)")
+    parser.add_argument("--max-depth", type=int, help="Độ sâu thư mục con tối đa khi duyệt đệ quy")
+    parser.add_argument(
+        "--watch",
+        nargs="*",
+        metavar="FOLDER",
+        help="Chạy liên tục, xử lý file MKV mới ngay khi copy xong (mặc định: thư mục đã chọn hoặc watch_folders trong config)",
+    )
+    args = parser.parse_args()
+    scan_options = {
+        key: value
+        for key, value in (
+            ("recursive", args.recursive),
+            ("scan_include", args.include),
+            ("scan_exclude", args.exclude),
+            ("scan_max_depth", args.max_depth),
+        )
+        if value is not None
+    }
+    if args.folder:
+        print(f"Xử lý thư mục: {args.folder}")
+    if args.watch is not None:
+        add_listener(ConsolePrinter())
+        watch_folders(args.watch or ([args.folder] if args.folder else None), jobs=args.jobs, scan_options=scan_options)
+    elif args.dry_run:
+        plan_library(args.folder, args.plan_file, jobs=args.jobs, scan_options=scan_options)
     else:
-        main()
\ No newline at end of file
+        add_listener(ConsolePrinter())  # In tiến độ ffmpeg ra console (GUI dùng listener riêng)
+        main(args.folder, jobs=args.jobs, plan_path=args.execute_plan, full_scan=args.full_scan, scan_options=scan_options)
\ No newline at end of file
@@ -0,0 +1,220 @@
+"""
+Quyết định có staging output trong RAM hay ghi thẳng ra đích, và đưa file
+staging về đích với số lần ghi ít nhất.
+
+- Ghi trực tiếp: ffmpeg ghi vào `<đích>.part` rồi `os.replace` khi xong,
+  nên file đích không bao giờ là file dở dang.
+- Staging: chỉ dùng khi đích nằm trên ổ mạng (ffmpeg seek ngược để ghi
+  Cues/SeekHead rất chậm qua SMB/NFS) và RAM đủ chứa một bản của file.
+  Chuyển về đích bằng `rename` nếu cùng filesystem, nếu không thì
+  `copy_file_range`/`sendfile` với buffer lớn (không qua bộ nhớ Python).
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import threading
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+
+PART_SUFFIX = ".part"
+COPY_CHUNK = 64 * 1024 * 1024
+STAGING_MODES = ("auto", "always", "never")
+NETWORK_FS_TYPES = {
+    "nfs", "nfs4", "cifs", "smb3", "smbfs", "fuse.sshfs", "sshfs", "9p",
+    "fuse.rclone", "fuse.s3fs", "afpfs", "webdav", "davfs", "fuse.davfs2",
+}
+
+
+def part_path(final_path: str) -> str:
+    return final_path + PART_SUFFIX
+
+
+def commit_part(part: str, final_path: str) -> int:
+    """Đổi `.part` thành file đích (atomic trên cùng filesystem). Trả về số byte."""
+    size = os.path.getsize(part)
+    os.replace(part, final_path)
+    return size
+
+
+def discard(path: str) -> None:
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except OSError as exc:
+        print(f"[STAGING] Không thể xóa file dở dang {path}: {exc}")
+
+
+@dataclass
+class StagingStats:
+    """Thống kê byte ghi trực tiếp so với byte phải copy từ vùng staging."""
+
+    direct_bytes: int = 0
+    copied_bytes: int = 0
+    renamed_bytes: int = 0
+    direct_files: int = 0
+    staged_files: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add_direct(self, size: int) -> None:
+        with self._lock:
+            self.direct_bytes += size
+            self.direct_files += 1
+
+    def add_staged(self, size: int, copied: bool) -> None:
+        with self._lock:
+            self.staged_files += 1
+            if copied:
+                self.copied_bytes += size
+            else:
+                self.renamed_bytes += size
+
+    def summary(self) -> str:
+        gb = 1024 ** 3
+        return (
+            f"ghi trực tiếp {self.direct_bytes / gb:.2f} GB ({self.direct_files} file), "
+            f"copy từ staging {self.copied_bytes / gb:.2f} GB, "
+            f"rename {self.renamed_bytes / gb:.2f} GB ({self.staged_files} file staging)"
+        )
+
+
+def _mount_table() -> List[Tuple[str, str]]:
+    """(mount_point, fstype) trên Linux; rỗng nếu không đọc được."""
+    mounts = []
+    try:
+        with open("/proc/self/mounts", "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3:
+                    mounts.append((parts[1].replace("\\040", " "), parts[2]))
+    except OSError:
+        pass
+    return mounts
+
+
+def filesystem_type(path: str) -> Optional[str]:
+    """Loại filesystem chứa `path` (Linux), None nếu không xác định được."""
+    real = os.path.realpath(path)
+    best = None
+    for mount_point, fstype in _mount_table():
+        prefix = mount_point.rstrip("/") + "/"
+        if real == mount_point or real.startswith(prefix):
+            if best is None or len(mount_point) > len(best[0]):
+                best = (mount_point, fstype)
+    return best[1] if best else None
+
+
+def is_network_path(path: str) -> bool:
+    """Đích có nằm trên ổ mạng không (SMB/NFS/SSHFS, đường dẫn UNC, network drive)."""
+    real = os.path.abspath(path)
+    if os.name == "nt":
+        if real.startswith("\\\\"):
+            return True
+        try:
+            import ctypes
+
+            drive = os.path.splitdrive(real)[0] + "\\"
+            return ctypes.windll.kernel32.GetDriveTypeW(drive) == 4  # DRIVE_REMOTE
+        except Exception:
+            return False
+    fstype = filesystem_type(real)
+    return bool(fstype) and fstype in NETWORK_FS_TYPES
+
+
+def _ram_staging_locations() -> List[str]:
+    locations = []
+    if os.name == "posix":
+        uid = os.getuid() if hasattr(os, "getuid") else None
+        for candidate in ("/dev/shm", f"/run/user/{uid}" if uid is not None else None):
+            if candidate and os.path.isdir(candidate) and os.access(candidate, os.W_OK):
+                locations.append(candidate)
+    return locations
+
+
+def choose_staging_dir(dest_dir: str, size_bytes: int, available_ram_bytes: float, mode: str = "auto") -> Optional[str]:
+    """Thư mục RAM để staging output, hoặc None nếu nên ghi thẳng ra đích.
+
+    Cần RAM trống > 1.2x và tmpfs trống > 1.1x kích thước file (chỉ một bản,
+    không còn phải gấp đôi như khi copy2).
+    """
+    if mode == "never":
+        return None
+    if mode != "always" and not is_network_path(dest_dir):
+        return None
+    if available_ram_bytes < size_bytes * 1.2:
+        return None
+    for location in _ram_staging_locations():
+        try:
+            if shutil.disk_usage(location).free >= size_bytes * 1.1:
+                return location
+        except OSError:
+            continue
+    return None
+
+
+def _copy_fd(src_fd: int, dst_fd: int, size: int) -> None:
+    """Copy trong kernel: copy_file_range, rồi sendfile, cuối cùng read/write buffer lớn."""
+    offset = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while offset < size:
+                copied = os.copy_file_range(src_fd, dst_fd, min(COPY_CHUNK, size - offset))
+                if copied == 0:
+                    break
+                offset += copied
+            if offset >= size:
+                return
+        except OSError:
+            pass  # Ví dụ EXDEV/ENOSYS trên kernel cũ -> thử cách khác từ offset hiện tại
+    if hasattr(os, "sendfile"):
+        try:
+            while offset < size:
+                sent = os.sendfile(dst_fd, src_fd, offset, min(COPY_CHUNK, size - offset))
+                if sent == 0:
+                    break
+                offset += sent
+            if offset >= size:
+                return
+        except OSError:
+            pass
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    while True:
+        chunk = os.read(src_fd, COPY_CHUNK)
+        if not chunk:
+            break
+        view = memoryview(chunk)
+        while view:
+            written = os.write(dst_fd, view)
+            view = view[written:]
+
+
+def move_into_place(staged_path: str, final_path: str, stats: Optional[StagingStats] = None) -> None:
+    """Đưa file staging về đích: rename nếu cùng filesystem, nếu không copy qua `.part` rồi replace."""
+    size = os.path.getsize(staged_path)
+    try:
+        os.replace(staged_path, final_path)
+        if stats:
+            stats.add_staged(size, copied=False)
+        return
+    except OSError:
+        pass  # Khác filesystem (EXDEV)
+
+    part = part_path(final_path)
+    try:
+        with open(staged_path, "rb") as src, open(part, "wb") as dst:
+            _copy_fd(src.fileno(), dst.fileno(), size)
+        shutil.copystat(staged_path, part)
+        os.replace(part, final_path)
+    except BaseException:
+        discard(part)
+        raise
+    os.remove(staged_path)
+    if stats:
+        stats.add_staged(size, copied=True)
+
+
+def make_staging_dir(location: str) -> str:
+    return tempfile.mkdtemp(dir=location, prefix="mkvstage_")
@@ -0,0 +1,125 @@
+"""
+Hàng đợi đồng bộ GitHub bền vững (outbox) trong thư mục logs của thư viện.
+- Mỗi entry cần đồng bộ được ghi thêm (và fsync) vào `sync_outbox.ndjson` trước
+  khi đưa cho thread đồng bộ nền: tắt GUI, crash hay mất mạng giữa chừng không
+  làm mất entry.
+- Sau khi entry đã lên GitHub, một dòng `ack` được ghi thêm; khi không còn entry
+  chờ thì file được làm rỗng.
+- Lần chạy sau, các entry chưa ack được đọc lại và đồng bộ tiếp (entry video trùng
+  chữ ký với log remote tự bị bỏ qua).
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+
+OUTBOX_FILE = "sync_outbox.ndjson"
+
+
+@dataclass
+class OutboxRecord:
+    id: str
+    entry: Dict[str, Any]
+    local_path: Optional[str] = None
+
+
+class SyncOutbox:
+    """Journal NDJSON chỉ ghi thêm: dòng `add` cho entry mới, dòng `ack` khi đã đồng bộ."""
+
+    def __init__(self, path: Path, fsync: bool = True):
+        self.path = Path(path)
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._pending: Dict[str, OutboxRecord] = {}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        acked = self._load()
+        if acked:
+            # Bỏ các dòng đã ack để file không lớn dần qua nhiều lần chạy
+            self._rewrite()
+
+    def _load(self) -> int:
+        try:
+            lines = self.path.read_text(encoding="utf-8").splitlines()
+        except FileNotFoundError:
+            return 0
+        except OSError as exc:
+            print(f"[AUTO PUSH] Không thể đọc {self.path}: {exc}")
+            return 0
+        acked = 0
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Dòng cuối bị cắt khi crash
+            if not isinstance(record, dict):
+                continue
+            if record.get("op") == "add" and isinstance(record.get("entry"), dict):
+                self._pending[record["id"]] = OutboxRecord(record["id"], record["entry"], record.get("local_path"))
+            elif record.get("op") == "ack":
+                for record_id in record.get("ids", []):
+                    acked += self._pending.pop(record_id, None) is not None
+        return acked
+
+    def _rewrite(self) -> None:
+        tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for record in self._pending.values():
+                f.write(self._line({"op": "add", "id": record.id, "entry": record.entry, "local_path": record.local_path}))
+            self._sync(f)
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def _line(data: Dict[str, Any]) -> str:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+    def _sync(self, f) -> None:
+        if self.fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _append(self, data: Dict[str, Any]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(self._line(data))
+            self._sync(f)
+
+    def pending(self) -> List[OutboxRecord]:
+        """Các entry chưa được đồng bộ, theo thứ tự ghi."""
+        with self._lock:
+            return list(self._pending.values())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def add(self, entry: Dict[str, Any], local_path: Optional[str] = None) -> Optional[str]:
+        """Ghi entry vào outbox. Trả về id, hoặc None nếu không ghi được (entry vẫn được đồng bộ)."""
+        record = OutboxRecord(uuid.uuid4().hex, dict(entry), os.path.abspath(local_path) if local_path else None)
+        with self._lock:
+            try:
+                self._append({"op": "add", "id": record.id, "entry": record.entry, "local_path": record.local_path})
+            except OSError as exc:
+                print(f"[AUTO PUSH] Không thể ghi outbox {self.path}: {exc}")
+                return None
+            self._pending[record.id] = record
+        return record.id
+
+    def ack(self, ids: Iterable[Optional[str]]) -> None:
+        """Đánh dấu các entry đã lên GitHub; làm rỗng file khi không còn entry chờ."""
+        with self._lock:
+            done = [record_id for record_id in ids if record_id and self._pending.pop(record_id, None) is not None]
+            if not done:
+                return
+            try:
+                if self._pending:
+                    self._append({"op": "ack", "ids": done})
+                else:
+                    with open(self.path, "w", encoding="utf-8") as f:
+                        self._sync(f)
+            except OSError as exc:
+                print(f"[AUTO PUSH] Không thể cập nhật outbox {self.path}: {exc}")
@@ -0,0 +1,81 @@
+"""Dựng file Matroska tổng hợp nhỏ cho test (EBML viết tay, không cần mkvmerge)."""
+import struct
+
+from mkv_reader import CLUSTER, TRACKS
+
+
+SEGMENT = 0x18538067
+INFO = 0x1549A966
+UNKNOWN_SIZE = b"\x01\xff\xff\xff\xff\xff\xff\xff"
+
+
+def vint(value, length=None):
+    if length is None:
+        length = 1
+        while value >= (1 << (7 * length)) - 1:
+            length += 1
+    return ((1 << (7 * length)) | value).to_bytes(length, "big")
+
+
+def element(element_id, data, size_length=None):
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, "big") + vint(len(data), size_length) + data
+
+
+def uint(element_id, value):
+    return element(element_id, value.to_bytes(max(1, (value.bit_length() + 7) // 8), "big"))
+
+
+def string(element_id, value):
+    return element(element_id, value.encode("utf-8"))
+
+
+def track_entry(number, track_type, codec_id, language="und", default=None, channels=None, extra=b""):
+    data = uint(0xD7, number) + uint(0x73C5, number * 111) + uint(0x83, track_type)
+    if default is not None:
+        data += uint(0x88, default)
+    if codec_id:
+        data += string(0x86, codec_id)
+    data += string(0x22B59C, language)
+    if track_type == 1:
+        data += element(0xE0, uint(0xB0, 1920) + uint(0xBA, 1080))
+    elif track_type == 2:
+        data += element(0xE1, element(0xB5, struct.pack(">d", 48000.0)) + uint(0x9F, channels or 2))
+    return element(0xAE, data + extra)
+
+
+def ebml_header():
+    return element(0x1A45DFA3, string(0x4282, "matroska") + uint(0x4287, 4))
+
+
+def info(duration_ms=5000.0):
+    return element(INFO, uint(0x2AD7B1, 1000000) + element(0x4489, struct.pack(">d", duration_ms)))
+
+
+def tracks(entries, size_length=None):
+    return element(TRACKS, b"".join(entries), size_length)
+
+
+def cluster(timestamp, children, unknown_size=False):
+    data = uint(0xE7, timestamp) + b"".join(children)
+    if unknown_size:
+        return CLUSTER.to_bytes(4, "big") + UNKNOWN_SIZE + data
+    return element(CLUSTER, data)
+
+
+def block_data(track_number, relative, payload, flags=0):
+    return vint(track_number) + struct.pack(">h", relative) + bytes([flags]) + payload
+
+
+def simple_block(track_number, relative, payload, flags=0x80):
+    return element(0xA3, block_data(track_number, relative, payload, flags))
+
+
+def block_group(track_number, relative, payload, duration=None):
+    data = element(0xA1, block_data(track_number, relative, payload))
+    if duration is not None:
+        data += uint(0x9B, duration)
+    return element(0xA0, data)
+
+
+def segment(*children):
+    return element(SEGMENT, b"".join(children), 8)
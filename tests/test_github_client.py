@@ -0,0 +1,362 @@
+"""Thử lại, Retry-After và rate limit của GitHubClient với server HTTP giả trên localhost."""
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import github_sync
+from github_sync import AutoPushConfig, GitHubAPIError, GitHubClient, GitRefConflict, RemoteSyncManager
+
+
+class StubServer:
+    """Trả lần lượt các response (status, headers, body) đã xếp sẵn, ghi lại request nhận được.
+
+    `body` là bytes thì gửi nguyên văn (file raw), còn lại gửi dạng JSON.
+    """
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                sent = json.loads(self.rfile.read(length)) if length else None
+                stub.requests.append((self.command, self.path, dict(self.headers), sent))
+                status, headers, body = stub.responses.pop(0) if stub.responses else (500, {}, {"message": "hết response"})
+                if body is None or isinstance(body, bytes):
+                    data = body or b""
+                else:
+                    data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, str(value))
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = _handle
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = StubServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Ghi lại thời gian chờ thay vì ngủ thật: 'backoff' (trước khi thử lại) và 'limiter' (điều tốc)."""
+    recorded = {"backoff": [], "limiter": []}
+    monkeypatch.setattr(github_sync.time, "sleep", recorded["backoff"].append)
+    return recorded
+
+
+def make_client(stub, sleeps, **overrides):
+    options = {"token": "t", "repo": "o/r", "max_retries": 3, "max_wait": 30.0}
+    options.update(overrides)
+    client = GitHubClient(AutoPushConfig(**options))
+    client.base_url = stub.url
+    client.limiter._sleep = sleeps["limiter"].append
+    return client
+
+
+def content(text):
+    return {"content": base64.b64encode(text.encode("utf-8")).decode("ascii"), "sha": "abc"}
+
+
+def test_retries_server_errors_until_success(stub, sleeps):
+    stub.responses = [(502, {}, {"message": "bad gateway"}), (503, {}, {"message": "unavailable"}), (200, {}, content("ok"))]
+    client = make_client(stub, sleeps)
+
+    assert client.get_content("logs/a.json") == (b"ok", "abc")
+    assert len(stub.requests) == 3
+    assert (client.stats.requests, client.stats.retries, client.stats.not_modified) == (3, 2, 0)
+    assert len(sleeps["backoff"]) == 2
+
+
+def test_gives_up_after_max_retries(stub, sleeps):
+    stub.responses = [(500, {}, {"message": "boom"})] * 3
+    client = make_client(stub, sleeps, max_retries=2)
+
+    with pytest.raises(RuntimeError, match="500"):
+        client.get_content("logs/a.json")
+    assert (client.stats.requests, client.stats.retries) == (3, 2)
+
+
+def test_429_waits_at_least_retry_after(stub, sleeps):
+    stub.responses = [(429, {"Retry-After": 7}, {"message": "slow down"}), (200, {}, content("ok"))]
+    client = make_client(stub, sleeps)
+
+    assert client.get_content("logs/a.json")[0] == b"ok"
+    assert (client.stats.requests, client.stats.retries) == (2, 1)
+    assert sleeps["backoff"] and sleeps["backoff"][0] >= 7
+    # Retry-After cũng tạm dừng mọi worker qua limiter
+    assert sleeps["limiter"] and max(sleeps["limiter"]) > 6
+    assert client.stats.throttled_seconds >= 7
+
+
+def test_secondary_rate_limit_403_is_retried(stub, sleeps):
+    stub.responses = [
+        (403, {}, {"message": "You have exceeded a secondary rate limit. Please wait a few minutes."}),
+        (403, {"Retry-After": 1}, {"message": "Forbidden"}),
+        (200, {}, content("ok")),
+    ]
+    client = make_client(stub, sleeps)
+
+    assert client.get_content("logs/a.json")[0] == b"ok"
+    assert (client.stats.requests, client.stats.retries) == (3, 2)
+    assert sleeps["backoff"][1] >= 1
+
+
+def test_plain_403_is_not_retried(stub, sleeps):
+    stub.responses = [(403, {}, {"message": "Resource not accessible by personal access token"}), (200, {}, content("ok"))]
+    client = make_client(stub, sleeps)
+
+    with pytest.raises(RuntimeError, match="403"):
+        client.get_content("logs/a.json")
+    assert len(stub.requests) == 1
+    assert (client.stats.requests, client.stats.retries) == (1, 0)
+    assert sleeps["backoff"] == []
+
+
+def test_conditional_get_counts_not_modified(stub, sleeps):
+    stub.responses = [(304, {"ETag": '"v1"'}, None), (200, {"ETag": '"v2"'}, content("new"))]
+    client = make_client(stub, sleeps)
+
+    assert client.get_content_if_changed("logs/a.json", '"v1"') == (False, None, None, '"v1"')
+    assert stub.requests[0][2].get("If-None-Match") == '"v1"'
+    assert client.get_content_if_changed("logs/a.json", '"v1"') == (True, b"new", "abc", '"v2"')
+    assert (client.stats.requests, client.stats.retries, client.stats.not_modified) == (2, 0, 1)
+
+
+def test_exhausted_quota_pauses_until_reset(stub, sleeps):
+    reset = int(time.time()) + 20
+    stub.responses = [
+        (200, {"X-RateLimit-Remaining": 0, "X-RateLimit-Reset": reset}, content("a")),
+        (200, {}, content("b")),
+    ]
+    client = make_client(stub, sleeps)
+
+    client.get_content("logs/a.json")
+    assert sleeps["limiter"] == []
+    client.get_content("logs/b.json")
+    # Request thứ hai chờ tới lúc reset thay vì gửi ngay
+    assert len(sleeps["limiter"]) == 1 and 15 < sleeps["limiter"][0] <= 21
+    assert client.stats.retries == 0
+
+
+def test_low_quota_slows_buckets(stub, sleeps):
+    stub.responses = [(200, {"X-RateLimit-Remaining": 100, "X-RateLimit-Reset": int(time.time()) + 100}, content("a"))]
+    client = make_client(stub, sleeps)
+
+    client.get_content("logs/a.json")
+    # (100 - 50 chừa lại) / ~100 giây
+    assert client.limiter.reads.rate < 1.0 and client.limiter.writes.rate < 1.0
+
+
+def test_403_quota_exhausted_waits_for_reset_within_max_wait(stub, sleeps):
+    reset = int(time.time()) + 10
+    exhausted = {"X-RateLimit-Remaining": 0, "X-RateLimit-Reset": reset}
+    stub.responses = [(403, exhausted, {"message": "API rate limit exceeded"}), (200, {}, content("ok"))]
+    client = make_client(stub, sleeps)
+
+    assert client.get_content("logs/a.json")[0] == b"ok"
+    assert (client.stats.requests, client.stats.retries) == (2, 1)
+    assert 5 < sleeps["backoff"][0] <= 11
+
+
+def test_403_quota_reset_beyond_max_wait_fails(stub, sleeps):
+    exhausted = {"X-RateLimit-Remaining": 0, "X-RateLimit-Reset": int(time.time()) + 3600}
+    stub.responses = [(403, exhausted, {"message": "API rate limit exceeded"})]
+    client = make_client(stub, sleeps, max_wait=60.0)
+
+    with pytest.raises(RuntimeError, match="403"):
+        client.get_content("logs/a.json")
+    assert (client.stats.requests, client.stats.retries) == (1, 0)
+
+
+def test_blob_upload_counted_once_after_retry(stub, sleeps):
+    stub.responses = [(502, {}, {"message": "bad gateway"}), (201, {}, {"sha": "b1"})]
+    client = make_client(stub, sleeps)
+
+    assert client.create_blob(b"x" * 100) == "b1"
+    assert client.create_blob(b"x" * 100) == "b1"  # Dùng lại blob đã tạo, không gửi lại
+    assert [request[0] for request in stub.requests] == ["POST", "POST"]
+    assert (client.stats.requests, client.stats.retries, client.stats.uploads, client.stats.bytes_uploaded) == (2, 1, 1, 100)
+
+
+def test_missing_file_is_classified_by_status(stub, sleeps):
+    stub.responses = [
+        (404, {}, {"message": "Not Found"}),
+        (404, {}, {"message": "Not Found"}),
+        (403, {}, {"message": "Blocked: see https://example.com/404"}),
+    ]
+    client = make_client(stub, sleeps)
+
+    assert client.get_content("logs/a.json") == (None, None)
+    assert client.get_raw("logs/a.ndjson") is None
+    # Thân response có chữ "404" nhưng status 403: không được coi là file không tồn tại
+    with pytest.raises(GitHubAPIError) as info:
+        client.get_raw("logs/b.ndjson")
+    assert info.value.status_code == 403
+
+
+def commit_responses(ref_status, ref_body):
+    return [
+        (200, {}, {"object": {"sha": "p1"}}),
+        (200, {}, {"tree": {"sha": "t1"}}),
+        (201, {}, {"sha": "b1"}),
+        (201, {}, {"sha": "t2"}),
+        (201, {}, {"sha": "c1"}),
+        (ref_status, {}, ref_body),
+    ]
+
+
+def test_ref_update_conflict_is_classified_by_status(stub, sleeps):
+    stub.responses = commit_responses(422, {"message": "Update is not a fast forward"})
+    client = make_client(stub, sleeps)
+    with pytest.raises(GitRefConflict):
+        client.commit_files({"subtitles/a.srt": b"1"}, "Sync")
+    client.close()
+
+    stub.responses = commit_responses(403, {"message": "Commit 409 rejected by ruleset"})
+    client = make_client(stub, sleeps)
+    with pytest.raises(GitHubAPIError) as info:
+        client.commit_files({"subtitles/a.srt": b"1"}, "Sync")
+    assert not isinstance(info.value, GitRefConflict) and info.value.status_code == 403
+    client.close()
+
+
+def make_manager(stub, sleeps, **overrides):
+    options = {"token": "t", "repo": "o/r", "max_retries": 0}
+    options.update(overrides)
+    manager = RemoteSyncManager(AutoPushConfig(**options))
+    manager.client.base_url = stub.url
+    manager.client.limiter._sleep = sleeps["limiter"].append
+    return manager
+
+
+NOT_FOUND = (404, {}, {"message": "Not Found"})
+
+
+def legacy_log(count):
+    entries = [
+        {"category": "video", "old_name": f"phim{i}.mkv", "signature": f"sig{i}", "timestamp": "2024-03-0%dT10:00:00" % (i % 9 + 1)}
+        for i in range(count)
+    ]
+    return entries, json.dumps(entries, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def test_large_legacy_log_is_read_raw_and_migrated(stub, sleeps):
+    entries, raw = legacy_log(12000)
+    assert len(raw) > 1024 * 1024  # Contents API dạng JSON không trả nội dung cỡ này
+    stub.responses = [
+        (200, {}, {"object": {"sha": "h1"}}),  # Đầu branch
+        NOT_FOUND,  # Subtitles/processed_files.log
+        NOT_FOUND,  # manifest.json
+        (200, {}, raw),  # logs/processed.json (raw)
+        (200, {}, {"object": {"sha": "h1"}}),
+        (200, {}, {"tree": {"sha": "t1"}}),
+        (201, {}, {"sha": "blob"}),
+        (201, {}, {"sha": "blob"}),
+        (201, {}, {"sha": "t2"}),
+        (201, {}, {"sha": "c1"}),
+        (200, {}, {"object": {"sha": "c1"}}),
+    ]
+    manager = make_manager(stub, sleeps, segment_max_entries=20000)  # Một segment + manifest: hai blob
+
+    loaded = manager.load_remote_logs()
+    manager.close()
+    assert len(loaded) == len(entries) and manager.has_signature("sig11999")
+    raw_request = stub.requests[3]
+    assert raw_request[1].startswith("/repos/o/r/contents/logs/processed.json")
+    assert raw_request[2]["Accept"] == "application/vnd.github.raw+json"
+    tree = next(sent for method, path, _headers, sent in stub.requests if path.endswith("/git/trees"))["tree"]
+    assert {"path": "logs/processed.json", "mode": "100644", "type": "blob", "sha": None} in tree
+    assert any(item["path"] == "logs/processed/manifest.json" for item in tree)
+    assert stub.requests[-1][0] == "PATCH" and manager.head == "c1"
+
+
+@pytest.mark.parametrize("raw", [b"", b"[]", b'{"entries": []}', b'[{"category": "video", "signa'])
+def test_empty_or_invalid_legacy_log_is_kept(stub, sleeps, raw):
+    stub.responses = [(200, {}, {"object": {"sha": "h1"}}), NOT_FOUND, NOT_FOUND, (200, {}, raw)]
+    manager = make_manager(stub, sleeps)
+
+    assert manager.load_remote_logs() == []
+    manager.close()
+    # Không commit, không xóa processed.json
+    assert [method for method, *_rest in stub.requests] == ["GET"] * 4
+
+
+def test_legacy_text_log_is_read_raw(stub, sleeps):
+    lines = "".join(f"phim{i}.mkv|Phim {i}.mkv|2024-01-01T00:00:00|sig{i}\n" for i in range(3))
+    stub.responses = [
+        (200, {}, lines.encode("utf-8")),  # Subtitles/processed_files.log (raw)
+        (200, {}, {"content": "", "encoding": "none", "sha": "old"}),  # sha để xóa từng file
+        (201, {}, {"content": {"sha": "n1"}}),
+        (200, {}, {"commit": {"sha": "c1"}}),
+    ]
+    manager = make_manager(stub, sleeps, batch_commits=False)
+
+    converted = manager.convert_remote_legacy_log()
+    manager.close()
+    assert [entry["signature"] for entry in converted] == ["sig0", "sig1", "sig2"]
+    assert stub.requests[0][2]["Accept"] == "application/vnd.github.raw+json"
+    method, path, _headers, sent = stub.requests[3]
+    assert method == "DELETE" and path.endswith("Subtitles/processed_files.log") and sent["sha"] == "old"
+
+
+def put_paths(stub):
+    return [path.split("/contents/", 1)[1] for method, path, _headers, _sent in stub.requests if method == "PUT"]
+
+
+def segment_entries(stub, index):
+    sent = [sent for method, path, _headers, sent in stub.requests if method == "PUT" and "/logs/processed/" in path]
+    return [json.loads(line) for line in base64.b64decode(sent[index]["content"]).splitlines()]
+
+
+def test_failed_subtitle_upload_keeps_entry_pending(stub, sleeps, tmp_path):
+    subtitle = tmp_path / "phim_vie.srt"
+    subtitle.write_text("1\n00:00:01,000 --> 00:00:02,000\nXin chào\n", encoding="utf-8")
+    uploaded = (201, {}, {"content": {"sha": "s"}})
+    stub.responses = [(500, {}, {"message": "boom"}), uploaded, uploaded]
+    manager = make_manager(stub, sleeps, batch_commits=False)
+
+    manager.record_entry({"category": "subtitle", "old_name": "phim.mkv"}, local_path=str(subtitle))
+    manager.record_entry({"category": "video", "old_name": "phim.mkv", "signature": "sig"})
+    # Upload lỗi: chỉ entry video được ghi log, entry subtitle còn chờ
+    assert manager.flush() is False
+    assert manager.has_pending()
+    assert [entry["category"] for entry in segment_entries(stub, 0)] == ["video"]
+
+    stub.responses = [uploaded, uploaded, uploaded]
+    assert manager.flush() is True
+    assert not manager.has_pending()
+    manager.close()
+    paths = put_paths(stub)
+    assert paths[0].startswith("subtitles/") and paths[3] == paths[0]  # Upload lại đúng remote_path trong entry
+    subtitle_entry = segment_entries(stub, 2)[0]
+    assert subtitle_entry["category"] == "subtitle" and subtitle_entry["remote_path"] == paths[0]
@@ -0,0 +1,34 @@
+"""Sao chép kho lịch sử sang bộ nhớ cho dry-run."""
+from pathlib import Path
+
+from history_store import HistoryStore
+
+
+def test_copy_from_reads_without_touching_the_library(tmp_path):
+    db_path = tmp_path / "processed_history.sqlite3"
+    store = HistoryStore(db_path)
+    store.append_many([{"old_name": "a.mkv", "new_name": "A.mkv", "signature": "1_2"}], source="run")
+    store.import_entries("processed_files.log:10:1", [{"old_name": "b.mkv", "new_name": "B.mkv"}])
+    store.close()
+    before = {path.name: path.read_bytes() for path in tmp_path.iterdir()}
+
+    snapshot = HistoryStore(Path(":memory:"))
+    assert snapshot.copy_from(db_path) == 2
+    assert snapshot.lookup_name("A.mkv")["signature"] == "1_2"
+    assert snapshot.was_imported("processed_files.log:10:1")
+    snapshot.append_many([{"old_name": "c.mkv"}], source="remote")
+    snapshot.close()
+
+    # Không tạo -wal/-shm, không sửa file SQLite
+    assert {path.name: path.read_bytes() for path in tmp_path.iterdir()} == before
+
+
+def test_copy_from_sees_uncheckpointed_writes(tmp_path):
+    db_path = tmp_path / "processed_history.sqlite3"
+    writer = HistoryStore(db_path)
+    writer.append_many([{"old_name": "a.mkv"}, {"old_name": "b.mkv"}], source="run")
+
+    snapshot = HistoryStore(Path(":memory:"))
+    assert snapshot.copy_from(db_path) == 2  # Đọc cả phần còn trong -wal của job đang chạy
+    snapshot.close()
+    writer.close()
@@ -0,0 +1,75 @@
+"""Thread đồng bộ remote của LogWriter: thử lại entry lỗi trong lượt chạy dài."""
+import threading
+import time
+
+from log_writer import LogWriter
+from sync_outbox import SyncOutbox
+
+
+class FlakyRemote:
+    """Remote giả: record_entry lỗi `failures` lần đầu, flush luôn thành công."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.attempts = []
+        self.recorded = []
+        self.flushed = threading.Event()
+        self._pending = False
+
+    def record_entry(self, entry, local_path=None):
+        self.attempts.append(time.monotonic())
+        if len(self.attempts) <= self.failures:
+            raise RuntimeError("mất mạng")
+        self.recorded.append(entry)
+        self._pending = True
+
+    def has_pending(self):
+        return self._pending
+
+    def flush(self):
+        if self._pending:
+            self._pending = False
+            self.flushed.set()
+        return True
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_failed_entry_is_retried_with_backoff(tmp_path):
+    remote = FlakyRemote(failures=3)
+    outbox = SyncOutbox(tmp_path / "sync_outbox.ndjson", fsync=False)
+    writer = LogWriter(remote=remote, outbox=outbox, flush_interval=0, remote_flush_interval=0.1)
+    try:
+        writer.write({"category": "video", "old_name": "phim.mkv", "signature": "sig"})
+        wait_for(remote.flushed.is_set)
+        wait_for(lambda: len(outbox) == 0)
+    finally:
+        writer.close()
+
+    assert [entry["old_name"] for entry in remote.recorded] == ["phim.mkv"]
+    assert len(remote.attempts) == 4
+    gaps = [later - earlier for earlier, later in zip(remote.attempts, remote.attempts[1:])]
+    # Chu kỳ 0.1s gấp đôi sau mỗi lần lỗi: 0.1, 0.2, 0.4
+    assert gaps[0] >= 0.09 and gaps[1] >= 0.18 and gaps[2] >= 0.36
+    assert writer._remote_failures == 0
+
+
+def test_flush_remote_retries_failed_entries_immediately(tmp_path):
+    remote = FlakyRemote(failures=1)
+    outbox = SyncOutbox(tmp_path / "sync_outbox.ndjson", fsync=False)
+    writer = LogWriter(remote=remote, outbox=outbox, flush_interval=0, remote_flush_interval=3600)
+    try:
+        writer.write({"category": "video", "old_name": "phim.mkv", "signature": "sig"})
+        writer.drain_remote()
+        assert remote.recorded == [] and len(outbox) == 1  # Lỗi: entry vẫn nằm trong outbox
+
+        writer.flush_remote()
+        assert [entry["old_name"] for entry in remote.recorded] == ["phim.mkv"]
+        assert len(outbox) == 0
+    finally:
+        writer.close()
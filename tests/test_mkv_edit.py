@@ -0,0 +1,171 @@
+"""Sửa header Matroska tại chỗ trên file Matroska tổng hợp nhỏ."""
+import zlib
+
+import pytest
+
+import mkv_edit
+from mkv_edit import MatroskaEditError, NotEnoughSpaceError, TrackEdit, edit_tracks_in_place
+from mkv_reader import CLUSTER, TRACKS, parse_matroska, to_probe_data, track_for_stream
+from mkv_samples import ebml_header, element, info, track_entry, uint, vint
+
+
+def build_mkv(void_total=0, crc=False, complex_track=False, tracks_size_length=None):
+    """EBML header + Segment(Info, Tracks, [Void], Cluster). Trả về bytes."""
+    entries = [track_entry(1, 1, "V_MPEG4/ISO/AVC")]
+    if complex_track:
+        entries.append(track_entry(9, 3, ""))  # Track "complex": FFmpeg không tạo stream
+    entries += [
+        track_entry(2, 2, "A_EAC3", "eng", channels=6),
+        track_entry(3, 2, "A_AAC", "vie", default=0, channels=2),
+        track_entry(4, 17, "S_TEXT/UTF8", "vie", default=0),
+    ]
+    payload = b"".join(entries)
+    if crc:
+        payload = element(0xBF, (zlib.crc32(payload) & 0xFFFFFFFF).to_bytes(4, "little")) + payload
+    tracks = element(TRACKS, payload, tracks_size_length)
+    void = b""
+    if void_total:
+        void = mkv_edit.void_element(void_total)
+    cluster = element(CLUSTER, uint(0xE7, 0) + element(0xA3, vint(1) + b"\x00\x00\x80" + b"V" * 200))
+    return ebml_header() + element(0x18538067, info() + tracks + void + cluster, 8)
+
+
+def write(tmp_path, data):
+    path = tmp_path / "movie.mkv"
+    path.write_bytes(data)
+    return str(path)
+
+
+def tracks_by_number(path):
+    return {track.number: track for track in parse_matroska(path).tracks}
+
+
+def test_flag_change_absorbed_by_void(tmp_path):
+    data = build_mkv(void_total=40)
+    path = write(tmp_path, data)
+    before = parse_matroska(path)
+    cluster_offset = data.index(CLUSTER.to_bytes(4, "big"))
+
+    edit_tracks_in_place(path, [TrackEdit(2, flag_default=0), TrackEdit(3, flag_default=1, flag_enabled=1)])
+
+    after = open(path, "rb").read()
+    assert len(after) == len(data)
+    assert after[cluster_offset:] == data[cluster_offset:]  # Cluster không bị dịch
+    assert after[: before.elements[TRACKS][0]] == data[: before.elements[TRACKS][0]]
+    tracks = tracks_by_number(path)
+    assert (tracks[2].flag_default, tracks[3].flag_default, tracks[3].flag_enabled) == (0, 1, 1)
+    assert tracks[4].flag_default == 0 and tracks[3].language == "vie"
+
+
+def test_one_byte_gap_widens_size_vint(tmp_path):
+    probe = build_mkv(void_total=40, tracks_size_length=2)
+    path = write(tmp_path, probe)
+    mkv = parse_matroska(path)
+    with open(path, "rb") as f:
+        buf = f.read()
+    old_length = mkv.elements[TRACKS][1] + mkv.elements[TRACKS][2]
+    edits = [TrackEdit(3, name="Thuyết Minh")]
+    grown = len(mkv_edit.build_tracks_element(buf, mkv, edits, 2)) - old_length
+
+    # Vùng trống sau Tracks mới đúng 1 byte: không đủ cho Void nên size vint phải dài thêm 1 byte
+    data = build_mkv(void_total=grown + 1, tracks_size_length=2)
+    path = write(tmp_path, data)
+    cluster_offset = data.index(CLUSTER.to_bytes(4, "big"))
+    edit_tracks_in_place(path, edits)
+
+    after = open(path, "rb").read()
+    assert len(after) == len(data) and after[cluster_offset:] == data[cluster_offset:]
+    mkv = parse_matroska(path)
+    assert mkv.elements[TRACKS][1] == 4 + 3  # ID 4 byte + size vint 3 byte
+    assert mkv.elements[TRACKS][0] + mkv.elements[TRACKS][1] + mkv.elements[TRACKS][2] == cluster_offset
+    assert tracks_by_number(path)[3].name == "Thuyết Minh"
+
+
+def test_crc32_recomputed(tmp_path):
+    path = write(tmp_path, build_mkv(void_total=30, crc=True))
+    edit_tracks_in_place(path, [TrackEdit(3, flag_default=1)])
+
+    mkv = parse_matroska(path)
+    offset, header_len, size = mkv.elements[TRACKS]
+    payload = open(path, "rb").read()[offset + header_len: offset + header_len + size]
+    assert payload[:2] == b"\xbf\x84"
+    assert int.from_bytes(payload[2:6], "little") == zlib.crc32(payload[6:]) & 0xFFFFFFFF
+    assert tracks_by_number(path)[3].flag_default == 1
+
+
+def test_not_enough_space_leaves_file_untouched(tmp_path):
+    data = build_mkv()
+    path = write(tmp_path, data)
+    with pytest.raises(NotEnoughSpaceError):
+        edit_tracks_in_place(path, [TrackEdit(3, flag_default=1, name="Một cái tên dài hơn chỗ trống")])
+    assert open(path, "rb").read() == data
+
+
+def test_restores_original_bytes_when_verify_fails(tmp_path, monkeypatch):
+    data = build_mkv(void_total=40)
+    path = write(tmp_path, data)
+
+    def broken_verify(path, edits):
+        raise MatroskaEditError("giả lập header hỏng")
+
+    monkeypatch.setattr(mkv_edit, "_verify", broken_verify)
+    with pytest.raises(MatroskaEditError):
+        edit_tracks_in_place(path, [TrackEdit(2, flag_default=0), TrackEdit(3, flag_default=1)])
+    assert open(path, "rb").read() == data
+
+
+def test_unknown_track_number_is_rejected(tmp_path):
+    data = build_mkv(void_total=40)
+    path = write(tmp_path, data)
+    with pytest.raises(MatroskaEditError):
+        edit_tracks_in_place(path, [TrackEdit(7, flag_default=1)])
+    assert open(path, "rb").read() == data
+
+
+def test_stream_index_skips_tracks_ffmpeg_ignores(tmp_path):
+    path = write(tmp_path, build_mkv(void_total=40, complex_track=True))
+    mkv = parse_matroska(path)
+    streams = to_probe_data(mkv)["streams"]
+    assert [stream["codec_type"] for stream in streams[:4]] == ["video", "audio", "audio", "subtitle"]
+    # Stream 2 (audio tiếng Việt) là TrackEntry thứ 4 (vị trí 3), TrackNumber 3
+    assert track_for_stream(mkv, 2).number == 3
+    assert track_for_stream(mkv, 3).number == 4
+    assert track_for_stream(mkv, 4) is None
+
+
+def test_set_default_audio_in_place_uses_stream_mapping(tmp_path):
+    import script
+
+    path = write(tmp_path, build_mkv(void_total=40, complex_track=True))
+    output_dir = tmp_path / "out"
+    output = str(output_dir / "movie_vie.mkv")
+    selected = (2, 2, "vie", "Thuyết Minh")  # stream index 2 theo ffprobe
+    logged = []
+    original_log = script.log_processed_file
+    script.log_processed_file = lambda *args, **kwargs: logged.append((args, kwargs))
+    try:
+        assert script.set_default_audio_in_place(path, output, selected, None, None)
+    finally:
+        script.log_processed_file = original_log
+
+    tracks = tracks_by_number(output)
+    assert (tracks[2].flag_default, tracks[3].flag_default, tracks[3].flag_enabled) == (0, 1, 1)
+    assert tracks[9].flag_default == 1 and tracks[4].flag_default == 0  # Track không phải audio giữ nguyên
+    assert logged and logged[0][1]["metadata"]["notes"] == "inplace"
+
+
+def test_set_default_audio_in_place_restores_flags_when_move_fails(tmp_path, monkeypatch):
+    import script
+
+    data = build_mkv(void_total=40)
+    path = write(tmp_path, data)
+    output = str(tmp_path / "movie_vie.mkv")
+
+    def failing_rename(src, dst):
+        raise OSError("giả lập file bị khóa")
+
+    monkeypatch.setattr(script.os, "rename", failing_rename)
+    monkeypatch.setattr(script, "log_processed_file", lambda *args, **kwargs: pytest.fail("không được ghi log"))
+    assert script.set_default_audio_in_place(path, output, (2, 2, "vie", ""), None, None) is False
+    tracks = tracks_by_number(path)
+    assert (tracks[2].flag_default, tracks[3].flag_default) == (1, 0)
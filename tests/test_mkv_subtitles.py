@@ -0,0 +1,144 @@
+"""Trích subtitle text native trên file Matroska tổng hợp nhỏ."""
+import zlib
+
+import pytest
+
+from mkv_samples import (
+    block_group,
+    cluster,
+    ebml_header,
+    element,
+    info,
+    segment,
+    simple_block,
+    track_entry,
+    tracks,
+    uint,
+)
+from mkv_subtitles import (
+    ExtractStats,
+    UnsupportedSubtitleError,
+    ass_dialogue_to_text,
+    extract_text_subtitles,
+    format_srt,
+)
+
+
+CUES = 0x1C53BB6B
+
+
+def compression(algo, settings=b""):
+    """ContentEncodings nén toàn bộ frame (scope 1) bằng `algo` (0 zlib, 3 header stripping)."""
+    comp = uint(0x4254, algo)
+    if settings:
+        comp += element(0x4255, settings)
+    return element(0x6D80, element(0x6240, uint(0x5031, 0) + uint(0x5032, 1) + uint(0x5033, 0) + element(0x5034, comp)))
+
+
+# Stream index theo ffprobe: video 0, rồi các subtitle 1..4
+TRACK_ENTRIES = [
+    track_entry(1, 1, "V_MPEG4/ISO/AVC"),
+    track_entry(2, 17, "S_TEXT/UTF8", "vie"),
+    track_entry(3, 17, "S_TEXT/ASS", "vie"),
+    track_entry(4, 17, "S_TEXT/UTF8", "eng", extra=compression(0)),
+    track_entry(5, 17, "S_TEXT/UTF8", "fre", extra=compression(3, "Bonjour ".encode("utf-8"))),
+]
+
+ASS_LINE = "0,0,Default,,0,0,0,,{\\i1}Xin{\\i0} chào\\Nbạn {\\pos(10,20)}nhé"
+
+
+def write(tmp_path, clusters):
+    path = tmp_path / "movie.mkv"
+    path.write_bytes(ebml_header() + segment(info(), tracks(TRACK_ENTRIES), *clusters))
+    return str(path)
+
+
+def video(relative):
+    return simple_block(1, relative, b"V" * 500)
+
+
+def sample_clusters(first_unknown_size=False):
+    return [
+        cluster(
+            1000,
+            [
+                video(0),
+                simple_block(2, 0, "Dòng một".encode("utf-8")),
+                block_group(3, 100, ASS_LINE.encode("utf-8"), duration=1500),
+                simple_block(4, 200, zlib.compress(b"Hello")),
+                simple_block(5, 300, b"monde"),
+                video(40),
+            ],
+            unknown_size=first_unknown_size,
+        ),
+        cluster(
+            5000,
+            [
+                video(0),
+                simple_block(2, 0, "Dòng hai\r\n".encode("utf-8")),
+                block_group(2, 2000, "Dòng ba".encode("utf-8"), duration=700),
+            ],
+        ),
+    ]
+
+
+def test_all_tracks_extracted_in_one_walk(tmp_path):
+    path = write(tmp_path, sample_clusters())
+    stats = ExtractStats()
+
+    results = extract_text_subtitles(path, [1, 2, 3, 4], stats)
+
+    utf8 = results[1]
+    assert [(event.start_ms, event.end_ms, event.text) for event in utf8] == [
+        (1000, 5000, "Dòng một"),  # SimpleBlock không có thời lượng: kết thúc khi câu sau bắt đầu
+        (5000, 7000, "Dòng hai"),
+        (7000, 7700, "Dòng ba"),  # BlockGroup + BlockDuration
+    ]
+    assert [(event.start_ms, event.end_ms) for event in results[2]] == [(1100, 2600)]
+    assert [(event.start_ms, event.text) for event in results[3]] == [(1200, "Hello")]  # zlib
+    assert [event.text for event in results[4]] == ["Bonjour monde"]  # header stripping
+    assert stats.blocks == 9 and stats.subtitle_blocks == 6
+    # Payload video chỉ được seek qua, không đọc
+    assert stats.bytes_skipped >= 3 * 500 and stats.bytes_read < 3 * 500
+
+
+def test_ass_dialogue_converted_to_srt_text(tmp_path):
+    assert ass_dialogue_to_text(ASS_LINE) == "<i>Xin</i> chào\nbạn nhé"
+    assert ass_dialogue_to_text("0,0,Default,,0,0,0,,a\\hb\\nc") == "a b\nc"
+
+    path = write(tmp_path, sample_clusters())
+    events = extract_text_subtitles(path, [2])[2]
+    assert format_srt(events) == "1\n00:00:01,100 --> 00:00:02,600\n<i>Xin</i> chào\nbạn nhé\n\n"
+
+
+def test_unknown_size_cluster_ends_at_next_cluster(tmp_path):
+    path = write(tmp_path, sample_clusters(first_unknown_size=True) + [element(CUES, b"\x00" * 8)])
+
+    results = extract_text_subtitles(path, [1, 4])
+
+    assert [event.text for event in results[1]] == ["Dòng một", "Dòng hai", "Dòng ba"]
+    assert [event.text for event in results[4]] == ["Bonjour monde"]
+
+
+def test_unknown_size_cluster_ends_at_cues(tmp_path):
+    last = cluster(1000, [simple_block(2, 0, b"Cuoi")], unknown_size=True)
+    path = write(tmp_path, [last, element(CUES, b"\x00" * 8)])
+
+    assert [event.text for event in extract_text_subtitles(path, [1])[1]] == ["Cuoi"]
+
+
+def test_laced_subtitle_block_is_unsupported(tmp_path):
+    laced = cluster(0, [simple_block(2, 0, b"\x01\x02ab", flags=0x82)])
+    path = write(tmp_path, [laced])
+
+    with pytest.raises(UnsupportedSubtitleError):
+        extract_text_subtitles(path, [1])
+
+
+def test_non_text_stream_is_unsupported(tmp_path):
+    path = write(tmp_path, sample_clusters())
+
+    with pytest.raises(UnsupportedSubtitleError):
+        extract_text_subtitles(path, [0])  # Stream video
+    with pytest.raises(UnsupportedSubtitleError):
+        extract_text_subtitles(path, [9])  # Không có stream này
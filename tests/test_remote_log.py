@@ -0,0 +1,223 @@
+"""Segment NDJSON, manifest và cache của log remote."""
+import datetime
+import json
+from concurrent.futures import Future
+
+import pytest
+
+from github_sync import AutoPushConfig, GitRefConflict, RemoteSyncManager
+from remote_log import (
+    Manifest,
+    RemoteState,
+    SegmentCache,
+    SegmentInfo,
+    build_segments,
+    decode_segment,
+    encode_segment,
+    segment_infos,
+    sha256_hex,
+)
+
+
+def entry(name, timestamp=None):
+    data = {"category": "video", "old_name": name, "signature": f"sig-{name}"}
+    if timestamp:
+        data["timestamp"] = timestamp
+    return data
+
+
+def test_segments_split_by_entry_month_and_count():
+    entries = [entry(f"a{i}.mkv", f"2024-01-0{i + 1}T00:00:00") for i in range(5)]
+    entries += [entry("b.mkv", "2024-02-10T00:00:00"), entry("c.mkv")]
+
+    segments = build_segments(entries, "logs/processed", max_entries=2, by_entry_month=True, label="legacy")
+
+    current = datetime.datetime.utcnow().strftime("%Y-%m")
+    months = [path.split("/")[2] for path in segments]
+    assert months == ["2024-01"] * 3 + ["2024-02", current]  # Entry không có timestamp vào tháng hiện tại
+    assert all(path.startswith("logs/processed/") and path.endswith(".ndjson") for path in segments)
+    assert [len(decode_segment(data)) for data in segments.values()] == [2, 2, 1, 1, 1]
+    decoded = [item for data in segments.values() for item in decode_segment(data)]
+    assert sorted(item["old_name"] for item in decoded) == sorted(item["old_name"] for item in entries)
+
+
+def test_new_entries_go_to_current_month():
+    entries = [entry("a.mkv", "2020-05-01T00:00:00"), entry("b.mkv", "2021-06-01T00:00:00")]
+
+    segments = build_segments(entries, "logs/processed")
+
+    current = datetime.datetime.utcnow().strftime("%Y-%m")
+    assert [path.split("/")[2] for path in segments] == [current]
+    infos = segment_infos(segments)
+    assert infos[0].entries == 2 and infos[0].sha256 == sha256_hex(next(iter(segments.values())))
+
+
+def test_truncated_and_invalid_lines_are_skipped():
+    data = encode_segment([entry("Phim một.mkv"), entry("Phim hai.mkv"), entry("Phim cuối.mkv")])
+    broken = b'not json\n["list"]\n\n' + data
+
+    # Cắt giữa dòng cuối, ngay giữa một ký tự UTF-8 nhiều byte
+    cut = broken.rindex("ố".encode("utf-8")) + 1
+    assert [item["old_name"] for item in decode_segment(broken[:cut])] == ["Phim một.mkv", "Phim hai.mkv"]
+    assert len(decode_segment(broken)) == 3
+
+
+def test_manifest_round_trip_and_future_version():
+    manifest = Manifest(segments=[SegmentInfo("logs/processed/2024-01/a.ndjson", 3, "ab", "2024-01-01T00:00:00")])
+
+    loaded = Manifest.from_bytes(manifest.to_bytes())
+    assert loaded == manifest and loaded.total_entries == 3
+    assert Manifest.from_bytes(None).segments == []
+    with pytest.raises(ValueError):
+        Manifest.from_bytes(json.dumps({"version": 99, "segments": []}).encode("utf-8"))
+
+
+def test_manifest_merge_keeps_known_segments_once():
+    mine = SegmentInfo("logs/processed/2024-03/mine.ndjson", 1, "m")
+    theirs = SegmentInfo("logs/processed/2024-03/theirs.ndjson", 2, "t")
+    base = SegmentInfo("logs/processed/2024-02/base.ndjson", 5, "b")
+
+    merged = Manifest(segments=[base, theirs]).merged_with([theirs, mine])
+    assert [segment.path for segment in merged.segments] == [base.path, theirs.path, mine.path]
+    assert merged.total_entries == 8
+
+
+def test_segment_cache_drops_corrupt_files(tmp_path):
+    cache = SegmentCache(tmp_path / "cache")
+    data = encode_segment([entry("a.mkv")])
+    digest = cache.put(data)
+
+    assert cache.get(SegmentInfo("x.ndjson", 1, digest)) == data
+    (tmp_path / "cache" / f"{digest}.ndjson").write_bytes(b"broken")
+    assert cache.load(digest) is None
+    assert not (tmp_path / "cache" / f"{digest}.ndjson").exists()
+
+
+def test_remote_state_persists_head_and_files(tmp_path):
+    cache = SegmentCache(tmp_path / "cache")
+    state = RemoteState(cache)
+    state.set_head("h1", '"etag-h1"')
+    state.remember("logs/processed/manifest.json", b"{}", sha="s1", etag='"etag-m"')
+    state.remember("logs/processed.json", None)
+    state.save()
+
+    reloaded = RemoteState(cache)
+    assert (reloaded.head, reloaded.head_etag) == ("h1", '"etag-h1"')
+    assert reloaded.content("logs/processed/manifest.json") == (True, b"{}", "s1")
+    assert reloaded.file("logs/processed/manifest.json")["etag"] == '"etag-m"'
+    assert reloaded.content("logs/processed.json") == (True, None, None)  # Đã biết là không tồn tại
+    assert reloaded.content("logs/other.json") == (False, None, None)
+
+
+class FakeClient:
+    """Thay GitHubClient: repo trong bộ nhớ, commit_files có thể báo xung đột."""
+
+    def __init__(self, files=None, head="h1"):
+        self.files = dict(files or {})
+        self.head = head
+        self.raw_requests = []
+        self.commits = []
+        self.conflicts = 0
+
+    def submit(self, func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+    def get_raw(self, path):
+        self.raw_requests.append(path)
+        return self.files.get(path)
+
+    def get_content(self, path):
+        data = self.files.get(path)
+        return data, (sha256_hex(data) if data is not None else None)
+
+    def get_content_if_changed(self, path, etag=None):
+        data, sha = self.get_content(path)
+        return True, data, sha, None
+
+    def get_head(self, etag=None):
+        return True, self.head, None
+
+    def commit_files(self, files, message, expected_head=None):
+        if self.conflicts:
+            self.conflicts -= 1
+            # Client khác vừa commit một segment và cập nhật manifest
+            theirs = encode_segment([entry("theirs.mkv")])
+            self.files["logs/processed/2024-03/theirs.ndjson"] = theirs
+            manifest = Manifest.from_bytes(self.files.get("logs/processed/manifest.json"))
+            manifest = manifest.merged_with(segment_infos({"logs/processed/2024-03/theirs.ndjson": theirs}))
+            self.files["logs/processed/manifest.json"] = manifest.to_bytes()
+            self.head = "h2"
+            raise GitRefConflict("Branch đã đổi")
+        self.commits.append(files)
+        for path, data in files.items():
+            if data is None:
+                self.files.pop(path, None)
+            else:
+                self.files[path] = data
+        self.head = f"c{len(self.commits)}"
+        return self.head
+
+    def close(self):
+        pass
+
+
+def make_manager(client, cache_dir=None):
+    manager = RemoteSyncManager(AutoPushConfig(token="t", repo="o/r", cache_dir=cache_dir))
+    manager.client = client
+    return manager
+
+
+def test_publish_merges_manifest_after_conflict():
+    client = FakeClient()
+    client.conflicts = 1
+    manager = make_manager(client)
+    manager.load_remote_logs()
+
+    manager.record_entry(entry("mine.mkv"))
+    assert manager.flush() is True
+
+    manifest = Manifest.from_bytes(client.files["logs/processed/manifest.json"])
+    paths = [segment.path for segment in manifest.segments]
+    assert paths[0] == "logs/processed/2024-03/theirs.ndjson" and len(paths) == 2
+    assert manager.head == client.head == "c1"
+    names = [item["old_name"] for path in paths for item in decode_segment(client.files[path])]
+    assert names == ["theirs.mkv", "mine.mkv"]
+
+
+def test_only_uncached_segments_are_fetched(tmp_path):
+    first = encode_segment([entry("a.mkv")])
+    second = encode_segment([entry("b.mkv"), entry("c.mkv")])
+    segments = {"logs/processed/2024-01/first.ndjson": first, "logs/processed/2024-02/second.ndjson": second}
+    files = dict(segments)
+    files["logs/processed/manifest.json"] = Manifest(segments=segment_infos(segments)).to_bytes()
+    client = FakeClient(files)
+    cache_dir = tmp_path / "cache"
+    SegmentCache(cache_dir).put(first)
+
+    manager = make_manager(client, str(cache_dir))
+    entries = manager.load_remote_logs()
+    assert [item["old_name"] for item in entries] == ["a.mkv", "b.mkv", "c.mkv"]
+    segment_requests = [path for path in client.raw_requests if path.endswith(".ndjson")]
+    assert segment_requests == ["logs/processed/2024-02/second.ndjson"]
+    assert SegmentCache(cache_dir).load(sha256_hex(second)) == second  # Segment vừa tải đã vào cache
+
+    client.raw_requests.clear()
+    manager = make_manager(client, str(cache_dir))
+    assert len(manager.load_remote_logs()) == 3
+    assert not [path for path in client.raw_requests if path.endswith(".ndjson")]
+
+
+def test_segment_with_wrong_checksum_is_used_but_not_cached(tmp_path):
+    data = encode_segment([entry("a.mkv")])
+    info = SegmentInfo("logs/processed/2024-01/a.ndjson", 1, sha256_hex(b"other"))
+    client = FakeClient({info.path: data, "logs/processed/manifest.json": Manifest(segments=[info]).to_bytes()})
+    cache_dir = tmp_path / "cache"
+
+    manager = make_manager(client, str(cache_dir))
+    assert [item["old_name"] for item in manager.load_remote_logs()] == ["a.mkv"]
+    assert SegmentCache(cache_dir).load(sha256_hex(data)) is None